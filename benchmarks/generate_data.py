@@ -0,0 +1,134 @@
+"""
+Генератор синтетических файлов доходов и расходов для замеров производительности.
+
+Значения берутся из настоящих справочников (Филиалы.csv, nomen_to_business.csv,
+rashod_bu_to_uu.csv, profile_to_med_direction.csv, subdivision_mapping.csv),
+а статьи затрат УУ проверенных файлов затем проходят сопоставление статей
+отчётов (cost_items_mapping.csv и др.). Поэтому данные идут по тем же веткам
+проверки и группировки, что и файлы филиалов. Доля ошибочных строк задаётся
+параметром error_rate.
+
+Запись в xlsx (см. main) возможна только до 1 048 575 строк - ограничение Excel.
+Для больших размеров замеры используют таблицы в памяти.
+
+    python benchmarks/generate_data.py --kind expense --rows 100000 --output expense.xlsx
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICTIONARIES_DIR = os.path.join(REPO_DIR, "pages", "dictionaries")
+EXCEL_MAX_ROWS = 1048575
+
+def _read(dictionaries_dir, filename):
+    return pd.read_csv(os.path.join(dictionaries_dir, filename), delimiter=";", encoding="utf-8-sig")
+
+def load_reference_data(dictionaries_dir=DICTIONARIES_DIR):
+    """Справочники в виде, в котором их получают функции проверки (см. proverka.py)"""
+    cities = _read(dictionaries_dir, "Филиалы.csv")
+    nomen_business = _read(dictionaries_dir, "nomen_to_business.csv")
+    nomen_service = _read(dictionaries_dir, "nomen_to_service_type.csv")
+    business_counterparty = _read(dictionaries_dir, "business_to_counterparty.csv")
+    profile_direction = _read(dictionaries_dir, "profile_to_med_direction.csv")
+    bu_to_uu = _read(dictionaries_dir, "rashod_bu_to_uu.csv")
+    subdivisions = _read(dictionaries_dir, "subdivision_mapping.csv")
+
+    return {
+        "ref_city": cities["Наименование"].tolist(),
+        "nomen_to_business": dict(zip(nomen_business.iloc[:, 0], nomen_business.iloc[:, 1])),
+        "nomen_to_service_type": dict(zip(nomen_service.iloc[:, 0], nomen_service.iloc[:, 1])),
+        "business_to_counterparty": dict(zip(business_counterparty.iloc[:, 0], business_counterparty.iloc[:, 1])),
+        "profile_to_med_direction": dict(zip(profile_direction.iloc[:, 0], profile_direction.iloc[:, 1])),
+        "rashod_bu_to_uu": dict(zip(bu_to_uu.iloc[:, 0], bu_to_uu.iloc[:, 1])),
+        "subdivision_mapping": dict(zip(subdivisions.iloc[:, 0], subdivisions.iloc[:, 1])),
+    }
+
+def _amounts(rng, rows):
+    # Суммы в рублях с копейками, логнормальное распределение как у реальных проводок
+    return np.round(rng.lognormal(mean=9, sigma=1.5, size=rows), 2)
+
+def _choice(rng, values, rows):
+    values = [v for v in values if isinstance(v, str) and v.strip()]
+    return rng.choice(np.array(values, dtype=object), size=rows)
+
+def _corrupt(rng, df, column, error_rate, bad_value):
+    mask = rng.random(len(df)) < error_rate
+    df.loc[mask, column] = bad_value
+    return mask
+
+def generate_income(rows, refs, error_rate=0.0, seed=0):
+    """Файл доходов в формате шаблона страницы проверки доходов"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Филиал": _choice(rng, refs["ref_city"], rows),
+        "Сумма": _amounts(rng, rows).astype(object),
+        "Номенклатурная группа": _choice(rng, list(refs["nomen_to_business"]), rows),
+        "Профиль": _choice(rng, list(refs["profile_to_med_direction"]), rows),
+    })
+    if error_rate:
+        per_column = error_rate / 3
+        _corrupt(rng, df, "Филиал", per_column, "г.Неизвестный")
+        _corrupt(rng, df, "Номенклатурная группа", per_column, "Неизвестная номенклатура")
+        _corrupt(rng, df, "Сумма", per_column, "сто рублей")
+    return df
+
+def generate_expense(rows, refs, error_rate=0.0, seed=0, management_share=0.3):
+    """Файл расходов в формате шаблона страницы проверки расходов"""
+    rng = np.random.default_rng(seed)
+    nomen = _choice(rng, list(refs["nomen_to_business"]), rows)
+    nomen[rng.random(rows) < management_share] = np.nan
+
+    df = pd.DataFrame({
+        "Филиал": _choice(rng, refs["ref_city"], rows),
+        "Сумма": _amounts(rng, rows).astype(object),
+        "Подразделение": _choice(rng, list(refs["subdivision_mapping"]), rows),
+        "Номенклатурная группа": nomen,
+        "Профиль": _choice(rng, list(refs["profile_to_med_direction"]), rows),
+        "Статья затрат БУ": _choice(rng, list(refs["rashod_bu_to_uu"]), rows),
+        "НД": rng.integers(0, 2, size=rows).astype(object),
+    })
+    if error_rate:
+        per_column = error_rate / 4
+        _corrupt(rng, df, "Филиал", per_column, "г.Неизвестный")
+        _corrupt(rng, df, "Статья затрат БУ", per_column, "Неизвестная статья")
+        _corrupt(rng, df, "Сумма", per_column, "сто рублей")
+        _corrupt(rng, df, "НД", per_column, "да")
+    return df
+
+def generate_validated_expense(rows, refs, seed=0):
+    """Проверенный файл расходов (со статьёй затрат УУ) - вход для отчётов"""
+    df = generate_expense(rows, refs, seed=seed)
+    df["Сумма"] = df["Сумма"].astype(float)
+    df["НД"] = df["НД"].astype(int)
+    df["Статья затрат УУ"] = df["Статья затрат БУ"].map(refs["rashod_bu_to_uu"])
+    df["Бизнес-направление"] = df["Номенклатурная группа"].map(refs["nomen_to_business"]).fillna("управление")
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетического файла доходов или расходов")
+    parser.add_argument("--kind", choices=["income", "expense", "validated_expense"], default="expense")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dictionaries", default=DICTIONARIES_DIR)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    if args.rows > EXCEL_MAX_ROWS:
+        parser.error(f"Excel вмещает не более {EXCEL_MAX_ROWS} строк данных")
+
+    refs = load_reference_data(args.dictionaries)
+    if args.kind == "income":
+        df = generate_income(args.rows, refs, args.error_rate, args.seed)
+    elif args.kind == "expense":
+        df = generate_expense(args.rows, refs, args.error_rate, args.seed)
+    else:
+        df = generate_validated_expense(args.rows, refs, args.seed)
+    df.to_excel(args.output, index=False)
+    print(f"{args.output}: {len(df)} строк")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Нагрузочный прогон страниц приложения: N одновременных сессий Streamlit без браузера
+(streamlit.testing AppTest). Каждая сессия по кругу выполняет действия пользователей:
+
+    проверка доходов    - загрузка файла на странице "Доход План Факт" и "Проверить файл"
+    проверка расходов   - то же на странице "Расход План Факт"
+    смета               - загрузка плана и факта на странице "Отчеты" и ожидание фоновой задачи
+    справочник          - вход администратора и добавление записи в справочник
+
+Для каждого действия выводятся p50/p95 задержки (от нажатия кнопки до готовой страницы),
+для процесса - рост памяти (RSS) за прогон. Сессии работают в одном процессе, как на
+сервере Streamlit, и делят общий пул фоновых задач (jobs.py).
+
+AppTest не умеет загружать файлы, поэтому st.file_uploader на время прогона заменяется:
+он возвращает заранее сгенерированный файл (generate_data.py), положенный в состояние
+сессии под ключом LOADTEST_UPLOADS. Кроме того, AppTest всегда перезапускает страницу
+целиком, а st.rerun(scope="fragment") допустим только при перезапуске фрагмента, поэтому
+на время прогона он перезапускает страницу. Остальной код страниц выполняется как есть.
+
+AppTest подставляет общий для процесса объект Runtime на время запуска страницы, поэтому
+запуски страниц разных сессий идут по очереди (RUN_LOCK), как потоки сервера под GIL.
+Фоновые задачи (формирование отчётов) при этом выполняются параллельно в общем пуле,
+а задержка действия включает ожидание очереди.
+
+Справочники, агрегаты и журналы пишутся во временный домашний каталог, рабочие
+файлы в Documents/medisapp не затрагиваются.
+
+    python benchmarks/load_test.py --sessions 8 --iterations 5 --rows 2000 --output load.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime
+from io import BytesIO
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_DIR = os.getcwd()
+sys.path.insert(0, REPO_DIR)
+# Страницы читают справочники статей затрат отчётов из текущего каталога
+os.chdir(REPO_DIR)
+
+# Каталог данных приложения (Path.home()/Documents/medisapp) подменяется до импорта его модулей
+HOME_DIR = tempfile.mkdtemp(prefix="medisapp_load_")
+os.environ["HOME"] = HOME_DIR
+os.environ["USERPROFILE"] = HOME_DIR
+
+import numpy as np
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import generate_data
+import proverka
+
+PASSWORD = "34medisadmin"
+LOADTEST_UPLOADS = "_loadtest_uploads"
+PAGES = {
+    "income": os.path.join("pages", "1_Доход План Факт.py"),
+    "expense": os.path.join("pages", "2_Расход План Факт.py"),
+    "reports": os.path.join("pages", "3_Отчеты.py"),
+}
+SCENARIOS = ["проверка доходов", "проверка расходов", "смета", "справочник"]
+
+class SimulatedUpload(BytesIO):
+    """Загруженный файл в том виде, в каком его видят страницы (name, size, getvalue)"""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _simulated_file_uploader(label, *args, key=None, accept_multiple_files=False, **kwargs):
+    uploads = st.session_state.get(LOADTEST_UPLOADS, {})
+    files = uploads.get(key or label)
+    if not files:
+        return [] if accept_multiple_files else None
+    # Каждый запуск страницы получает свежие объекты - страницы читают файл с начала
+    files = [SimulatedUpload(name, data) for name, data in files]
+    return files if accept_multiple_files else files[0]
+
+_original_rerun = st.rerun
+
+def _simulated_rerun(*, scope="app"):
+    _original_rerun()
+
+def _rss_mb():
+    """Текущий RSS процесса (Linux); на других системах - None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemorySampler(threading.Thread):
+    """Замеряет RSS раз в interval секунд в течение прогона"""
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = _rss_mb()
+            if rss is not None:
+                self.samples.append((time.perf_counter(), rss))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _xlsx(df):
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+def prepare_files(rows, seed):
+    """Файлы, которые сессии "загружают": исходные доходы/расходы и проверенные план/факт"""
+    refs = generate_data.load_reference_data()
+    files = {
+        "income": ("income.xlsx", _xlsx(generate_data.generate_income(rows, refs, seed=seed))),
+        "expense": ("expense.xlsx", _xlsx(generate_data.generate_expense(rows, refs, seed=seed))),
+    }
+    # План и факт - обработанные файлы в том виде, в каком их выдаёт страница проверки расходов
+    for kind, offset in (("plan", 1), ("fact", 2)):
+        df = generate_data.generate_validated_expense(rows, refs, seed=seed + offset)
+        files[kind] = (f"{kind}.xlsx", proverka.processed_file(df, "Январь", 2025))
+    return files
+
+RUN_LOCK = threading.Lock()
+
+def _run(element_or_app):
+    """Запускает страницу (at.run() или click().run()) в очереди запусков"""
+    with RUN_LOCK:
+        return element_or_app.run()
+
+def _label(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"Не найден элемент '{label}'")
+
+def _check_exceptions(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+class Session:
+    """Одна сессия пользователя: свои экземпляры страниц и свои загруженные файлы"""
+
+    def __init__(self, number, files, timeout):
+        self.number = number
+        self.files = files
+        self.timeout = timeout
+        self.apps = {}
+        self.counter = 0
+
+    def app(self, page):
+        if page not in self.apps:
+            at = AppTest.from_file(PAGES[page], default_timeout=self.timeout)
+            at.session_state[LOADTEST_UPLOADS] = {}
+            _run(at)
+            _check_exceptions(at)
+            self.apps[page] = at
+        return self.apps[page]
+
+    def check_file(self, page, kind):
+        at = self.app(page)
+        at.session_state[LOADTEST_UPLOADS] = {"Выберите Excel файл": [self.files[kind]]}
+        start = time.perf_counter()
+        _run(_label(at.button, "Проверить файл").click())
+        # Большой файл проверяется в фоне - опрашиваем страницу, пока виден индикатор
+        while at.get("progress"):
+            _check_exceptions(at)
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError("Файл не проверен за отведённое время")
+            time.sleep(0.2)
+            _run(at)
+        elapsed = time.perf_counter() - start
+        _check_exceptions(at)
+        # Итог проверки (успех или список ошибок) должен появиться на странице
+        if not at.success and not at.error:
+            raise RuntimeError("Страница не показала результат проверки")
+        return elapsed
+
+    def smeta(self):
+        at = self.app("reports")
+        at.session_state[LOADTEST_UPLOADS] = {"plan_file": [self.files["plan"]], "fact_file": [self.files["fact"]]}
+        start = time.perf_counter()
+        _run(_label(at.button, "Сформировать отчёт").click())
+        # Опрос страницы вместо фрагмента с run_every, как это делает браузер
+        while not any("Сформирован" in s.value for s in at.success):
+            _check_exceptions(at)
+            if at.error:
+                raise RuntimeError(at.error[0].value)
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError("Отчёт не сформирован за отведённое время")
+            time.sleep(0.2)
+            _run(at)
+        return time.perf_counter() - start
+
+    def edit_dictionary(self):
+        at = self.app("income")
+        if not at.session_state["password_verified"]:
+            _label(at.text_input, "Пароль:").input(PASSWORD)
+            _run(_label(at.button, "Войти").click())
+            _check_exceptions(at)
+
+        self.counter += 1
+        _label(at.text_input, "Номенклатурная группа").input(f"Нагрузка {self.number}-{self.counter}")
+        _label(at.text_input, "Бизнес-направление").input("Нагрузочный тест")
+        start = time.perf_counter()
+        _run(_label(at.button, "Добавить").click())
+        elapsed = time.perf_counter() - start
+        _check_exceptions(at)
+        return elapsed
+
+    def run_scenario(self, scenario):
+        if scenario == "проверка доходов":
+            return self.check_file("income", "income")
+        if scenario == "проверка расходов":
+            return self.check_file("expense", "expense")
+        if scenario == "смета":
+            return self.smeta()
+        if scenario == "справочник":
+            return self.edit_dictionary()
+        raise ValueError(f"Неизвестное действие: {scenario}")
+
+def _session_worker(session, scenarios, iterations, latencies, errors, lock):
+    for iteration in range(iterations):
+        # Сессии начинают с разных действий, чтобы нагрузка была смешанной
+        for i in range(len(scenarios)):
+            scenario = scenarios[(session.number + iteration + i) % len(scenarios)]
+            try:
+                elapsed = session.run_scenario(scenario)
+            except Exception as e:
+                with lock:
+                    errors.append({"session": session.number, "scenario": scenario, "error": str(e)})
+                continue
+            with lock:
+                latencies.setdefault(scenario, []).append(elapsed)
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+def copy_dictionaries():
+    target = os.path.join(HOME_DIR, "Documents", "medisapp", "dictionaries")
+    os.makedirs(target, exist_ok=True)
+    for filename in os.listdir(generate_data.DICTIONARIES_DIR):
+        if filename.endswith(".csv"):
+            shutil.copy(os.path.join(generate_data.DICTIONARIES_DIR, filename), target)
+
+def run(args):
+    scenarios = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    copy_dictionaries()
+    files = prepare_files(args.rows, args.seed)
+    st.file_uploader = _simulated_file_uploader
+    st.rerun = _simulated_rerun
+
+    sessions = [Session(number, files, args.timeout) for number in range(args.sessions)]
+    latencies, errors, lock = {}, [], threading.Lock()
+
+    sampler = MemorySampler()
+    start_rss = _rss_mb()
+    sampler.start()
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=_session_worker, args=(session, scenarios, args.iterations, latencies, errors, lock))
+        for session in sessions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    sampler.stop()
+    end_rss = _rss_mb()
+
+    results = []
+    for scenario in scenarios:
+        values = latencies.get(scenario, [])
+        results.append({
+            "scenario": scenario,
+            "count": len(values),
+            "p50_s": round(_percentile(values, 50), 4) if values else None,
+            "p95_s": round(_percentile(values, 95), 4) if values else None,
+            "max_s": round(max(values), 4) if values else None,
+            "mean_s": round(statistics.mean(values), 4) if values else None,
+        })
+
+    memory = {}
+    if start_rss is not None:
+        memory = {
+            "start_mb": round(start_rss, 1),
+            "end_mb": round(end_rss, 1),
+            "peak_mb": round(max(rss for _, rss in sampler.samples), 1) if sampler.samples else None,
+            "growth_mb": round(end_rss - start_rss, 1),
+        }
+
+    print(f"{'Действие':20} {'кол-во':>7} {'p50, с':>9} {'p95, с':>9} {'макс, с':>9}")
+    for r in results:
+        if r["count"]:
+            print(f"{r['scenario']:20} {r['count']:>7} {r['p50_s']:>9.3f} {r['p95_s']:>9.3f} {r['max_s']:>9.3f}")
+        else:
+            print(f"{r['scenario']:20} {0:>7} {'-':>9} {'-':>9} {'-':>9}")
+    if memory:
+        print(f"Память (RSS): {memory['start_mb']} -> {memory['end_mb']} МБ, пик {memory['peak_mb']} МБ, рост {memory['growth_mb']} МБ")
+    if errors:
+        print(f"Ошибок: {len(errors)}")
+        for error in errors[:10]:
+            print(f"  сессия {error['session']}, {error['scenario']}: {error['error']}")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "parameters": {
+            "sessions": args.sessions,
+            "iterations": args.iterations,
+            "rows": args.rows,
+            "scenarios": scenarios,
+            "seed": args.seed,
+        },
+        "duration_s": round(duration, 2),
+        "results": results,
+        "memory": memory,
+        "memory_samples": [(round(t - started, 2), round(rss, 1)) for t, rss in sampler.samples],
+        "errors": errors,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон страниц: одновременные сессии Streamlit")
+    parser.add_argument("--sessions", type=int, default=4, help="число одновременных сессий")
+    parser.add_argument("--iterations", type=int, default=3, help="сколько раз каждая сессия проходит все действия")
+    parser.add_argument("--rows", type=int, default=1000, help="строк в загружаемых файлах")
+    parser.add_argument("--scenarios", default="", help=f"действия через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--timeout", type=float, default=300, help="предельное время одного действия, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-home", action="store_true", help="не удалять временный каталог данных")
+    parser.add_argument("--output", default="load_results.json")
+    args = parser.parse_args()
+    args.output = os.path.join(START_DIR, args.output)
+
+    try:
+        run(args)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        if args.keep_home:
+            print(f"Данные прогона: {HOME_DIR}")
+        else:
+            shutil.rmtree(HOME_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
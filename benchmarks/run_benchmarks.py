@@ -0,0 +1,194 @@
+"""
+Замеры производительности: проверка файлов, create_report / create_admin_report,
+сводный отчёт и выгрузка в Excel на синтетических данных (см. generate_data.py).
+
+Каждый этап замеряется отдельно; результат записывается в JSON вместе с версиями
+Python/pandas и текущим коммитом, чтобы прогоны можно было сравнивать.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --output bench.json
+    python benchmarks/run_benchmarks.py --stages create_report --sizes 1000000,5000000 --output big.json
+    python benchmarks/run_benchmarks.py --compare bench_old.json bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_DIR = os.getcwd()
+sys.path.insert(0, REPO_DIR)
+# Справочники статей затрат отчётов читаются из текущего каталога
+os.chdir(REPO_DIR)
+
+import numpy as np
+import pandas as pd
+
+import generate_data
+import otchety
+import proverka
+
+STAGES = [
+    "validation_income",
+    "validation_expense",
+    "export_processed",
+    "create_report",
+    "create_admin_report",
+    "save_to_excel",
+    "consolidation",
+]
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "commit": commit,
+    }
+
+def measure(fn, repeat, memory):
+    """Минимальное и медианное время из repeat запусков; пиковая память - отдельным запуском"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    result = {"min_s": round(min(times), 4), "median_s": round(statistics.median(times), 4)}
+    if memory:
+        tracemalloc.start()
+        fn()
+        result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return result
+
+def stage_functions(stage, rows, refs, args):
+    """Готовит входные данные этапа (вне замера) и возвращает замеряемую функцию"""
+    if stage == "validation_income":
+        df = generate_data.generate_income(rows, refs, args.error_rate, args.seed)
+        return lambda: proverka.check_dataframe(df.copy(), "income", refs)
+
+    if stage == "validation_expense":
+        df = generate_data.generate_expense(rows, refs, args.error_rate, args.seed)
+        return lambda: proverka.check_dataframe(df.copy(), "expense", refs)
+
+    if stage == "export_processed":
+        if rows > generate_data.EXCEL_MAX_ROWS:
+            return None
+        df = generate_data.generate_validated_expense(rows, refs, args.seed)
+        return lambda: proverka.processed_file(df, "Январь", 2025)
+
+    if stage in ("create_report", "create_admin_report", "save_to_excel"):
+        plan_df = generate_data.generate_validated_expense(rows, refs, args.seed)
+        fact_df = generate_data.generate_validated_expense(rows, refs, args.seed + 1)
+        if stage == "create_report":
+            return lambda: otchety.create_report(plan_df, fact_df)
+        if stage == "create_admin_report":
+            return lambda: otchety.create_admin_report(plan_df, fact_df)
+        report_df, _ = otchety.create_report(plan_df, fact_df)
+        return lambda: otchety.save_to_excel(report_df, "01.01.2025 – 31.01.2025")
+
+    if stage == "consolidation":
+        # Выгрузки отчётов филиалов (по rows строк расходов в каждом), как их загружают во вкладку "Сводный отчет"
+        files = []
+        for i in range(args.files):
+            plan_df = generate_data.generate_validated_expense(rows, refs, args.seed + 2 * i)
+            fact_df = generate_data.generate_validated_expense(rows, refs, args.seed + 2 * i + 1)
+            report_df, _ = otchety.create_report(plan_df, fact_df)
+            files.append((f"report_{i}.xlsx", otchety.save_to_excel(report_df, "01.01.2025 – 31.01.2025")))
+
+        def consolidate():
+            dfs = otchety.read_excel_files([BytesIO(data) for _, data in files])
+            return otchety.consolidate_reports(zip([name for name, _ in files], dfs))
+        return consolidate
+
+    raise ValueError(f"Неизвестный этап: {stage}")
+
+def run(args):
+    refs = generate_data.load_reference_data(args.dictionaries)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    stages = args.stages.split(",") if args.stages else STAGES
+
+    results = []
+    for stage in stages:
+        for rows in sizes:
+            fn = stage_functions(stage, rows, refs, args)
+            if fn is None:
+                print(f"{stage:22} {rows:>10} пропущен (больше строк, чем вмещает Excel)")
+                continue
+            try:
+                timing = measure(fn, args.repeat, args.memory)
+            except Exception as e:
+                print(f"{stage:22} {rows:>10} ошибка: {e}")
+                results.append({"stage": stage, "rows": rows, "error": str(e)})
+                continue
+            record = {"stage": stage, "rows": rows, "repeat": args.repeat, **timing}
+            record["rows_per_s"] = round(rows / timing["median_s"]) if timing["median_s"] else None
+            results.append(record)
+            print(f"{stage:22} {rows:>10} {timing['median_s']:>10.4f} с")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "parameters": {
+            "sizes": sizes,
+            "stages": stages,
+            "error_rate": args.error_rate,
+            "repeat": args.repeat,
+            "files": args.files,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+def compare(old_path, new_path):
+    """Печатает медианное время двух прогонов и их отношение по каждому этапу и размеру"""
+    def load(path):
+        with open(path, encoding="utf-8") as f:
+            results = json.load(f)["results"]
+        return pd.DataFrame([r for r in results if "median_s" in r])[["stage", "rows", "median_s"]]
+
+    merged = pd.merge(load(old_path), load(new_path), on=["stage", "rows"], suffixes=("_old", "_new"))
+    merged["ratio"] = (merged["median_s_new"] / merged["median_s_old"]).round(3)
+    print(merged.to_string(index=False))
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности на синтетических данных")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="число строк через запятую (до 5000000)")
+    parser.add_argument("--stages", default="", help=f"этапы через запятую: {', '.join(STAGES)}")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="доля строк с ошибками в проверяемых файлах")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--files", type=int, default=30, help="число отчётов для сводного отчёта")
+    parser.add_argument("--memory", action="store_true", help="дополнительно замерить пиковую память (tracemalloc)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dictionaries", default=generate_data.DICTIONARIES_DIR)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    args = parser.parse_args()
+
+    # Пути из командной строки - относительно каталога запуска
+    args.output = os.path.join(START_DIR, args.output)
+    args.dictionaries = os.path.join(START_DIR, args.dictionaries)
+    if args.compare:
+        compare(*(os.path.join(START_DIR, path) for path in args.compare))
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
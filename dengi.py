@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+# Денежные суммы внутри расчётов хранятся в копейках (int64).
+# Целые складываются точно, поэтому итоги по плану, факту и сводным отчётам
+# не накапливают погрешность float, а суммирование остаётся векторным.
+# В рубли (float) суммы переводятся только для показа и выгрузки в Excel.
+
+KOPECKS = 100
+
+def to_kopecks(values):
+    """
+    Переводит суммы в рублях (числа или строки) в копейки.
+    Возвращает Series типа Int64: пустые, нечисловые и бесконечные значения - <NA>.
+    """
+    numbers = pd.to_numeric(pd.Series(values), errors="coerce").astype("float64")
+    finite = np.isfinite(numbers.to_numpy())
+    kopecks = np.zeros(len(numbers), dtype="int64")
+    kopecks[finite] = np.round(numbers.to_numpy()[finite] * KOPECKS).astype("int64")
+    return pd.Series(pd.arrays.IntegerArray(kopecks, ~finite), index=numbers.index)
+
+def invalid_amounts(values):
+    """Маска заполненных значений, которые не являются числом"""
+    values = pd.Series(values)
+    return values.notna() & to_kopecks(values).isna()
+
+def amount_column(values):
+    """Копейки int64 для суммирования: пустые и нечисловые значения считаются нулём"""
+    return to_kopecks(values).fillna(0).astype("int64")
+
+def to_rubles(kopecks):
+    """Копейки -> рубли (float) для показа и выгрузки"""
+    return kopecks / KOPECKS
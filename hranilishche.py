@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+# Общее для всех сессий хранилище загруженных таблиц и выгрузок (xlsx).
+# В памяти держится не больше MEMORY_BUDGET байт: при превышении давно не
+# использованные данные любых сессий сбрасываются на диск (таблицы - в parquet,
+# файлы - как есть) и прозрачно читаются обратно при следующем обращении.
+# Пока значение пишется на диск, оно остаётся доступным из памяти.
+# Данные, к которым не обращались ITEM_TTL секунд, удаляются; данные закрытой
+# сессии - через SESSION_GRACE секунд после закрытия.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+SPILL_DIR = os.path.join(base_dir, "spill")
+MEMORY_BUDGET = int(os.environ.get("MEDISAPP_MEMORY_MB", 512)) * 2 ** 20
+# Значения меньше этого размера хранятся прямо в состоянии сессии
+MIN_ITEM_SIZE = 64 * 2 ** 10
+ITEM_TTL = 2 * 60 * 60
+# После разрыва соединения Streamlit некоторое время позволяет вернуться в ту же сессию
+SESSION_GRACE = 5 * 60
+
+class Ref:
+    """Ссылка на значение в хранилище (вместо самого значения)"""
+    __slots__ = ("id",)
+
+    def __init__(self, item_id):
+        self.id = item_id
+
+    def __repr__(self):
+        return f"Ref({self.id})"
+
+class _Item:
+    def __init__(self, owner, value, size):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.value = value
+        self.size = size
+        self.is_frame = isinstance(value, pd.DataFrame)
+        self.path = None
+        self.spilling = False
+        self.last_used = time.time()
+
+_lock = threading.Lock()
+_items = OrderedDict()
+_in_memory = 0
+# Сессии, которые оказались неактивными: {сессия: когда это обнаружено}
+_closed = {}
+
+def _size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return len(value)
+
+def put(owner, value):
+    """Кладёт таблицу (DataFrame) или файл (bytes) в хранилище, возвращает идентификатор"""
+    global _in_memory
+    item = _Item(owner, value, _size(value))
+    with _lock:
+        _cleanup()
+        _items[item.id] = item
+        _in_memory += item.size
+    _evict()
+    return item.id
+
+def get(item_id):
+    """Значение по идентификатору (с чтением с диска, если оно было сброшено); None, если удалено"""
+    global _in_memory
+    with _lock:
+        _cleanup()
+        item = _items.get(item_id)
+        if item is None:
+            return None
+        item.last_used = time.time()
+        _items.move_to_end(item_id)
+        if item.value is not None:
+            return item.value
+        path = item.path
+
+    try:
+        value = _load(path)
+    except OSError:
+        # Значение удалили, пока оно читалось
+        return None
+    with _lock:
+        if item.value is None and item_id in _items:
+            item.value = value
+            _in_memory += item.size
+    _evict()
+    return value
+
+def release(item_id):
+    """Удаляет значение из памяти и с диска"""
+    global _in_memory
+    with _lock:
+        item = _items.pop(item_id, None)
+        if item is None:
+            return
+        if item.value is not None:
+            _in_memory -= item.size
+    _remove_file(item.path)
+
+def release_owner(owner):
+    """Удаляет все значения сессии"""
+    with _lock:
+        item_ids = [item.id for item in _items.values() if item.owner == owner]
+    for item_id in item_ids:
+        release(item_id)
+
+def usage():
+    """Сколько данных в памяти и на диске"""
+    with _lock:
+        _cleanup()
+        spilled = [item for item in _items.values() if item.value is None]
+        return {
+            "items": len(_items),
+            "memory_bytes": _in_memory,
+            "budget_bytes": MEMORY_BUDGET,
+            "spilled_items": len(spilled),
+            "spilled_bytes": sum(item.size for item in spilled),
+        }
+
+def _evict():
+    """Сбрасывает на диск давно не использованные значения, пока память не уложится в бюджет"""
+    global _in_memory
+    with _lock:
+        excess = _in_memory - MEMORY_BUDGET
+        victims = []
+        # _items упорядочен от давно использованных к недавним
+        for item in _items.values():
+            if excess <= 0:
+                break
+            if item.value is not None and not item.spilling:
+                item.spilling = True
+                victims.append(item)
+                excess -= item.size
+
+    # Запись на диск - вне блокировки, чтобы не задерживать другие сессии
+    for item in victims:
+        try:
+            path = _spill(item)
+        except OSError:
+            # Нет места на диске - значение остаётся в памяти
+            path = None
+        with _lock:
+            item.spilling = False
+            if item.id in _items and item.value is not None and path is not None:
+                item.path = path
+                item.value = None
+                _in_memory -= item.size
+                path = None
+        # Значение удалили, пока шла запись
+        _remove_file(path)
+
+def _spill(item):
+    # Значения неизменяемы: прочитанное с диска повторно не записываем
+    if item.path is not None:
+        return item.path
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    value = item.value
+    if value is None:
+        return None
+    if item.is_frame:
+        path = os.path.join(SPILL_DIR, f"{item.id}.parquet")
+        try:
+            value.to_parquet(path)
+        except Exception:
+            # Столбцы со смешанными типами (например, непроверенные суммы) parquet не сохраняет
+            _remove_file(path)
+            path = os.path.join(SPILL_DIR, f"{item.id}.pkl")
+            value.to_pickle(path)
+    else:
+        path = os.path.join(SPILL_DIR, f"{item.id}.bin")
+        Path(path).write_bytes(value)
+    return path
+
+def _load(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".pkl"):
+        return pd.read_pickle(path)
+    return Path(path).read_bytes()
+
+def _remove_file(path):
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _cleanup():
+    """Удаляет значения, к которым не обращались более ITEM_TTL секунд (вызывается под блокировкой)"""
+    global _in_memory
+    now = time.time()
+    for item in [item for item in _items.values() if now - item.last_used > ITEM_TTL]:
+        del _items[item.id]
+        if item.value is not None:
+            _in_memory -= item.size
+        _remove_file(item.path)
+
+# --- Словари значений (результаты задач, результаты проверки) ---
+
+def put_values(owner, values):
+    """Заменяет крупные таблицы и файлы в словаре ссылками на хранилище"""
+    if not isinstance(values, dict):
+        return values
+    stored = {}
+    for key, value in values.items():
+        if isinstance(value, (pd.DataFrame, bytes)) and _size(value) >= MIN_ITEM_SIZE:
+            value = Ref(put(owner, value))
+        stored[key] = value
+    return stored
+
+def get_values(values):
+    """Словарь с подставленными значениями вместо ссылок; None, если часть данных уже удалена"""
+    if not isinstance(values, dict):
+        return values
+    loaded = {}
+    for key, value in values.items():
+        if isinstance(value, Ref):
+            value = get(value.id)
+            if value is None:
+                return None
+        loaded[key] = value
+    return loaded
+
+def release_values(values):
+    if isinstance(values, dict):
+        for value in values.values():
+            if isinstance(value, Ref):
+                release(value.id)
+
+# --- Интерфейс Streamlit ---
+
+def session_put(key, values):
+    """Сохраняет словарь значений текущей сессии под ключом key (прежние данные удаляются)"""
+    import streamlit as st
+    from jobs import session_owner
+
+    release_closed_sessions()
+    release_values(st.session_state.get(f"data_{key}"))
+    st.session_state[f"data_{key}"] = put_values(session_owner(), values)
+
+def session_get(key):
+    """Словарь значений сессии под ключом key или None"""
+    import streamlit as st
+
+    values = st.session_state.get(f"data_{key}")
+    return None if values is None else get_values(values)
+
+def release_closed_sessions():
+    """Удаляет значения сессий, закрытых больше SESSION_GRACE секунд назад (release_owner)"""
+    from streamlit.runtime import Runtime
+
+    if not Runtime.exists():
+        return
+    runtime = Runtime.instance()
+    now = time.time()
+    with _lock:
+        owners = {item.owner for item in _items.values()}
+    active = {owner for owner in owners if runtime.is_active_session(owner)}
+    with _lock:
+        for owner in list(_closed):
+            if owner in active or owner not in owners:
+                del _closed[owner]
+        for owner in owners - active:
+            _closed.setdefault(owner, now)
+        expired = [owner for owner, since in _closed.items() if now - since > SESSION_GRACE]
+        for owner in expired:
+            del _closed[owner]
+    for owner in expired:
+        release_owner(owner)
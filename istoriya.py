@@ -0,0 +1,191 @@
+import getpass
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# История справочников.
+# Версия справочника - хэш его содержимого (строки без учёта порядка), поэтому
+# одинаковое содержимое всегда даёт одну версию. Каждое сохранение дописывает
+# в журнал history/<файл>.jsonl одну строку: кто и когда сохранил, какие строки
+# добавлены и удалены. Первая запись и каждая SNAPSHOT_EVERY-я хранят справочник
+# целиком, остальные - только изменения; по ним восстанавливается любая прошлая версия.
+# Сам CSV остаётся текущей версией, которую читают страницы и отчёты.
+# Модуль не зависит от Streamlit.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+HISTORY_DIR = os.path.join(base_dir, "dictionaries", "history")
+# Как часто сохранять справочник целиком (ограничивает длину восстановления)
+SNAPSHOT_EVERY = 50
+
+_lock = threading.Lock()
+_versions = {}
+# Конец журнала по справочнику: {путь: (метка файла журнала, версия, число записей, столбцы)} -
+# сохранение дописывает запись без разбора всего журнала
+_tips = {}
+
+def _rows(df):
+    """Строки таблицы как списки строк (пустые значения - None)"""
+    values = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+    return [[None if value is None else str(value) for value in row] for row in values]
+
+def content_hash(df):
+    """Версия содержимого справочника (не зависит от порядка строк)"""
+    lines = sorted(json.dumps(row, ensure_ascii=False) for row in _rows(df))
+    digest = hashlib.sha256(json.dumps(list(map(str, df.columns)), ensure_ascii=False).encode("utf-8"))
+    for line in lines:
+        digest.update(b"\n" + line.encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def _read_csv(path, sep):
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, delimiter=sep)
+
+def file_version(path, sep=";"):
+    """Версия справочника в файле (пересчитывается только после изменения файла); None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _versions.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    version = content_hash(_read_csv(path, sep))
+    with _lock:
+        _versions[path] = (stamp, version)
+    return version
+
+def file_versions(paths, sep=";"):
+    """Версии нескольких справочников {имя файла: версия} - метка для отчётов и наборов"""
+    return {os.path.basename(path): file_version(path, sep) for path in paths}
+
+def _log_path(path):
+    return os.path.join(HISTORY_DIR, os.path.basename(path) + ".jsonl")
+
+def _read_log(path):
+    log_path = _log_path(path)
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _log_stamp(path):
+    try:
+        stat = os.stat(_log_path(path))
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _append(path, entry, count):
+    """Дописывает запись в журнал; count - число записей в журнале после неё"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    with open(_log_path(path), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    _tips[path] = (_log_stamp(path), entry["version"], count, entry["columns"])
+
+def _tip(path):
+    """(версия, число записей, столбцы) последней записи журнала; журнал читается, только если он изменён не через record()"""
+    cached = _tips.get(path)
+    stamp = _log_stamp(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1:]
+    log = _read_log(path)
+    tip = (log[-1]["version"], len(log), log[-1]["columns"]) if log else (None, 0, None)
+    _tips[path] = (stamp,) + tip
+    return tip
+
+def _entry(version, parent, columns, note, author=None):
+    return {
+        "version": version,
+        "parent": parent,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "author": author or getpass.getuser(),
+        "note": note,
+        "columns": list(map(str, columns)),
+    }
+
+def record(path, old_df, new_df, note="", author=None):
+    """
+    Дописывает сохранение справочника в журнал.
+    old_df - содержимое до сохранения (None, если файла не было). Возвращает новую версию.
+    Если old_df не совпадает с последней версией журнала (справочник сохранили из другой сессии
+    или правили вручную), изменения относительно неё неизвестны - запись хранит справочник целиком.
+    """
+    new_version = content_hash(new_df)
+    with _lock:
+        parent, count, columns = _tip(path)
+        old_version = content_hash(old_df) if old_df is not None else None
+        if count == 0 and old_df is not None:
+            # Справочник до начала ведения истории - исходный снимок
+            base = _entry(old_version, None, old_df.columns, "версия до начала истории")
+            base["snapshot"] = _rows(old_df)
+            count += 1
+            _append(path, base, count)
+            parent, columns = old_version, base["columns"]
+
+        if parent == new_version:
+            return new_version
+
+        entry = _entry(new_version, parent, new_df.columns, note, author)
+        old_rows = Counter(map(tuple, _rows(old_df))) if old_df is not None else Counter()
+        new_rows = Counter(map(tuple, _rows(new_df)))
+        entry["added"] = [list(row) for row in (new_rows - old_rows).elements()]
+        entry["removed"] = [list(row) for row in (old_rows - new_rows).elements()]
+        if count % SNAPSHOT_EVERY == 0 or old_version != parent or entry["columns"] != columns:
+            entry["snapshot"] = _rows(new_df)
+        _append(path, entry, count + 1)
+    return new_version
+
+def history(path):
+    """Сохранённые версии справочника, новые первыми (без самих строк)"""
+    entries = []
+    for entry in reversed(_read_log(path)):
+        removed_keys = {row[0] for row in entry.get("removed", [])}
+        added_keys = {row[0] for row in entry.get("added", [])}
+        entries.append({
+            "version": entry["version"],
+            "time": entry["time"],
+            "author": entry["author"],
+            "note": entry["note"],
+            "added": len(added_keys - removed_keys),
+            "removed": len(removed_keys - added_keys),
+            "changed": len(added_keys & removed_keys),
+        })
+    return entries
+
+def reconstruct(path, version):
+    """Содержимое справочника в версии version (DataFrame); None, если такой версии нет в журнале"""
+    log = _read_log(path)
+    target = next((i for i in range(len(log) - 1, -1, -1) if log[i]["version"] == version), None)
+    if target is None:
+        return None
+    start = max(i for i in range(target + 1) if "snapshot" in log[i])
+
+    rows = [tuple(row) for row in log[start]["snapshot"]]
+    for entry in log[start + 1:target + 1]:
+        removed = Counter(map(tuple, entry["removed"]))
+        kept = []
+        for row in rows:
+            if removed[row]:
+                removed[row] -= 1
+            else:
+                kept.append(row)
+        rows = kept + [tuple(row) for row in entry["added"]]
+    return pd.DataFrame(rows, columns=log[target]["columns"])
+
+def version_at(path, moment):
+    """Версия справочника, действовавшая в момент moment (datetime); None, если история начинается позже"""
+    version = None
+    for entry in _read_log(path):
+        if datetime.fromisoformat(entry["time"]) > moment:
+            break
+        version = entry["version"]
+    return version
@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+import hranilishche
+
+# Общий для всех сессий пул фоновых задач.
+# Одна сессия не может занять больше MAX_JOBS_PER_SESSION потоков, а очереди
+# разных сессий обслуживаются по кругу - тяжёлые отчёты одного пользователя
+# не блокируют остальных.
+MAX_WORKERS = int(os.environ.get("MEDISAPP_JOB_WORKERS", 4))
+MAX_JOBS_PER_SESSION = int(os.environ.get("MEDISAPP_JOBS_PER_SESSION", 2))
+# Сколько секунд хранить результат завершённой задачи
+RESULT_TTL = 2 * 60 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+STATUS_LABELS = {
+    QUEUED: "В очереди",
+    RUNNING: "Выполняется",
+    DONE: "Готово",
+    FAILED: "Ошибка",
+    CANCELLED: "Отменено",
+}
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем"""
+
+class Job:
+    """Фоновая задача: состояние, прогресс и результат"""
+
+    def __init__(self, owner, name, fn, args, kwargs):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.name = name
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self._result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def result(self):
+        """Результат задачи; крупные таблицы и файлы читаются из хранилища (hranilishche.py)"""
+        return hranilishche.get_values(self._result)
+
+    def set_progress(self, fraction, message=None):
+        """Обновляет прогресс (0..1); вызывается из функции задачи и прерывает её при отмене"""
+        self.check_cancelled()
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        cancel(self.id)
+
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="medisapp-job")
+_jobs = {}
+_queues = OrderedDict()
+_running = defaultdict(int)
+
+def submit(owner, name, fn, *args, **kwargs):
+    """
+    Ставит задачу в очередь и возвращает её идентификатор.
+    Функция вызывается как fn(job, *args, **kwargs) в фоновом потоке.
+    """
+    job = Job(owner, name, fn, args, kwargs)
+    with _lock:
+        _cleanup()
+        _jobs[job.id] = job
+        _queues.setdefault(owner, deque()).append(job)
+    _dispatch()
+    return job.id
+
+def get(job_id):
+    return _jobs.get(job_id)
+
+def cancel(job_id):
+    """Отменяет задачу: из очереди удаляется сразу, выполняющаяся прерывается на следующем set_progress"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None or job.done:
+            return
+        job._cancel_event.set()
+        queue = _queues.get(job.owner)
+        if job.status == QUEUED and queue is not None and job in queue:
+            queue.remove(job)
+            job.status = CANCELLED
+            job.finished = time.time()
+
+def _dispatch():
+    """Запускает задачи из очередей сессий по кругу, пока есть свободные потоки"""
+    with _lock:
+        while sum(_running.values()) < MAX_WORKERS:
+            owner = next(
+                (o for o, queue in _queues.items() if queue and _running[o] < MAX_JOBS_PER_SESSION),
+                None
+            )
+            if owner is None:
+                break
+            job = _queues[owner].popleft()
+            # Сессия, получившая поток, уходит в конец круга
+            _queues.move_to_end(owner)
+            job.status = RUNNING
+            _running[owner] += 1
+            _executor.submit(_run, job)
+
+def _run(job):
+    try:
+        job.check_cancelled()
+        job._result = hranilishche.put_values(job.owner, job._fn(job, *job._args, **job._kwargs))
+        job.progress = 1.0
+        job.status = DONE
+    except JobCancelled:
+        job.status = CANCELLED
+    except Exception as e:
+        job.error = str(e)
+        job.status = FAILED
+    finally:
+        job.finished = time.time()
+        # Аргументы (загруженные файлы) больше не нужны
+        job._args = job._kwargs = None
+        with _lock:
+            _running[job.owner] -= 1
+        _dispatch()
+
+def discard(job_id):
+    """Отменяет задачу и сразу удаляет её результат"""
+    cancel(job_id)
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None or not job.done:
+            return
+        del _jobs[job_id]
+    hranilishche.release_values(job._result)
+
+def _cleanup():
+    """Удаляет результаты задач, завершённых более RESULT_TTL секунд назад"""
+    now = time.time()
+    for job_id in [j.id for j in _jobs.values() if j.done and now - j.finished > RESULT_TTL]:
+        hranilishche.release_values(_jobs.pop(job_id)._result)
+    for owner in [o for o, queue in _queues.items() if not queue and not _running[o]]:
+        del _queues[owner]
+        _running.pop(owner, None)
+
+# --- Интерфейс Streamlit ---
+
+def session_owner():
+    """Идентификатор текущей сессии Streamlit"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+def submit_for_session(key, name, fn, *args, **kwargs):
+    """Запускает задачу от имени текущей сессии и запоминает её под ключом key"""
+    previous = st.session_state.get(f"job_{key}")
+    if previous:
+        # Результат прежнего отчёта больше не нужен
+        discard(previous)
+    job_id = submit(session_owner(), name, fn, *args, **kwargs)
+    st.session_state[f"job_{key}"] = job_id
+    return job_id
+
+def discard_for_session(key):
+    """Отменяет задачу сессии под ключом key и забывает её"""
+    job_id = st.session_state.pop(f"job_{key}", None)
+    if job_id:
+        discard(job_id)
+
+def session_job(key):
+    """
+    Возвращает задачу под ключом key, если она завершена.
+    Пока задача выполняется, показывает прогресс (с опросом раз в секунду) и возвращает None.
+    """
+    job = get(st.session_state.get(f"job_{key}"))
+    if job is None:
+        return None
+    if job.done:
+        return job
+    _job_progress(job.id, key)
+    return None
+
+@st.fragment(run_every=1.0)
+def _job_progress(job_id, key):
+    job = get(job_id)
+    if job is None or job.done:
+        # Перерисовываем страницу целиком, чтобы показать результат
+        st.rerun()
+    text = f"{job.name}: {STATUS_LABELS[job.status].lower()}"
+    if job.message:
+        text += f" - {job.message}"
+    st.progress(job.progress, text=text)
+    if st.button("Отменить", key=f"cancel_{key}"):
+        job.cancel()
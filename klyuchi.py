@@ -0,0 +1,203 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Сопоставление значений из файлов с ключами справочников без учёта написания.
+# Канонический ключ: регистр, ё/е, кавычки и пробелы не различаются
+# ("г.Москва", "г. Москва " и "Г. МОСКВА" дают один ключ).
+# Индекс "канонический ключ -> ключ справочника" строится один раз на версию
+# справочника: загруженные справочники кэшируются (spravochniki.load_dictionary),
+# поэтому новая версия файла - это новый объект и новый индекс.
+# Для значений, которых нет в справочнике, индекс триграмм подбирает
+# похожие ключи ("возможно, имелось в виду").
+# В столбце файла обычно десятки-сотни различных значений на сотни тысяч строк,
+# поэтому сверка со справочником идёт по различным значениям (pd.factorize),
+# а результат раздаётся строкам через коды значений.
+
+QUOTES = str.maketrans({quote: '"' for quote in "«»“”„‟″'‘’‚‛`´"})
+_SPACES = re.compile(r"\s+")
+# Пробелы вокруг точек, запятых и скобок не учитываются
+_PUNCTUATION_SPACES = re.compile(r'\s*([.,;:()"])\s*')
+
+# Сколько индексов хранить (по два на версию каждого справочника)
+MAX_INDEXES = 128
+# Сколько похожих ключей предлагать и минимальное сходство (коэффициент Дайса по триграммам)
+MAX_SUGGESTIONS = 3
+MIN_SIMILARITY = 0.3
+
+_lock = threading.Lock()
+_indexes = OrderedDict()
+
+def canonical(value):
+    """Канонический вид значения для сравнения со справочником"""
+    text = str(value).casefold().replace("ё", "е").translate(QUOTES)
+    text = _SPACES.sub(" ", text)
+    return _PUNCTUATION_SPACES.sub(r"\1", text).strip()
+
+def _cached(keys, kind, build):
+    """Индекс справочника keys, построенный build(keys) один раз на объект справочника"""
+    cache_key = (id(keys), kind)
+    with _lock:
+        cached = _indexes.get(cache_key)
+        # Объект хранится вместе с индексом, поэтому его id не может достаться другому справочнику
+        if cached is not None and cached[0] is keys:
+            _indexes.move_to_end(cache_key)
+            return cached[1]
+
+    index = build(keys)
+    with _lock:
+        _indexes[cache_key] = (keys, index)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def _build_key_index(keys):
+    index = {}
+    for key in keys:
+        if pd.notna(key):
+            # При совпадении канонических ключей остаётся первый
+            index.setdefault(canonical(key), key)
+    return index
+
+def key_index(keys):
+    """Индекс канонический ключ -> ключ справочника (keys - словарь или список ключей)"""
+    return _cached(keys, "keys", _build_key_index)
+
+def distinct(values):
+    """
+    Разложение столбца: (коды строк, различные значения). Пустые значения получают код -1.
+    Различные значения можно заменять (обрезка пробелов, написание справочника) - коды остаются верными.
+    """
+    codes, uniques = pd.factorize(pd.Series(values))
+    return codes, np.asarray(uniques, dtype=object)
+
+def per_row(codes, results, empty):
+    """Результаты для различных значений (по одному на значение) -> массив по строкам; для пустых - empty"""
+    results = np.asarray(results, dtype=object)
+    # Последний элемент - результат для кода -1
+    return np.append(results, np.array([empty], dtype=object))[codes]
+
+def in_keys(values, keys, factor=None):
+    """Маска строк, значения которых есть среди ключей справочника (как values.isin(keys)); factor - готовое разложение"""
+    codes, uniques = factor if factor is not None else distinct(values)
+    keys = list(keys)
+    found = np.append(pd.Index(uniques, dtype=object).isin(keys), pd.Index([np.nan]).isin(keys))
+    return pd.Series(found[codes], index=pd.Series(values).index)
+
+def map_keys(values, mapping, factor=None):
+    """Значения справочника mapping для столбца (как values.map(mapping)), по одному поиску на различное значение"""
+    values = pd.Series(values)
+    codes, uniques = factor if factor is not None else distinct(values)
+    mapped = pd.Series(uniques, dtype=object).map(mapping)
+    empty = pd.Series([np.nan], dtype=object).map(mapping).iloc[0]
+    return pd.Series(per_row(codes, mapped, empty), index=values.index).infer_objects()
+
+def _canonical_or_empty(value):
+    return canonical(value) if pd.notna(value) else ""
+
+def composite_index(table, columns):
+    """Множество канонических сочетаний значений столбцов columns справочника-таблицы"""
+    def build(table):
+        return set(zip(*(table[col].map(_canonical_or_empty) for col in columns)))
+    return _cached(table, ("composite",) + tuple(columns), build)
+
+def has_combination(index, values):
+    """Есть ли сочетание values (значения в порядке столбцов индекса) в composite_index"""
+    return tuple(_canonical_or_empty(value) for value in values) in index
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _build_trigram_index(keys):
+    candidates = list(key_index(keys).items())
+    postings = {}
+    for position, (key_canonical, _) in enumerate(candidates):
+        for gram in trigrams(key_canonical):
+            postings.setdefault(gram, []).append(position)
+    sizes = [len(trigrams(key_canonical)) for key_canonical, _ in candidates]
+    return {"keys": [key for _, key in candidates], "sizes": sizes, "postings": postings}
+
+def suggest(value, keys, limit=MAX_SUGGESTIONS):
+    """Ключи справочника, похожие на value (самые похожие первыми)"""
+    index = _cached(keys, "trigrams", _build_trigram_index)
+    grams = trigrams(canonical(value))
+    common = {}
+    for gram in grams:
+        for position in index["postings"].get(gram, ()):
+            common[position] = common.get(position, 0) + 1
+
+    scored = [
+        (2 * count / (len(grams) + index["sizes"][position]), position)
+        for position, count in common.items()
+    ]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [index["keys"][position] for score, position in scored[:limit] if score >= MIN_SIMILARITY]
+
+# Поиск подстроки по большому справочнику (spravochniki.paged_editor_ui): индекс троек
+# символов строится один раз на версию справочника. Тройка и номер строки хранятся
+# одним числом (код тройки * число строк + номер строки) в отсортированном массиве,
+# поэтому строки с тройкой - отрезок массива, а строки с подстрокой - пересечение
+# отрезков всех её троек с проверкой найденных строк.
+
+def _chars(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+def _gram_codes(dense, alphabet_size):
+    """Коды троек подряд идущих символов по номерам символов в алфавите"""
+    dense = dense.astype(np.int64)
+    return (dense[:-2] * alphabet_size + dense[1:-1]) * alphabet_size + dense[2:]
+
+def substring_index(texts):
+    """Индекс поиска подстроки в строках texts (см. find_substring)"""
+    texts = np.asarray(texts, dtype=object)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    # Строки склеиваются через разделитель, тройки с разделителем не учитываются
+    chars = _chars("\0".join(texts))
+    present = np.bincount(chars) > 0
+    alphabet = np.flatnonzero(present).astype(np.uint32)
+    if len(alphabet) ** 3 * max(len(texts), 1) >= 2 ** 63:
+        return {"texts": texts, "keys": None}
+    # Номер символа в алфавите
+    dense = (np.cumsum(present) - 1)[chars]
+    separator = np.zeros(len(chars), dtype=bool)
+    separator[(np.cumsum(lengths + 1) - 1)[:-1]] = True
+    rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths + 1)[:len(chars)]
+    inside = ~(separator[:-2] | separator[1:-1] | separator[2:])
+    keys = np.sort(_gram_codes(dense, len(alphabet))[inside] * len(texts) + rows[:-2][inside])
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = keys[1:] != keys[:-1]
+    return {"texts": texts, "alphabet": alphabet, "keys": keys[unique]}
+
+def find_substring(index, query):
+    """Номера строк индекса substring_index, содержащих query (по возрастанию)"""
+    texts = index["texts"]
+    chars = _chars(query)
+    if len(chars) < 3 or index["keys"] is None:
+        # В коротком запросе нет троек - строки проверяются подряд
+        return np.flatnonzero(np.fromiter((query in text for text in texts), dtype=bool, count=len(texts)))
+    alphabet = index["alphabet"]
+    dense = np.searchsorted(alphabet, chars)
+    if (dense == len(alphabet)).any() or (alphabet[np.minimum(dense, len(alphabet) - 1)] != chars).any():
+        return np.array([], dtype=np.int64)
+    grams = np.unique(_gram_codes(dense, len(alphabet))) * len(texts)
+    starts = np.searchsorted(index["keys"], grams, side="left")
+    ends = np.searchsorted(index["keys"], grams + len(texts), side="left")
+    # Пересечение начинается с самой редкой тройки
+    rows = None
+    for _, start, end, gram in sorted(zip(ends - starts, starts, ends, grams)):
+        found = index["keys"][start:end] - gram
+        rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        if not len(rows):
+            break
+    # Все тройки запроса есть в строке, но не обязательно подряд
+    return rows[np.fromiter((query in texts[row] for row in rows), dtype=bool, count=len(rows))]
+
+def match_distinct(uniques, keys):
+    """Ключ справочника для каждого различного значения, совпадающего с ним только после нормализации, иначе None"""
+    exact = set(keys)
+    index = key_index(keys)
+    return [None if value in exact else index.get(canonical(value)) for value in uniques]
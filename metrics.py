@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# Замеры этапов обработки: время, число строк и пиковая память.
+# По умолчанию выключены - stage() тогда ничего не измеряет и не пишет.
+# Включаются переменной окружения MEDISAPP_METRICS=1 (MEDISAPP_METRICS=memory -
+# вместе с учётом памяти) или из панели администратора.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+LOG_PATH = os.path.join(base_dir, "logs", "stages.jsonl")
+
+_lock = threading.Lock()
+_records = deque(maxlen=1000)
+enabled = os.environ.get("MEDISAPP_METRICS", "") in ("1", "memory")
+track_memory = os.environ.get("MEDISAPP_METRICS", "") == "memory"
+
+def configure(enable, memory=False):
+    """Включает или выключает замеры (memory - учитывать пиковую память через tracemalloc)"""
+    global enabled, track_memory
+    enabled = enable
+    track_memory = enable and memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+if track_memory:
+    tracemalloc.start()
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Замеряет этап обработки. Внутри блока можно уточнить число строк:
+        with stage("проверка") as record:
+            ...
+            record["rows"] = len(df)
+    Пиковая память считается по всему процессу, поэтому при параллельных задачах она приблизительная.
+    """
+    record = {"stage": name, "rows": rows}
+    if not enabled:
+        yield record
+        return
+
+    memory = track_memory and tracemalloc.is_tracing()
+    if memory:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        if memory:
+            record["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - start_memory) / 2 ** 20, 2)
+        record["time"] = datetime.now().isoformat(timespec="seconds")
+        record["thread"] = threading.current_thread().name
+        _save(record)
+
+def _save(record):
+    with _lock:
+        _records.append(record)
+        try:
+            os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+            with open(LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            # Журнал - вспомогательный, ошибка записи не должна ломать отчёт
+            pass
+
+def recent_records():
+    """Последние замеры (в памяти процесса), новые первыми"""
+    with _lock:
+        return pd.DataFrame(list(reversed(_records)))
+
+def stage_summary(records_df):
+    """Сводка по этапам: количество, среднее и максимальное время, строки, память"""
+    if records_df.empty:
+        return records_df
+    agg = {"seconds": ["count", "mean", "max"], "rows": "sum"}
+    if "peak_mb" in records_df.columns:
+        agg["peak_mb"] = "max"
+    summary = records_df.groupby("stage").agg(agg)
+    summary.columns = ["Замеров", "Среднее, с", "Максимум, с", "Строк"] + (["Пик памяти, МБ"] if "peak_mb" in records_df.columns else [])
+    return summary.sort_values("Максимум, с", ascending=False).reset_index().rename(columns={"stage": "Этап"})
+
+def show_metrics_panel():
+    """Панель администратора с замерами этапов"""
+    import streamlit as st
+
+    col1, col2 = st.columns(2)
+    with col1:
+        enable = st.toggle("Включить замеры", value=enabled, key="metrics_enabled")
+    with col2:
+        memory = st.toggle("Учитывать память (замедляет обработку)", value=track_memory, key="metrics_memory", disabled=not enable)
+    if enable != enabled or (enable and memory != track_memory):
+        configure(enable, memory)
+
+    records_df = recent_records()
+    if records_df.empty:
+        st.info("Замеров пока нет. Включите замеры и сформируйте отчёт или проверьте файл.")
+        return
+
+    st.write("Сводка по этапам:")
+    st.dataframe(stage_summary(records_df), use_container_width=True, hide_index=True)
+    st.write("Последние замеры:")
+    st.dataframe(records_df, use_container_width=True, hide_index=True)
+    st.caption(f"Полный журнал: {LOG_PATH}")
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+# Проверенные наборы данных (доходы и расходы филиалов).
+# Страница проверки публикует набор сразу после успешной проверки, а отчёты
+# выбирают его из списка вместо повторной загрузки processed_file.xlsx.
+# Набор хранится в файле Arrow IPC (datasets/<id>.arrow) и читается через
+# отображение в память - без разбора Excel и без копирования числовых столбцов.
+# Описание набора (вид, план/факт, месяц, файл, число строк) - в <id>.json рядом.
+# В описании же хранятся различные значения полей KEY_COLUMNS: по ним find()
+# находит наборы, которые нужно поправить после изменения справочника.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+DATASETS_DIR = os.path.join(base_dir, "datasets")
+# Сколько последних наборов хранить
+MAX_DATASETS = int(os.environ.get("MEDISAPP_MAX_DATASETS", 100))
+
+KIND_LABELS = {"income": "Доход", "expense": "Расход"}
+DATA_TYPES = ["Факт", "План"]
+# Поля, по которым в наборах ищутся значения справочников
+KEY_COLUMNS = ["Статья затрат БУ", "Номенклатурная группа"]
+
+_lock = threading.Lock()
+_listing = {"version": None, "datasets": []}
+
+def _arrow_table(df):
+    """Таблица Arrow; столбцы со значениями разных типов сохраняются как строки"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def _keys(df):
+    return {
+        col: sorted(str(value) for value in df[col].dropna().unique())
+        for col in KEY_COLUMNS if col in df.columns
+    }
+
+def _write(dataset_id, df, meta):
+    path = os.path.join(DATASETS_DIR, f"{dataset_id}.arrow")
+    table = _arrow_table(df)
+    # Запись во временный файл и переименование - набор появляется в списке только целиком
+    with pa.OSFile(path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+    meta_path = os.path.join(DATASETS_DIR, f"{dataset_id}.json")
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(meta_path + ".tmp", meta_path)
+
+def publish(df, kind, data_type, month, year, source_name, dictionaries=None):
+    """
+    Публикует проверенную таблицу, возвращает описание набора (словарь с id).
+    dictionaries - версии справочников {файл: версия}, по которым проверена таблица.
+    """
+    os.makedirs(DATASETS_DIR, exist_ok=True)
+    dataset_id = uuid.uuid4().hex[:12]
+    meta = {
+        "id": dataset_id,
+        "kind": kind,
+        "data_type": data_type,
+        "month": month,
+        "year": year,
+        "source_name": source_name,
+        "rows": len(df),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "keys": _keys(df),
+        "dictionaries": dictionaries or {},
+    }
+    _write(dataset_id, df, meta)
+    _cleanup()
+    return meta
+
+def replace(meta, df):
+    """Перезаписывает таблицу набора (после правки справочника), описание сохраняется"""
+    meta = dict(meta, rows=len(df), keys=_keys(df))
+    _write(meta["id"], df, meta)
+    return meta
+
+def load_table(dataset_id):
+    """Таблица Arrow набора, отображённая в память"""
+    source = pa.memory_map(os.path.join(DATASETS_DIR, f"{dataset_id}.arrow"), "r")
+    return pa.ipc.open_file(source).read_all()
+
+def load(dataset_id):
+    """Набор данных как DataFrame"""
+    return load_table(dataset_id).to_pandas(split_blocks=True)
+
+def list_datasets(kind=None, data_type=None):
+    """Опубликованные наборы, новые первыми (список перечитывается только после изменения каталога)"""
+    try:
+        version = os.stat(DATASETS_DIR).st_mtime_ns
+    except OSError:
+        return []
+
+    with _lock:
+        if _listing["version"] != version:
+            datasets = []
+            for name in os.listdir(DATASETS_DIR):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(DATASETS_DIR, name), encoding="utf-8") as f:
+                        datasets.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+            datasets.sort(key=lambda meta: meta["created"], reverse=True)
+            _listing["version"] = version
+            _listing["datasets"] = datasets
+        datasets = _listing["datasets"]
+
+    return [
+        meta for meta in datasets
+        if (kind is None or meta["kind"] == kind) and (data_type is None or meta["data_type"] == data_type)
+    ]
+
+def find(field, keys):
+    """Наборы, в которых поле field принимает одно из значений keys"""
+    keys = set(keys)
+    return [
+        meta for meta in list_datasets()
+        if keys.intersection(meta.get("keys", {}).get(field, ()))
+    ]
+
+def describe(meta):
+    """Подпись набора для списков выбора"""
+    created = datetime.fromisoformat(meta["created"]).strftime("%d.%m %H:%M")
+    return (
+        f"{KIND_LABELS.get(meta['kind'], meta['kind'])} {meta['data_type'].lower()}, "
+        f"{meta['month']} {meta['year']} - {meta['source_name']} ({meta['rows']} строк, {created})"
+    )
+
+def _cleanup():
+    """Удаляет наборы сверх MAX_DATASETS (самые старые)"""
+    for meta in list_datasets()[MAX_DATASETS:]:
+        try:
+            os.remove(os.path.join(DATASETS_DIR, meta["id"] + ".arrow"))
+            os.remove(os.path.join(DATASETS_DIR, meta["id"] + ".json"))
+        except OSError:
+            # В Windows файл, открытый для чтения, удалить нельзя - удалим в следующий раз
+            pass
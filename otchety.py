@@ -0,0 +1,1237 @@
+import pandas as pd
+import numpy as np
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import threading
+from metrics import stage
+import istoriya
+import nabory
+import raspredelenie
+import sverka
+from dengi import amount_column, to_kopecks, to_rubles
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+
+# Пути к CSV-файлам со справочниками
+COST_ITEMS_MAPPING_CSV = "cost_items_mapping.csv"
+COST_ITEMS_SUBSECTIONS_CSV = "cost_items_subsections.csv"
+ADMIN_COST_ITEMS_MAPPING_CSV = "admin_cost_items_mapping.csv"
+ADMIN_COST_ITEMS_SUBSECTIONS_CSV = "admin_cost_items_subsections.csv"
+
+# Справочники отчётов (файлы с разделителем ",")
+REPORT_DICTIONARIES = {
+    "smeta": [COST_ITEMS_MAPPING_CSV, COST_ITEMS_SUBSECTIONS_CSV],
+    "admin": [ADMIN_COST_ITEMS_MAPPING_CSV, ADMIN_COST_ITEMS_SUBSECTIONS_CSV],
+}
+
+def report_dictionary_versions(kind):
+    """Версии справочников отчёта {файл: версия} (см. istoriya.py)"""
+    return istoriya.file_versions(REPORT_DICTIONARIES[kind], sep=",")
+
+def load_or_create_mapping(file_path, default_data=None):
+    """Загружает справочник из CSV или создает новый с default_data"""
+    if os.path.exists(file_path):
+        df = pd.read_csv(file_path)
+        return dict(zip(df.iloc[:, 0], df.iloc[:, 1]))
+    elif default_data is not None:
+        df = pd.DataFrame(list(default_data.items()), columns=['Original', 'Mapped'])
+        df.to_csv(file_path, index=False)
+        return default_data
+    return {}
+
+# Загрузка или создание справочников
+COST_ITEMS_MAPPING = load_or_create_mapping(
+    COST_ITEMS_MAPPING_CSV,
+    {
+    "Хозяйственные услуги": "Хозяйственные услуги",
+    "Амортизация": "Амортизация основных средств",
+    "Расходы по аренде автотранспорта": "Расходы по аренде автотранспорта",
+    "Аренда гаражей и стоянок": "Аренда гаражей и стоянок",
+    "Расходы по аренде помещений": "Расходы по аренде помещений",
+    "Расходы по аренде прочего имущества": "Расходы по аренде прочего имущества",
+    "Бланки, карты, журналы медицинские": "Бланки, карты, журналы медицинские",
+    "Вакцина": "Вакцина",
+    "Водоснабжение и канализация": "Водоснабжение и канализация",
+    "Вывоз мусора": "Вывоз мусора",
+    "ГСМ для а/м": "ГСМ для а/м",
+    "Дератизация и дезинсекция": "Дератизация и дезинсекция",
+    "ДМС работников (3% от ФОТ)": "ДМС работников (3% от ФОТ)",
+    "Услуги доставки, тарнспортировки грузов": "Услуги доставки, тарнспортировки грузов",
+    "Интернет и передача данных": "Интернет и передача данных",
+    "Канцелярские товары": "Канцелярские товары",
+    "Командировочные": "Командировочные",
+    "Компенсация проезда к местам отдыха (льготный проезд)": "Компенсация проезда к местам отдыха (льготный проезд)",
+    "Медикаменты": "Медикаменты",
+    "Медицинский инструментарий и прочий инвентарь многоразового использования": "Медицинский инструментарий и прочий инвентарь многоразового использования",
+    "Метрология": "Метрология",
+    "Моющие и дезинфицирующие средства": "Моющие и дезинфицирующие средства",
+    "Мягкий инвентарь": "Мягкий инвентарь",
+    "Расходы на обучение и повышение квалификации": "Расходы на обучение",
+    "Оплата труда": "Оплата труда",
+    "Организация питания (в санаторно-профилактических учреждениях)": "Организация питания (в санаторно-профилактических учреждениях)",
+    "Питание, проживание на вахте": "Питание, проживание на вахте",
+    "Охрана зданий": "Питание, проживание на вахте",
+    "Междугородные перевозки сотрудников к месту работы": "Междугородные перевозки сотрудников к месту работы",
+    "Подбор персонала": "Подбор персонала",
+    "Пожарная безопасность": "Пожарная безопасность",
+    "Приобретение мед. оборудования (до 100 тыс. руб.)": "Приобретение мед. оборудования (до 100 тыс. руб.)",
+    "Приобретение оргтехники (до 100 тыс. руб.)": "Приобретение оргтехники (до 100 тыс. руб.)",
+    "Приобретение прочего. оборудования (до 100 тыс. руб.)": "Приобретение прочего. оборудования (до 100 тыс. руб.)",
+    "Прочие на содержание автотранспорта": "Прочие на содержание автотранспорта",
+    "Расходные материалы": "Расходные материалы",
+    "Расходные материалы ИТ": "Расходные материалы ИТ",
+    "Реклама, продвижение": "Реклама, продвижение",
+    "ТО и ремонт медицинского оборудования (материалы)": "ТО и ремонт медицинского оборудования (материалы)",
+    "ТО и ремонт медицинского оборудования (услуги)": "ТО и ремонт медицинского оборудования (услуги)",
+    "Ремонт и ТО автотранспорта": "Ремонт и ТО автотранспорта",
+    "Ремонт офисной мебели, оборудования общего назначения": "Ремонт офисной мебели, оборудования общего назначения",
+    "Ремонт помещений": "Ремонт помещений",
+    "Техническое обслуживание системы вентиляции и кондиционирования": "Техническое обслуживание системы вентиляции и кондиционирования",
+    "Сопровождение информационных систем": "Сопровождение информационных систем",
+    "Специальная оценка условий труда": "Специальная оценка условий труда",
+    "Спец одежда, спец обувь": "Спец одежда, спец обувь",
+    "Стирка белья": "Прочие налоги, сборы, пошлины",
+    "Сторонние ЛПУ": "Сторонние ЛПУ",
+    "Страхование автотранспорта": "Страхование автотранспорта",
+    "Страховые взносы": "Страховые взносы",
+    "Страховые взносы": "Страховые взносы",
+    "Страховые взносы": "Страховые взносы",
+    "Телефон и телефонные переговоры (в т.ч. сотовая связь)": "Телефон и телефонные переговоры (в т.ч. сотовая связь)",
+    "Тепловая энергия (отопление и горячая вода)": "Тепловая энергия (отопление и горячая вода)",
+    "ТО прочих коммунальных систем": "ТО прочих коммунальных систем",
+    "Уборка помещений, клининг": "Уборка помещений, клининг",
+    "Уборка территории": "Уборка территории",
+    "Услуги по обслуживанию и ремонту оборудования ИТ": "Услуги по обслуживанию и ремонту оборудования ИТ",
+    "Услуги по обслуживанию и ремонту помещений ИТ": "Услуги по обслуживанию и ремонту помещений ИТ",
+    "Услуги СЭС": "Услуги СЭС",
+    "Утилизация медицинских отходов": "Утилизация медицинских отходов",
+    "Хозяйственные товары": "Хозяйственные услуги",
+    "Электроэнергия": "Электроэнергия",
+    "Замещение": "Замещение",
+    "Вахтовые": "Вахтовые"
+    }
+)
+
+COST_ITEMS_SUBSECTIONS = load_or_create_mapping(
+    COST_ITEMS_SUBSECTIONS_CSV,
+    {
+    "Хозяйственные услуги": "Прочие расходы",
+    "Амортизация": "Амортизация основных средств",
+    "Расходы по аренде автотранспорта": "Прочие расходы",
+    "Аренда гаражей и стоянок": "Прочие расходы",
+    "Расходы по аренде помещений": "Прочие расходы",
+    "Расходы по аренде прочего имущества": "Прочие расходы",
+    "Бланки, карты, журналы медицинские": "Материальные производственные расходы",
+    "Вакцина": "Материальные производственные расходы",
+    "Водоснабжение и канализация": "Прочие расходы",
+    "Вывоз мусора": "Прочие расходы",
+    "ГСМ для а/м": "Прочие расходы",
+    "Дератизация и дезинсекция": "Прочие расходы",
+    "ДМС работников (3% от ФОТ)": "ДМС работников (3% от ФОТ)",
+    "Услуги доставки, тарнспортировки грузов": "Прочие расходы",
+    "Интернет и передача данных": "Прочие расходы",
+    "Канцелярские товары": "Материальные производственные расходы",
+    "Командировочные": "Прочие расходы",
+    "Компенсация проезда к местам отдыха (льготный проезд)": "Прочие расходы",
+    "Медикаменты": "Материальные производственные расходы",
+    "Медицинский инструментарий и прочий инвентарь многоразового использования": "Материальные производственные расходы",
+    "Метрология": "Прочие расходы",
+    "Моющие и дезинфицирующие средства": "Материальные производственные расходы",
+    "Мягкий инвентарь": "Материальные производственные расходы",
+    "Расходы на обучение": "Прочие расходы",
+    "Оплата труда": "Заработная плата",
+    "Организация питания (в санаторно-профилактических учреждениях)": "Прочие расходы",
+    "Питание, проживание на вахте": "Прочие расходы",
+    "Междугородные перевозки сотрудников к месту работы": "Прочие расходы",
+    "Подбор персонала": "Прочие расходы",
+    "Пожарная безопасность": "Прочие расходы",
+    "Приобретение мед. оборудования (до 100 тыс. руб.)": "Материальные производственные расходы",
+    "Приобретение оргтехники (до 100 тыс. руб.)": "Материальные производственные расходы",
+    "Приобретение прочего. оборудования (до 100 тыс. руб.)": "Материальные производственные расходы",
+    "Прочие на содержание автотранспорта": "Прочие расходы",
+    "Расходные материалы": "Материальные производственные расходы",
+    "Расходные материалы ИТ": "Материальные производственные расходы",
+    "Реклама, продвижение": "Прочие расходы",
+    "ТО и ремонт медицинского оборудования (материалы)": "Материальные производственные расходы",
+    "ТО и ремонт медицинского оборудования (услуги)": "Материальные производственные расходы",
+    "Ремонт и ТО автотранспорта": "Прочие расходы",
+    "Ремонт офисной мебели, оборудования общего назначения": "Прочие расходы",
+    "Ремонт помещений": "Прочие расходы",
+    "Техническое обслуживание системы вентиляции и кондиционирования": "Прочие расходы",
+    "Сопровождение информационных систем": "Прочие расходы",
+    "Специальная оценка условий труда": "Прочие расходы",
+    "Спец одежда, спец обувь": "Материальные производственные расходы",
+    "Прочие налоги, сборы, пошлины": "Прочие расходы",
+    "Сторонние ЛПУ": "Прочие расходы",
+    "Страхование автотранспорта": "Прочие расходы",
+    "Страховые взносы": "Заработная плата",
+    "Телефон и телефонные переговоры (в т.ч. сотовая связь)": "Прочие расходы",
+    "Тепловая энергия (отопление и горячая вода)": "Прочие расходы",
+    "ТО прочих коммунальных систем": "Прочие расходы",
+    "Уборка помещений, клининг": "Прочие расходы",
+    "Уборка территории": "Прочие расходы",
+    "Услуги по обслуживанию и ремонту оборудования ИТ": "Прочие расходы",
+    "Услуги по обслуживанию и ремонту помещений ИТ": "Прочие расходы",
+    "Услуги СЭС": "Прочие расходы",
+    "Утилизация медицинских отходов": "Прочие расходы",
+    "Электроэнергия": "Прочие расходы",
+    "Замещение": "Заработная плата",
+    "Вахтовые": "Заработная плата"
+    }
+)
+
+ADMIN_COST_ITEMS_MAPPING = load_or_create_mapping(
+    ADMIN_COST_ITEMS_MAPPING_CSV,
+    {
+    'Хозяйственные услуги': 'Хозяйственные услуги',
+    'Амортизация': 'Амортизация основных средств',
+    'Расходы по аренде автотранспорта': 'Расходы по аренде автотранспорта',
+    'Аренда гаражей и стоянок': 'Аренда гаражей и стоянок',
+    'Расходы по аренде помещений': 'Расходы по аренде помещений',
+    'Расходы по аренде прочего имущества': 'Расходы по аренде прочего имущества',
+    'Аудит': 'Аудит',
+    'Безопасность ИТ': 'Безопасность ИТ',
+    'Водоснабжение и канализация': 'Водоснабжение и канализация',
+    'Вознаграждения по договорам ГПХ': 'Оплата труда',
+    'Вывоз мусора': 'Вывоз мусора',
+    'ГСМ для а/м': 'ГСМ для а/м',
+    'ДМС работников (3% от ФОТ)': 'ДМС работников (3% от ФОТ)',
+    'Услуги доставки, тарнспортировки грузов': 'Услуги доставки, тарнспортировки грузов',
+    'Интернет и передача данных': 'Интернет и передача данных',
+    'ИТ аутсорсинг': 'ИТ аутсорсинг',
+    'Канцелярские товары': 'Канцелярские товары',
+    'Командировочные': 'Командировочные',
+    'Корпоративные мероприятия': 'Корпоративные мероприятия',
+    'Консультационные услуги (в т.ч. В связи с лицензированием)': 'Консультационные услуги (в т.ч. В связи с лицензированием)',
+    'Налог на имущество': 'Налог на имущество',
+    'Прочие налоги, сборы, пошлины': 'Прочие налоги, сборы, пошлины',
+    'Расходы на обучение и повышение квалификации': 'Расходы на обучение',
+    'Оплата труда': 'Оплата труда',
+    'Охрана зданий': 'Питание, проживание на вахте',
+    'Подбор персонала': 'Подбор персонала',
+    'Подписка и приобретение периодических изданий и книг': 'Подписка и приобретение периодических изданий и книг',
+    'Пожарная безопасность': 'Пожарная безопасность',
+    'Почтовые услуги, телеграф': 'Почтовые услуги, телеграф',
+    'Представительские': 'Представительские',
+    'Приобретение ПО и лицензий': 'Приобретение ПО и лицензий',
+    'Приобретение прочего. оборудования (до 100 тыс. руб.)': 'Приобретение прочего. оборудования (до 100 тыс. руб.)',
+    'Прочие на содержание автотранспорта': 'Прочие на содержание автотранспорта',
+    'Расходные материалы ИТ': 'Расходные материалы ИТ',
+    'Реклама, продвижение': 'Реклама, продвижение',
+    'Ремонт и ТО автотранспорта': 'Ремонт и ТО автотранспорта',
+    'Ремонт офисной мебели, оборудования общего назначения': 'Ремонт офисной мебели, оборудования общего назначения',
+    'Ремонт помещений': 'Ремонт помещений',
+    'Техническое обслуживание системы вентиляции и кондиционирования': 'Техническое обслуживание системы вентиляции и кондиционирования',
+    'Сопровождение информационных систем': 'Сопровождение информационных систем',
+    'Специальная оценка условий труда': 'Специальная оценка условий труда',
+    'Страхование автотранспорта': 'Страхование автотранспорта',
+    'Страховые взносы': 'Страховые взносы',
+    'Телефон и телефонные переговоры (в т.ч. сотовая связь)': 'Телефон и телефонные переговоры (в т.ч. сотовая связь)',
+    'Тепловая энергия (отопление и горячая вода)': 'Тепловая энергия (отопление и горячая вода)',
+    'ТО прочих коммунальных систем': 'ТО прочих коммунальных систем',
+    'Уборка помещений, клининг': 'Уборка помещений, клининг',
+    'Уборка территории': 'Уборка территории',
+    'Услуги по обслуживанию и ремонту оборудования ИТ': 'Услуги по обслуживанию и ремонту оборудования ИТ',
+    'Услуги по обслуживанию и ремонту помещений ИТ': 'Услуги по обслуживанию и ремонту помещений ИТ',
+    'Хозяйственные товары': 'Хозяйственные услуги',
+    'Электроэнергия': 'Электроэнергия',
+    'Юридические услуги (в т.ч. нотариальные)': 'Юридические услуги (в т.ч. нотариальные)',
+    'Замещение': 'Замещение',
+    'Вахтовые': 'Вахтовые'
+    }
+)
+
+ADMIN_COST_ITEMS_SUBSECTIONS = load_or_create_mapping(
+    ADMIN_COST_ITEMS_SUBSECTIONS_CSV,
+    {
+    'Хозяйственные услуги': 'Прочие расходы',
+    'Амортизация': 'Амортизация основных средств',
+    'Расходы по аренде автотранспорта': 'Прочие расходы',
+    'Аренда гаражей и стоянок': 'Прочие расходы',
+    'Расходы по аренде помещений': 'Прочие расходы',
+    'Расходы по аренде прочего имущества': 'Прочие расходы',
+    'Аудит': 'Прочие расходы',
+    'Безопасность ИТ': 'Прочие расходы',
+    'Водоснабжение и канализация': 'Прочие расходы',
+    'Оплата труда': 'Заработная плата',
+    'Вывоз мусора': 'Прочие расходы',
+    'ГСМ для а/м': 'Прочие расходы',
+    'ДМС работников (3% от ФОТ)': 'ДМС работников (3% от ФОТ)',
+    'Услуги доставки, тарнспортировки грузов': 'Прочие расходы',
+    'Интернет и передача данных': 'Прочие расходы',
+    'ИТ аутсорсинг': 'Прочие расходы',
+    'Канцелярские товары': 'Материальные производственные расходы',
+    'Командировочные': 'Прочие расходы',
+    'Корпоративные мероприятия': 'Прочие расходы',
+    'Консультационные услуги (в т.ч. В связи с лицензированием)': 'Прочие расходы',
+    'Налог на имущество': 'Прочие расходы',
+    'Прочие налоги, сборы, пошлины': 'Прочие расходы',
+    'Расходы на обучение': 'Прочие расходы',
+    'Питание, проживание на вахте': 'Прочие расходы',
+    'Подбор персонала': 'Прочие расходы',
+    'Подписка и приобретение периодических изданий и книг': 'Прочие расходы',
+    'Пожарная безопасность': 'Прочие расходы',
+    'Почтовые услуги, телеграф': 'Прочие расходы',
+    'Представительские': 'Прочие расходы',
+    'Приобретение ПО и лицензий': 'Материальные производственные расходы',
+    'Приобретение прочего. оборудования (до 100 тыс. руб.)': 'Материальные производственные расходы',
+    'Прочие на содержание автотранспорта': 'Прочие расходы',
+    'Расходные материалы ИТ': 'Материальные производственные расходы',
+    'Реклама, продвижение': 'Прочие расходы',
+    'Ремонт и ТО автотранспорта': 'Прочие расходы',
+    'Ремонт офисной мебели, оборудования общего назначения': 'Прочие расходы',
+    'Ремонт помещений': 'Прочие расходы',
+    'Техническое обслуживание системы вентиляции и кондиционирования': 'Прочие расходы',
+    'Сопровождение информационных систем': 'Прочие расходы',
+    'Специальная оценка условий труда': 'Прочие расходы',
+    'Страхование автотранспорта': 'Прочие расходы',
+    'Страховые взносы': 'Заработная плата',
+    'Телефон и телефонные переговоры (в т.ч. сотовая связь)': 'Прочие расходы',
+    'Тепловая энергия (отопление и горячая вода)': 'Прочие расходы',
+    'ТО прочих коммунальных систем': 'Прочие расходы',
+    'Уборка помещений, клининг': 'Прочие расходы',
+    'Уборка территории': 'Прочие расходы',
+    'Услуги по обслуживанию и ремонту оборудования ИТ': 'Прочие расходы',
+    'Услуги по обслуживанию и ремонту помещений ИТ': 'Прочие расходы',
+    'Электроэнергия': 'Прочие расходы',
+    'Юридические услуги (в т.ч. нотариальные)': 'Прочие расходы',
+    'Замещение': 'Заработная плата',
+    'Вахтовые': 'Заработная плата'
+    }
+)
+
+def normalize_items(df, mapping, subsections):
+    """Сопоставляет статьи затрат УУ статьям отчёта и добавляет подразделы"""
+    df["Статья затрат УУ"] = df["Статья затрат УУ"].map(mapping).fillna(df["Статья затрат УУ"])
+    df["Подраздел"] = df["Статья затрат УУ"].map(subsections).fillna("Прочие расходы")
+    return df
+
+def normalize_cost_items(df):
+    """Нормализует названия статей затрат и добавляет подразделы"""
+    return normalize_items(df, COST_ITEMS_MAPPING, COST_ITEMS_SUBSECTIONS)
+
+def normalize_admin_cost_items(df):
+    """Нормализует статьи затрат и подразделы для управленческого отчета"""
+    return normalize_items(df, ADMIN_COST_ITEMS_MAPPING, ADMIN_COST_ITEMS_SUBSECTIONS)
+
+
+# Числовые колонки отчёта
+VALUE_COLUMNS = ['План', 'Факт', 'Отклонение', 'План НД', 'Факт НД', 'Отклонение НД']
+
+# Ключ статьи отчёта и суммируемые показатели
+ITEM_COLUMNS = ['Подраздел', 'Статья затрат УУ']
+MEASURE_COLUMNS = ['План', 'Факт', 'План НД', 'Факт НД']
+
+# Исходные статьи строк (до сопоставления статей отчёта) - ключ базы агрегатов
+BASE_COLUMNS = ['Статья затрат БУ', 'Статья затрат УУ']
+
+# --- Описания отчётов по статьям затрат ---
+#
+# Отчёт задаётся описанием (REPORTS): отбор строк, сопоставление статей отчёта,
+# уровни иерархии (подраздел, статья), показатели и производные колонки.
+# Описания отчётов, которые строятся по одним файлам плана и факта, компилируются
+# в общий план агрегации (compile_reports): каждая строка файлов просматривается
+# один раз, показатели всех отчётов считаются одной группировкой по исходным
+# статьям и сочетанию отборов строк, а база агрегатов каждого отчёта
+# выбирается из общей группировки (run_plan).
+
+# Показатели: имя -> (сторона, только строки с НД == 1)
+MEASURES = {
+    'План': ('План', False),
+    'Факт': ('Факт', False),
+    'План НД': ('План', True),
+    'Факт НД': ('Факт', True),
+}
+
+def _all_rows(df, by_nomenclature):
+    return np.ones(len(df), dtype=bool)
+
+def _with_nomenclature(df, by_nomenclature):
+    # Если номенклатурная группа не заполнена ни в одном файле, отчёт строится по всем строкам
+    return df['Номенклатурная группа'].notna().to_numpy() if by_nomenclature else _all_rows(df, by_nomenclature)
+
+def _without_nomenclature(df, by_nomenclature):
+    return df['Номенклатурная группа'].isna().to_numpy() if by_nomenclature else _all_rows(df, by_nomenclature)
+
+# Отборы строк: имя -> функция (таблица, есть ли в файлах номенклатурные группы) -> маска строк
+ROW_FILTERS = {
+    'все строки': _all_rows,
+    'с номенклатурной группой': _with_nomenclature,
+    'без номенклатурной группы': _without_nomenclature,
+}
+
+REPORTS = {
+    'smeta': {
+        'title': 'Смета',
+        'filter': 'с номенклатурной группой',
+        'normalize': normalize_cost_items,
+        'levels': ITEM_COLUMNS,
+        'measures': MEASURE_COLUMNS,
+        # Производные колонки: имя -> (уменьшаемое, вычитаемое)
+        'derived': {'Отклонение': ('Факт', 'План'), 'Отклонение НД': ('Факт НД', 'План НД')},
+        'columns': VALUE_COLUMNS,
+    },
+    'admin': {
+        'title': 'Управленческие расходы',
+        'filter': 'без номенклатурной группы',
+        'normalize': normalize_admin_cost_items,
+        'levels': ITEM_COLUMNS,
+        'measures': MEASURE_COLUMNS,
+        'derived': {'Отклонение': ('Факт', 'План'), 'Отклонение НД': ('Факт НД', 'План НД')},
+        'columns': VALUE_COLUMNS,
+    },
+}
+
+def compile_reports(names):
+    """
+    План агрегации для отчётов names: различные отборы строк и показатели всех отчётов.
+    Отчёты с одинаковым отбором используют одну выборку, каждый показатель считается один раз.
+    """
+    definitions = {name: REPORTS[name] for name in names}
+    return {
+        'reports': definitions,
+        'filters': list(dict.fromkeys(definition['filter'] for definition in definitions.values())),
+        'measures': [measure for measure in MEASURES if any(measure in d['measures'] for d in definitions.values())],
+    }
+
+def _grouped_measures(expense_plan_df, expense_fact_df, filters, measures, by_nomenclature):
+    """
+    Один проход по строкам плана и факта: суммы показателей (в копейках) по сочетанию
+    отборов строк (бит i - строка входит в отбор filters[i]) и исходным статьям БУ и УУ.
+    """
+    sides = []
+    for side, df in (('План', expense_plan_df), ('Факт', expense_fact_df)):
+        amounts = amount_column(df['Сумма']).to_numpy()
+        # Суммы НД считаются только если НД == 1
+        nd = (df['НД'].fillna(0) == 1).to_numpy()
+        segment = np.zeros(len(df), dtype='int64')
+        for bit, name in enumerate(filters):
+            segment |= ROW_FILTERS[name](df, by_nomenclature).astype('int64') << bit
+        frame = pd.DataFrame({
+            '_segment': segment,
+            'Статья затрат БУ': df['Статья затрат БУ'] if 'Статья затрат БУ' in df.columns else '',
+            'Статья затрат УУ': df['Статья затрат УУ'],
+        }, index=df.index)
+        side_measures = [measure for measure in measures if MEASURES[measure][0] == side]
+        for measure in side_measures:
+            frame[measure] = np.where(nd, amounts, 0) if MEASURES[measure][1] else amounts
+        # Строки, не вошедшие ни в один отбор, не группируются;
+        # строки без статьи УУ тоже храним: после дополнения справочника они попадут в отчёт
+        sides.append(frame[segment != 0].groupby(['_segment'] + BASE_COLUMNS, dropna=False)[side_measures].sum())
+    # Группировки плана и факта невелики (по одной строке на сочетание статей) и объединяются сложением
+    grouped = pd.concat(sides).fillna(0)
+    return grouped.groupby(level=['_segment'] + BASE_COLUMNS, dropna=False)[measures].sum()
+
+def _select_base(grouped, bit, measures):
+    """База агрегатов одного отбора из общей группировки (см. _grouped_measures)"""
+    selected = grouped[(grouped.index.get_level_values('_segment') & bit) != 0]
+    base = selected.groupby(level=BASE_COLUMNS, dropna=False)[measures].sum().reset_index()
+    # Порядок показателей - как в группировках по сторонам (сначала план, затем факт)
+    base = base[BASE_COLUMNS + sorted(measures, key=lambda measure: MEASURES[measure][0] != 'План')]
+    base[measures] = base[measures].astype('int64')
+    return base
+
+def run_plan(plan, expense_plan_df, expense_fact_df):
+    """
+    Выполняет план агрегации (compile_reports). Возвращает ({отчёт: база агрегатов}, признак "Сметы" -
+    в файлах заполнены номенклатурные группы).
+    """
+    _check_required_columns(expense_plan_df, expense_fact_df)
+    by_nomenclature = _is_budget_report(expense_plan_df, expense_fact_df)
+    grouped = _grouped_measures(expense_plan_df, expense_fact_df, plan['filters'], plan['measures'], by_nomenclature)
+    bases = {
+        name: _select_base(grouped, 1 << plan['filters'].index(definition['filter']), definition['measures'])
+        for name, definition in plan['reports'].items()
+    }
+    return bases, by_nomenclature
+
+def items_from_base(base_df, normalize, levels=ITEM_COLUMNS, measures=MEASURE_COLUMNS):
+    """Агрегаты по статьям отчёта из базы (см. run_plan)"""
+    items = normalize(base_df.drop(columns='Статья затрат БУ'))
+    return items.groupby(levels)[measures].sum().reset_index()
+
+def report_items(base_df, definition):
+    """Агрегаты по статьям отчёта из его базы по описанию отчёта"""
+    return items_from_base(base_df, definition['normalize'], definition['levels'], definition['measures'])
+
+def build_report(merged_df, definition=REPORTS['smeta']):
+    """
+    Формирует строки отчёта (подразделы, статьи, итог) из агрегатов по статьям.
+    Дополнительные числовые колонки (например, сравнение периодов) переносятся как есть.
+    Агрегаты - в копейках, суммы в готовом отчёте - в рублях.
+    """
+    merged_df = merged_df.copy()
+    group_level, item_level = definition['levels']
+
+    # Расчёт отклонений
+    for col, (minuend, subtrahend) in definition['derived'].items():
+        merged_df[col] = merged_df[minuend] - merged_df[subtrahend]
+
+    extra_columns = [col for col in merged_df.columns if col not in definition['levels'] and col not in definition['columns']]
+    value_columns = definition['columns'] + extra_columns
+
+    # Создаём структуру отчёта с корректными суммами по подразделам
+    report_data = []
+    subsection_counter = 1
+
+    # Сначала считаем суммы по подразделам
+    subsection_totals = merged_df.groupby(group_level)[value_columns].sum().reset_index()
+
+    # Общие итоги
+    totals = merged_df[value_columns].sum()
+    for col, (minuend, subtrahend) in definition['derived'].items():
+        totals[col] = totals[minuend] - totals[subtrahend]
+
+    # Сортируем данные
+    merged_df.sort_values(by=definition['levels'], inplace=True)
+
+    # Формируем отчёт
+    for subsection in subsection_totals[group_level].unique():
+        # Добавляем строку подраздела
+        subsection_row = subsection_totals[subsection_totals[group_level] == subsection].iloc[0]
+        row = {'Код строки': f"{subsection_counter}.", 'Статья расходов': subsection}
+        row.update({col: subsection_row[col] for col in value_columns})
+        row['is_subsection'] = True
+        report_data.append(row)
+
+        # Добавляем статьи затрат этого подраздела
+        items = merged_df[merged_df[group_level] == subsection]
+        item_counter = 1
+        for _, item in items.iterrows():
+            row = {'Код строки': f"{subsection_counter}.{item_counter}", 'Статья расходов': item[item_level]}
+            row.update({col: item[col] for col in value_columns})
+            row['is_subsection'] = False
+            report_data.append(row)
+            item_counter += 1
+
+        subsection_counter += 1
+
+    # Добавляем итоговую строку
+    row = {'Код строки': 'Итого', 'Статья расходов': ''}
+    row.update({col: totals[col] for col in value_columns})
+    row['is_subsection'] = False
+    report_data.append(row)
+
+    report_df = pd.DataFrame(report_data)
+    report_df[value_columns] = to_rubles(report_df[value_columns].astype('int64'))
+    return report_df
+
+def _check_required_columns(expense_plan_df, expense_fact_df):
+    required_columns = {'Сумма', 'Статья затрат УУ', 'НД'}
+    for col in required_columns:
+        if col not in expense_plan_df.columns or col not in expense_fact_df.columns:
+            raise ValueError(f"Отсутствует обязательный столбец: {col}")
+
+def _is_budget_report(expense_plan_df, expense_fact_df):
+    """Определяет тип отчёта по наличию номенклатурной группы"""
+    is_budget_report = 'Номенклатурная группа' in expense_plan_df.columns and 'Номенклатурная группа' in expense_fact_df.columns
+    is_budget_report = is_budget_report and not expense_plan_df['Номенклатурная группа'].isna().all()
+    is_budget_report = is_budget_report and not expense_fact_df['Номенклатурная группа'].isna().all()
+    return is_budget_report
+
+def create_reports(names, expense_plan_df, expense_fact_df):
+    """
+    Строит несколько отчётов по одним файлам плана и факта одним планом агрегации.
+    Возвращает ({отчёт: строки отчёта}, признак "Сметы").
+    """
+    bases, is_budget_report = run_plan(compile_reports(names), expense_plan_df, expense_fact_df)
+    return {name: build_report(report_items(bases[name], REPORTS[name]), REPORTS[name]) for name in names}, is_budget_report
+
+def create_report(expense_plan_df, expense_fact_df):
+    """
+    Создаёт отчёт с корректным расчётом сумм по подразделам
+    """
+    reports, is_budget_report = create_reports(['smeta'], expense_plan_df, expense_fact_df)
+    return reports['smeta'], is_budget_report
+
+def create_admin_report(expense_plan_df, expense_fact_df):
+    """
+    Создаёт управленческий отчёт с корректным расчётом сумм по подразделам
+    """
+    reports, is_budget_report = create_reports(['admin'], expense_plan_df, expense_fact_df)
+    return reports['admin'], is_budget_report
+
+# --- Помесячные агрегаты и сравнение периодов ---
+#
+# Для каждого вида отчёта хранятся агрегаты по статьям за каждый месяц
+# (monthly/ГГГГ-ММ.parquet) и накопленные итоги (cumulative/ГГГГ-ММ.parquet) -
+# сумма всех сохранённых месяцев до указанного включительно.
+# Итог за любое окно (квартал, год, 12 месяцев) - разность двух накопленных
+# итогов, поэтому новый месяц добавляется одним сложением без пересчёта года.
+# Суммы хранятся в копейках (int64), поэтому разности накопленных итогов точные.
+#
+# Рядом хранится база месяца (base/ГГГГ-ММ.parquet) - суммы по исходным статьям
+# БУ и УУ до сопоставления статей отчёта, и обратный индекс (index.parquet):
+# значение статьи -> месяцы, в базе которых оно встречается. После правки
+# справочника (см. pereschet.py) пересчитываются только эти месяцы и только
+# строки базы с изменёнными статьями.
+
+AGGREGATES_DIR = os.path.join(base_dir, "aggregates")
+
+# Период сравнения -> подпись в названии колонки
+COMPARISON_PERIODS = {
+    "Предыдущий месяц": "пред. месяц",
+    "С начала квартала": "с начала квартала",
+    "С начала года": "с начала года",
+    "Скользящие 12 месяцев": "12 мес.",
+}
+
+def period_index(year, month):
+    """Порядковый номер месяца (для арифметики периодов)"""
+    return year * 12 + month - 1
+
+def _period_name(index):
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+_aggregates_lock = threading.RLock()
+
+def _aggregates_dir(kind, cumulative):
+    return os.path.join(AGGREGATES_DIR, kind, "cumulative" if cumulative else "monthly")
+
+def _base_path(kind, index):
+    return os.path.join(AGGREGATES_DIR, kind, "base", f"{_period_name(index)}.parquet")
+
+def _tag_path(kind, index):
+    return os.path.join(AGGREGATES_DIR, kind, "base", f"{_period_name(index)}.json")
+
+def _index_path(kind):
+    return os.path.join(AGGREGATES_DIR, kind, "index.parquet")
+
+def _stored_periods(kind, cumulative=False):
+    folder = _aggregates_dir(kind, cumulative)
+    if not os.path.exists(folder):
+        return []
+    periods = []
+    for name in os.listdir(folder):
+        if name.endswith(".parquet"):
+            year, month = name[:-len(".parquet")].split("-")
+            periods.append(period_index(int(year), int(month)))
+    return sorted(periods)
+
+def _read_aggregates(kind, index, cumulative=False):
+    path = os.path.join(_aggregates_dir(kind, cumulative), f"{_period_name(index)}.parquet")
+    if os.path.exists(path):
+        df = pd.read_parquet(path)
+        # Агрегаты, сохранённые в рублях (float), переводим в копейки
+        for col in MEASURE_COLUMNS:
+            if df[col].dtype.kind == 'f':
+                df[col] = amount_column(df[col])
+        return df
+    return pd.DataFrame(columns=ITEM_COLUMNS + MEASURE_COLUMNS)
+
+def _write_aggregates(kind, index, df, cumulative=False):
+    folder = _aggregates_dir(kind, cumulative)
+    os.makedirs(folder, exist_ok=True)
+    df.to_parquet(os.path.join(folder, f"{_period_name(index)}.parquet"), index=False)
+
+def _combine(left, right, sign=1):
+    """Складывает (или вычитает при sign=-1) агрегаты с объединением статей"""
+    right = right.copy()
+    right[MEASURE_COLUMNS] = right[MEASURE_COLUMNS] * sign
+    frames = [df for df in (left, right) if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=ITEM_COLUMNS + MEASURE_COLUMNS)
+    combined = pd.concat(frames, ignore_index=True).groupby(ITEM_COLUMNS)[MEASURE_COLUMNS].sum().reset_index()
+    # Статьи, обнулившиеся после вычитания, не храним
+    return combined[(combined[MEASURE_COLUMNS] != 0).any(axis=1)].reset_index(drop=True)
+
+def _cumulative_at(kind, index, periods=None):
+    """Накопленный итог на конец месяца index (по последнему сохранённому месяцу не позже него)"""
+    if periods is None:
+        periods = _stored_periods(kind, cumulative=True)
+    earlier = [p for p in periods if p <= index]
+    if not earlier:
+        return pd.DataFrame(columns=ITEM_COLUMNS + MEASURE_COLUMNS)
+    return _read_aggregates(kind, earlier[-1], cumulative=True)
+
+def _shift_cumulative(kind, index, delta, periods=None):
+    """Прибавляет изменение месяца index к его накопленному итогу и ко всем более поздним"""
+    if periods is None:
+        periods = _stored_periods(kind, cumulative=True)
+    base = _read_aggregates(kind, index, cumulative=True) if index in periods else _cumulative_at(kind, index, periods)
+    _write_aggregates(kind, index, _combine(base, delta), cumulative=True)
+
+    # Более поздние месяцы (при повторной загрузке прошлого месяца) сдвигаем на ту же разницу
+    for later in (p for p in periods if p > index):
+        _write_aggregates(kind, later, _combine(_read_aggregates(kind, later, cumulative=True), delta), cumulative=True)
+
+def store_month_aggregates(kind, year, month, items_df, base_df=None, versions=None):
+    """
+    Сохраняет агрегаты по статьям за месяц и вносит изменение в накопленные итоги.
+    Повторное сохранение месяца учитывается как разница со старыми агрегатами.
+    base_df - база месяца (run_plan) для пересчёта после правки справочников,
+    versions - версии справочников {файл: версия}, по которым посчитаны агрегаты.
+    """
+    index = period_index(year, month)
+    new = items_df[ITEM_COLUMNS + MEASURE_COLUMNS]
+    with _aggregates_lock:
+        delta = _combine(new, _read_aggregates(kind, index), sign=-1)
+        _write_aggregates(kind, index, new)
+        _shift_cumulative(kind, index, delta)
+        if base_df is not None:
+            _write_base(kind, index, base_df)
+        if versions:
+            _update_tag(kind, index, versions)
+
+def _update_tag(kind, index, versions):
+    """Запоминает версии справочников, по которым посчитан месяц"""
+    tag = _read_tag(kind, index)
+    tag.update(versions)
+    path = _tag_path(kind, index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tag, f, ensure_ascii=False)
+
+def _read_tag(kind, index):
+    path = _tag_path(kind, index)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def month_dictionary_versions(kind, year, month):
+    """Версии справочников {файл: версия}, по которым посчитаны сохранённые агрегаты месяца"""
+    return _read_tag(kind, period_index(year, month))
+
+def comparison_versions(kind, year, month, periods, versions):
+    """
+    Месяцы сравнения (compare_periods), агрегаты которых посчитаны по другим версиям справочников,
+    чем versions: {"ММ.ГГГГ": {файл: версия месяца}}, только отличающиеся файлы.
+    """
+    months = set()
+    for period in periods:
+        start, end = _comparison_window(year, month, period)
+        months.update(range(start + 1, end + 1))
+    months = sorted(months & set(_stored_periods(kind)))
+    result = {}
+    for index in months:
+        tag = month_dictionary_versions(kind, index // 12, index % 12 + 1)
+        changed = {filename: version for filename, version in tag.items() if versions.get(filename, version) != version}
+        if changed:
+            result[f"{index % 12 + 1:02d}.{index // 12}"] = changed
+    return result
+
+def _read_base(kind, index):
+    path = _base_path(kind, index)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return pd.DataFrame(columns=BASE_COLUMNS + MEASURE_COLUMNS)
+
+def _write_base(kind, index, base_df):
+    """Сохраняет базу месяца и обновляет обратный индекс статей"""
+    path = _base_path(kind, index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    base_df[BASE_COLUMNS + MEASURE_COLUMNS].to_parquet(path, index=False)
+
+    keys = pd.concat([
+        pd.DataFrame({'Поле': col, 'Ключ': base_df[col].dropna().astype(str).unique()})
+        for col in BASE_COLUMNS
+    ], ignore_index=True)
+    keys['Период'] = index
+    stored = _read_index(kind)
+    pd.concat([stored[stored['Период'] != index], keys], ignore_index=True).to_parquet(_index_path(kind), index=False)
+
+def _read_index(kind):
+    if os.path.exists(_index_path(kind)):
+        return pd.read_parquet(_index_path(kind))
+    return pd.DataFrame({'Поле': pd.Series(dtype=object), 'Ключ': pd.Series(dtype=object), 'Период': pd.Series(dtype='int64')})
+
+def indexed_keys(kind, field):
+    """Все значения поля базы, встречающиеся в сохранённых месяцах"""
+    stored = _read_index(kind)
+    return set(stored.loc[stored['Поле'] == field, 'Ключ'])
+
+def recompute_month_items(kind, field, keys, normalize_old, normalize_new, update_base=None, versions=None):
+    """
+    Пересчитывает сохранённые агрегаты после правки справочника.
+    По обратному индексу выбираются месяцы, где в поле базы field встречаются keys;
+    в них пересчитываются только строки базы с этими значениями: разница между
+    статьями отчёта по новому (normalize_new) и старому (normalize_old) сопоставлению
+    добавляется к агрегатам месяца и накопленным итогам.
+    update_base(rows) возвращает строки базы с новыми исходными статьями (если они меняются),
+    versions - новые версии справочников для метки пересчитанных месяцев.
+    Возвращает (число месяцев, число строк базы).
+    """
+    keys = set(keys)
+    with _aggregates_lock:
+        stored = _read_index(kind)
+        periods = sorted(stored.loc[(stored['Поле'] == field) & stored['Ключ'].isin(keys), 'Период'].unique())
+        cumulative_periods = _stored_periods(kind, cumulative=True)
+        months = rows = 0
+        for index in periods:
+            base = _read_base(kind, index)
+            mask = base[field].isin(keys)
+            if not mask.any():
+                continue
+            old_rows = base[mask]
+            new_rows = update_base(old_rows.copy()) if update_base is not None else old_rows
+            delta = _combine(items_from_base(new_rows, normalize_new), items_from_base(old_rows, normalize_old), sign=-1)
+
+            if update_base is not None:
+                base = pd.concat([base[~mask], new_rows], ignore_index=True)
+                base = base.groupby(BASE_COLUMNS, dropna=False)[MEASURE_COLUMNS].sum().reset_index()
+                _write_base(kind, int(index), base)
+            if not delta.empty:
+                _write_aggregates(kind, int(index), _combine(_read_aggregates(kind, int(index)), delta))
+                _shift_cumulative(kind, int(index), delta, cumulative_periods)
+            if versions:
+                _update_tag(kind, int(index), versions)
+            months += 1
+            rows += int(mask.sum())
+    return months, rows
+
+def window_aggregates(kind, start_index, end_index):
+    """Сумма агрегатов за месяцы (start_index, end_index]"""
+    periods = _stored_periods(kind, cumulative=True)
+    return _combine(_cumulative_at(kind, end_index, periods), _cumulative_at(kind, start_index, periods), sign=-1)
+
+def _comparison_window(year, month, period):
+    """Месяцы периода сравнения (start_index, end_index] для window_aggregates"""
+    index = period_index(year, month)
+    return {
+        "Предыдущий месяц": (index - 2, index - 1),
+        "С начала квартала": (index - (month - 1) % 3 - 1, index),
+        "С начала года": (index - month, index),
+        "Скользящие 12 месяцев": (index - 12, index),
+    }[period]
+
+def compare_periods(kind, year, month, periods):
+    """
+    Собирает колонки сравнения (План/Факт за каждый выбранный период) по статьям.
+    Используются только сохранённые агрегаты, исходные файлы не перечитываются.
+    """
+    result = pd.DataFrame(columns=ITEM_COLUMNS)
+    for period in periods:
+        label = COMPARISON_PERIODS[period]
+        window = window_aggregates(kind, *_comparison_window(year, month, period))[ITEM_COLUMNS + ['План', 'Факт']]
+        window = window.rename(columns={'План': f'План ({label})', 'Факт': f'Факт ({label})'})
+        result = pd.merge(result, window, on=ITEM_COLUMNS, how='outer')
+    return result
+
+def add_comparisons(merged_df, comparison_df):
+    """Добавляет колонки сравнения к агрегатам текущего периода"""
+    if comparison_df.empty and len(comparison_df.columns) == len(ITEM_COLUMNS):
+        return merged_df
+    merged_df = pd.merge(merged_df, comparison_df, on=ITEM_COLUMNS, how='outer')
+    value_columns = [col for col in merged_df.columns if col not in ITEM_COLUMNS]
+    merged_df[value_columns] = merged_df[value_columns].fillna(0).astype('int64')
+    return merged_df
+
+# --- Прибыль и убытки ---
+
+PNL_GROUP_COLUMNS = ['Бизнес-направление', 'Филиал']
+INCOME_REQUIRED_COLUMNS = ['Филиал', 'Сумма', 'Бизнес-направление']
+EXPENSE_REQUIRED_COLUMNS = ['Филиал', 'Сумма', 'Бизнес-направление', 'Статья затрат УУ']
+
+def read_excel_files(files, max_workers=8, progress=None):
+    """
+    Читает несколько Excel-файлов параллельно (порядок результатов совпадает с порядком файлов).
+    progress(прочитано, всего) вызывается после чтения каждого файла.
+    """
+    if not files:
+        return []
+    results = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as pool:
+        futures = {pool.submit(pd.read_excel, file): i for i, file in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, len(files))
+    return results
+
+def split_pnl_sources(named_frames):
+    """
+    Разделяет проверенные файлы на доходы и расходы.
+    Файл расходов определяется по наличию статьи затрат. Возвращает (доходы, расходы), суммы в копейках.
+    """
+    income_dfs, expense_dfs = [], []
+    for name, df in named_frames:
+        is_expense = 'Статья затрат УУ' in df.columns or 'Статья затрат БУ' in df.columns
+        required_columns = EXPENSE_REQUIRED_COLUMNS if is_expense else INCOME_REQUIRED_COLUMNS
+        missing_cols = [col for col in required_columns if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"Файл {name} не содержит колонок: {', '.join(missing_cols)}")
+
+        # Служебная строка с месяцем и годом в конце обработанного файла не содержит суммы
+        df = df.copy()
+        df['Сумма'] = to_kopecks(df['Сумма']).to_numpy()
+        df = df[df['Сумма'].notna()]
+        df['Сумма'] = df['Сумма'].astype('int64')
+        (expense_dfs if is_expense else income_dfs).append(df)
+
+    income_df = pd.concat(income_dfs, ignore_index=True) if income_dfs else pd.DataFrame(columns=INCOME_REQUIRED_COLUMNS)
+    expense_df = pd.concat(expense_dfs, ignore_index=True) if expense_dfs else pd.DataFrame(columns=EXPENSE_REQUIRED_COLUMNS)
+    return income_df, expense_df
+
+def _add_margin(df):
+    df['Маржа'] = df['Выручка'] - df['Расходы']
+    revenue = df['Выручка'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['Маржа, %'] = np.where(revenue != 0, df['Маржа'].to_numpy(dtype=float) / revenue * 100, np.nan)
+    return df
+
+def create_pnl_report(income_df, expense_df):
+    """
+    Считает выручку, расходы, маржу и маржинальность по бизнес-направлениям и филиалам.
+    Суммы на входе - в копейках (см. split_pnl_sources), в отчёте - в рублях.
+    Возвращает (отчёт с итогами по направлениям, выручка по видам услуг).
+    """
+    revenue = income_df.groupby(PNL_GROUP_COLUMNS, dropna=False)['Сумма'].sum().rename('Выручка')
+    cost = expense_df.groupby(PNL_GROUP_COLUMNS, dropna=False)['Сумма'].sum().rename('Расходы')
+    detail = pd.concat([revenue, cost], axis=1).fillna(0).astype('int64').reset_index()
+    detail[PNL_GROUP_COLUMNS] = detail[PNL_GROUP_COLUMNS].fillna('(не указано)')
+
+    # Итоги по направлениям и общий итог
+    by_direction = detail.groupby('Бизнес-направление')[['Выручка', 'Расходы']].sum().reset_index()
+    by_direction['Филиал'] = 'Итого по направлению'
+    detail['_order'] = 0
+    by_direction['_order'] = 1
+    report_df = pd.concat([detail, by_direction], ignore_index=True)
+    report_df.sort_values(['Бизнес-направление', '_order', 'Филиал'], inplace=True)
+
+    total_row = pd.DataFrame([{
+        'Бизнес-направление': 'ИТОГО',
+        'Филиал': '',
+        'Выручка': detail['Выручка'].sum(),
+        'Расходы': detail['Расходы'].sum(),
+    }])
+    report_df = pd.concat([report_df.drop(columns='_order'), total_row], ignore_index=True)
+    report_df = _add_margin(report_df)
+    report_df[['Выручка', 'Расходы', 'Маржа']] = to_rubles(report_df[['Выручка', 'Расходы', 'Маржа']])
+
+    # Структура выручки по видам услуг
+    if 'Вид услуг' in income_df.columns:
+        services_df = income_df.groupby(['Бизнес-направление', 'Вид услуг'], dropna=False)['Сумма'].sum().reset_index()
+        services_df.rename(columns={'Сумма': 'Выручка'}, inplace=True)
+        services_df['Выручка'] = to_rubles(services_df['Выручка'])
+    else:
+        services_df = pd.DataFrame(columns=['Бизнес-направление', 'Вид услуг', 'Выручка'])
+
+    return report_df[PNL_GROUP_COLUMNS + ['Выручка', 'Расходы', 'Маржа', 'Маржа, %']], services_df
+
+# --- Сводный отчёт ---
+
+CONSOLIDATION_COLUMNS = ['Код строки', 'Статья расходов'] + VALUE_COLUMNS
+
+def _row_code_sort_key(code):
+    """Ключ сортировки кодов строк вида "1.", "1.2": подраздел перед своими статьями, Итого в конце"""
+    if not isinstance(code, str):
+        code = str(code)
+    if code == 'ИТОГО':
+        return (float('inf'),)
+    parts = code.rstrip('.').split('.')
+    try:
+        return tuple(int(part) if part.isdigit() else float('inf') for part in parts)
+    except:
+        return (float('inf'),)
+
+def consolidate_reports(named_frames):
+    """
+    Суммирует несколько выгруженных отчётов по коду строки и статье расходов (в копейках).
+    Возвращает (сводный отчёт, имена файлов с неверной структурой).
+    """
+    dfs = []
+    skipped = []
+    for name, df in named_frames:
+        # Пропускаем строку "Период отчета:"
+        df = df[~df.iloc[:, 0].astype(str).str.contains('Период отчета:', na=False)]
+
+        if not all(col in df.columns for col in CONSOLIDATION_COLUMNS):
+            skipped.append(name)
+            continue
+
+        # Преобразуем код строки в строковый тип, суммы - в копейки
+        df = df.copy()
+        df['Код строки'] = df['Код строки'].astype(str)
+        df = df[df['Код строки'] != 'Итого']
+        for col in VALUE_COLUMNS:
+            df[col] = amount_column(df[col])
+        dfs.append(df)
+
+    if not dfs:
+        return None, skipped
+
+    # Группировка по статье расходов и суммирование
+    all_data = pd.concat(dfs)
+    grouped_data = all_data.groupby(['Код строки', 'Статья расходов'])[VALUE_COLUMNS].sum().reset_index()
+
+    # Итоговая строка - по строкам подразделов ("1.", "2."), статьи в них уже учтены
+    subsections = grouped_data[grouped_data['Код строки'].str.endswith('.')]
+    total_row = {
+        'Код строки': 'ИТОГО',
+        'Статья расходов': '',
+        'План': subsections['План'].sum(),
+        'Факт': subsections['Факт'].sum(),
+        'Отклонение': subsections['Факт'].sum() - subsections['План'].sum(),
+        'План НД': subsections['План НД'].sum(),
+        'Факт НД': subsections['Факт НД'].sum(),
+        'Отклонение НД': subsections['Факт НД'].sum() - subsections['План НД'].sum()
+    }
+
+    # Сортировка по коду строки, итог в конце
+    grouped_data = grouped_data.assign(sort_key=grouped_data['Код строки'].apply(_row_code_sort_key))
+    grouped_data = grouped_data.sort_values('sort_key').drop('sort_key', axis=1)
+    consolidated_df = pd.concat([grouped_data, pd.DataFrame([total_row])], ignore_index=True)
+    consolidated_df[VALUE_COLUMNS] = to_rubles(consolidated_df[VALUE_COLUMNS].astype('int64'))
+    return consolidated_df, skipped
+
+# --- Фоновые задачи построения отчётов (см. jobs.py) ---
+#
+# Источник данных - файл, переданный парой (имя, содержимое в байтах), чтобы задача
+# не зависела от виджетов загрузки сессии, или идентификатор проверенного набора
+# данных (см. nabory.py). Результат - словарь с таблицами и готовым Excel.
+
+def source_name(source):
+    """Имя файла или подпись набора данных"""
+    if isinstance(source, str):
+        return f"набор {source}"
+    return source[0]
+
+def _read_task_files(job, sources, start, end):
+    def progress(done, total):
+        job.set_progress(start + (end - start) * done / total, f"прочитано файлов: {done} из {total}")
+
+    with stage("чтение файлов") as record:
+        # Наборы данных отображаются в память, Excel-файлы читаются параллельно
+        dfs = [nabory.load(source) if isinstance(source, str) else None for source in sources]
+        files = [(i, BytesIO(source[1])) for i, source in enumerate(sources) if not isinstance(source, str)]
+        for (i, _), df in zip(files, read_excel_files([file for _, file in files], progress=progress)):
+            dfs[i] = df
+        record["rows"] = sum(len(df) for df in dfs)
+    return dfs
+
+def build_budget_report_task(job, plan_file, fact_file, period_start, period_end, comparison_periods):
+    """Формирует "Смету" с сохранением агрегатов месяца и сравнением периодов"""
+    expense_plan_df, expense_fact_df = _read_task_files(job, [plan_file, fact_file], 0.0, 0.5)
+
+    versions = report_dictionary_versions("smeta")
+    job.set_progress(0.6, "группировка по статьям")
+    with stage("группировка по статьям", rows=len(expense_plan_df) + len(expense_fact_df)):
+        bases, is_budget_report = run_plan(compile_reports(['smeta']), expense_plan_df, expense_fact_df)
+        base_df = bases['smeta']
+        merged_df = report_items(base_df, REPORTS['smeta'])
+    # Статьи только в плане или только в факте и строки, не попавшие в отчёт
+    with stage("сверка плана и факта", rows=len(base_df)):
+        reconciliation = sverka.reconcile(base_df, REPORTS['smeta']['normalize'])
+
+    # Отчёт за один месяц сохраняем и дополняем сравнением периодов
+    warnings = []
+    if (period_start.year, period_start.month) == (period_end.year, period_end.month):
+        with stage("сохранение агрегатов месяца", rows=len(merged_df)):
+            store_month_aggregates("smeta", period_start.year, period_start.month, merged_df, base_df, versions)
+        if comparison_periods:
+            job.set_progress(0.7, "сравнение периодов")
+            with stage("сравнение периодов", rows=len(merged_df)):
+                merged_df = add_comparisons(
+                    merged_df,
+                    compare_periods("smeta", period_start.year, period_start.month, comparison_periods)
+                )
+                stale = comparison_versions("smeta", period_start.year, period_start.month, comparison_periods, versions)
+                if stale:
+                    warnings.append("Месяцы сравнения посчитаны по другим версиям справочников: " + "; ".join(
+                        f"{name} ({', '.join(f'{filename} - {version}' for filename, version in changed.items())})"
+                        for name, changed in stale.items()
+                    ))
+    elif comparison_periods:
+        warnings.append("Сравнение периодов доступно только для отчёта за один календарный месяц")
+
+    job.set_progress(0.8, "формирование отчёта")
+    with stage("формирование строк отчёта", rows=len(merged_df)):
+        report_df = build_report(merged_df, REPORTS['smeta'])
+
+    job.set_progress(0.9, "выгрузка в Excel")
+    report_period = f"{period_start.strftime('%d.%m.%Y')} – {period_end.strftime('%d.%m.%Y')}"
+    with stage("save_to_excel", rows=len(report_df)):
+        excel_data = save_to_excel(report_df, report_period)
+    return {
+        "report_df": report_df,
+        "is_budget_report": is_budget_report,
+        "excel_data": excel_data,
+        "reconciliation": reconciliation,
+        "warnings": warnings,
+        "dictionary_versions": versions,
+    }
+
+def build_admin_report_task(job, plan_file, fact_file, period_start, period_end):
+    """Формирует управленческий отчёт"""
+    expense_plan_df, expense_fact_df = _read_task_files(job, [plan_file, fact_file], 0.0, 0.5)
+
+    versions = report_dictionary_versions("admin")
+    job.set_progress(0.6, "группировка по статьям")
+    with stage("управленческий отчёт", rows=len(expense_plan_df) + len(expense_fact_df)):
+        bases, _ = run_plan(compile_reports(['admin']), expense_plan_df, expense_fact_df)
+        base_df = bases['admin']
+        report_df = build_report(report_items(base_df, REPORTS['admin']), REPORTS['admin'])
+    with stage("сверка плана и факта", rows=len(base_df)):
+        reconciliation = sverka.reconcile(base_df, REPORTS['admin']['normalize'])
+
+    job.set_progress(0.9, "выгрузка в Excel")
+    report_period = f"{period_start.strftime('%d.%m.%Y')} – {period_end.strftime('%d.%m.%Y')}"
+    with stage("save_to_excel", rows=len(report_df)):
+        excel_data = save_to_excel(report_df, report_period)
+    return {
+        "report_df": report_df,
+        "excel_data": excel_data,
+        "reconciliation": reconciliation,
+        "warnings": [],
+        "dictionary_versions": versions,
+    }
+
+def build_pnl_report_task(job, files):
+    """Формирует отчёт о прибылях и убытках"""
+    dfs = _read_task_files(job, files, 0.0, 0.7)
+
+    job.set_progress(0.8, "расчёт маржи")
+    with stage("прибыль и убытки", rows=sum(len(df) for df in dfs)):
+        income_df, expense_df = split_pnl_sources(zip([source_name(source) for source in files], dfs))
+        pnl_df, services_df = create_pnl_report(income_df, expense_df)
+
+    warnings = []
+    if income_df.empty:
+        warnings.append("Не загружено ни одного файла доходов - выручка будет нулевой")
+    if expense_df.empty:
+        warnings.append("Не загружено ни одного файла расходов - расходы будут нулевыми")
+
+    job.set_progress(0.9, "выгрузка в Excel")
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        pnl_df.to_excel(writer, index=False, sheet_name='Отчёт')
+        services_df.to_excel(writer, index=False, sheet_name='Виды услуг')
+
+    return {
+        "report_df": pnl_df,
+        "services_df": services_df,
+        "income_rows": len(income_df),
+        "expense_rows": len(expense_df),
+        "excel_data": output.getvalue(),
+        "warnings": warnings,
+    }
+
+def build_consolidated_report_task(job, files):
+    """Формирует сводный отчёт по нескольким выгруженным отчётам"""
+    dfs = _read_task_files(job, files, 0.0, 0.8)
+
+    job.set_progress(0.85, "суммирование")
+    with stage("сводный отчёт", rows=sum(len(df) for df in dfs)):
+        consolidated_df, skipped = consolidate_reports(zip([name for name, _ in files], dfs))
+    warnings = [f"Файл {name} не содержит всех необходимых колонок" for name in skipped]
+    if consolidated_df is None:
+        raise ValueError("Нет файлов с корректной структурой")
+
+    job.set_progress(0.9, "выгрузка в Excel")
+    excel_data = BytesIO()
+    with pd.ExcelWriter(excel_data, engine='openpyxl') as writer:
+        consolidated_df.to_excel(writer, index=False, sheet_name='Сводный отчет')
+
+    return {
+        "report_df": consolidated_df,
+        "files_count": len(files) - len(skipped),
+        "excel_data": excel_data.getvalue(),
+        "warnings": warnings,
+    }
+
+# --- Распределение управленческих расходов (см. raspredelenie.py) ---
+
+def allocation_dictionary_versions():
+    """Версии справочников распределения {файл: версия}"""
+    return istoriya.file_versions([
+        raspredelenie.dictionary_path(raspredelenie.DRIVERS_CSV),
+        raspredelenie.dictionary_path(raspredelenie.HEADCOUNT_CSV),
+    ])
+
+def build_allocation_task(job, files, default_driver):
+    """Распределяет управленческие расходы по филиалам и бизнес-направлениям"""
+    dfs = _read_task_files(job, files, 0.0, 0.7)
+
+    versions = allocation_dictionary_versions()
+    item_drivers = raspredelenie.load_item_drivers()
+    job.set_progress(0.8, "распределение")
+    with stage("распределение управленческих расходов", rows=sum(len(df) for df in dfs)):
+        income_df, expense_df = split_pnl_sources(zip([source_name(source) for source in files], dfs))
+        allocation_df, unallocated_df = raspredelenie.allocate(
+            income_df, expense_df, item_drivers, default_driver, raspredelenie.load_headcount()
+        )
+        summary_df = raspredelenie.allocation_summary(income_df, expense_df, allocation_df)
+
+    warnings = []
+    unknown = sorted({str(driver) for driver in item_drivers.values() if driver not in raspredelenie.DRIVERS})
+    if unknown:
+        warnings.append(f"Неизвестные базы распределения в справочнике: {', '.join(unknown)} - "
+                        f"для этих статей используется база «{default_driver}»")
+    if allocation_df.empty and unallocated_df.empty:
+        warnings.append("В данных расходов нет управленческих расходов (строк без номенклатурной группы)")
+    if not unallocated_df.empty:
+        warnings.append(
+            f"Не распределено {to_rubles(unallocated_df['Сумма'].sum()):,.2f} руб.: нет значений базы "
+            + ", ".join(f"«{driver}»" for driver in unallocated_df['База распределения'].unique())
+        )
+
+    # Итоговая строка
+    total_row = summary_df.drop(columns=raspredelenie.CELL_COLUMNS).sum()
+    total_row["Филиал"], total_row["Бизнес-направление"] = "ИТОГО", ""
+    summary_df = pd.concat([summary_df, pd.DataFrame([total_row])], ignore_index=True)
+    amount_columns = [col for col in summary_df.columns if col not in raspredelenie.CELL_COLUMNS]
+    summary_df[amount_columns] = to_rubles(summary_df[amount_columns].astype('int64'))
+    allocation_df['Сумма'] = to_rubles(allocation_df['Сумма'])
+    unallocated_df['Сумма'] = to_rubles(unallocated_df['Сумма'])
+
+    job.set_progress(0.9, "выгрузка в Excel")
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        summary_df.to_excel(writer, index=False, sheet_name='Распределение')
+        allocation_df.to_excel(writer, index=False, sheet_name='По статьям')
+        if not unallocated_df.empty:
+            unallocated_df.to_excel(writer, index=False, sheet_name='Не распределено')
+
+    return {
+        "report_df": summary_df,
+        "allocation_df": allocation_df,
+        "unallocated_df": unallocated_df,
+        "excel_data": output.getvalue(),
+        "warnings": warnings,
+        "dictionary_versions": versions,
+    }
+
+def save_to_excel(df, report_period):
+    """Сохраняет DataFrame в Excel с правильным форматированием"""
+    from openpyxl.styles import PatternFill
+    from openpyxl.utils import get_column_letter
+
+    columns = [col for col in df.columns if col != 'is_subsection']
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(
+            writer,
+            sheet_name='Отчёт',
+            index=False,
+            columns=columns
+        )
+
+        # Получаем объект workbook и worksheet для форматирования
+        worksheet = writer.sheets['Отчёт']
+
+        # Устанавливаем ширину столбцов
+        worksheet.column_dimensions['A'].width = 10
+        worksheet.column_dimensions['B'].width = 50
+        for j in range(3, len(columns) + 1):
+            worksheet.column_dimensions[get_column_letter(j)].width = 15
+
+        # Форматирование чисел
+        yellow_fill = PatternFill(start_color='FFFF99', end_color='FFFF99', fill_type='solid')
+
+        for i, row in enumerate(df.itertuples(index=False), start=2):
+            if getattr(row, 'is_subsection', False) or row[0] == 'Итого':
+                for j in range(1, len(columns) + 1):
+                    worksheet.cell(row=i, column=j).fill = yellow_fill
+
+        # Добавим дату в конец
+        worksheet.cell(row=worksheet.max_row + 2, column=1, value="Период отчета:")
+        worksheet.cell(row=worksheet.max_row, column=2, value=report_period)
+        for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=3, max_col=len(columns)):
+            for cell in row:
+                cell.number_format = '#,##0.00'
+
+    return output.getvalue()
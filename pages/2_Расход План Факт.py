@@ -2,43 +2,195 @@ import streamlit as st
 import pandas as pd
 import os
 from io import BytesIO
-from spravochniki import load_dictionary, edit_dictionary_ui, init_dictionaries
+from spravochniki import load_dictionary, edit_dictionary_ui, init_dictionaries, suggestions_ui, dictionary_versions
+from proverka import MAX_ERRORS, MONTHS, check_preview, processed_file
+from pometki import error_workbook
+import hranilishche
+import jobs
+import nabory
+from svyazi import broken_links
+from zagruzka import check_upload_task, publish_checked
 from pathlib import Path
 
 base_dir = str(Path.home() / "Documents" / "medisapp")
 os.makedirs(os.path.join(base_dir, "dictionaries"), exist_ok=True)
 init_dictionaries()
 
-# --- Загрузка справочников ---
-ref_city = load_dictionary("Филиалы.csv", "Наименование")
-rashod_bu_to_uu = load_dictionary("rashod_bu_to_uu.csv", "Статья затрат БУ", "Статья затрат УУ")
-nomen_to_business = load_dictionary("nomen_to_business.csv", "Номенклатурная группа", "Бизнес-направление")
-nomen_to_service_type = load_dictionary("nomen_to_service_type.csv", "Номенклатурная группа", "Вид услуг")
-business_to_counterparty = load_dictionary("business_to_counterparty.csv", "Бизнес-направление", "Контрагент")
-profile_to_med_direction = load_dictionary("profile_to_med_direction.csv", "Профиль", "Направление медицинских услуг")
-subdivision_mapping = load_dictionary("subdivision_mapping.csv", "Подразделение", "Новое подразделение")
-
-# --- Функции валидации ---
-def validate_city(city_value):
-    return city_value in ref_city
-
-def validate_amount(amount_value):
-    try:
-        float(amount_value)
-        return True
-    except ValueError:
-        return False
+# --- Загрузка справочников (файлы перечитываются только после изменения) ---
+DUPLICATE_MODES = ["Сообщить", "Пропустить"]
+
+# Файлы справочников проверки (их версии записываются в описание набора данных)
+EXPENSE_DICTIONARY_FILES = [
+    "Филиалы.csv",
+    "rashod_bu_to_uu.csv",
+    "nomen_to_business.csv",
+    "nomen_to_service_type.csv",
+    "business_to_counterparty.csv",
+    "profile_to_med_direction.csv",
+    "subdivision_mapping.csv",
+    "subdiv_to_contractor_business.csv",
+]
+
+def load_expense_dictionaries():
+    return {
+        "ref_city": load_dictionary("Филиалы.csv", "Наименование"),
+        "rashod_bu_to_uu": load_dictionary("rashod_bu_to_uu.csv", "Статья затрат БУ", "Статья затрат УУ"),
+        "nomen_to_business": load_dictionary("nomen_to_business.csv", "Номенклатурная группа", "Бизнес-направление"),
+        "nomen_to_service_type": load_dictionary("nomen_to_service_type.csv", "Номенклатурная группа", "Вид услуг"),
+        "business_to_counterparty": load_dictionary("business_to_counterparty.csv", "Бизнес-направление", "Контрагент"),
+        "profile_to_med_direction": load_dictionary("profile_to_med_direction.csv", "Профиль", "Направление медицинских услуг"),
+        "subdivision_mapping": load_dictionary("subdivision_mapping.csv", "Подразделение", "Новое подразделение"),
+        "subdiv_to_contractor_business": load_dictionary("subdiv_to_contractor_business.csv", is_triple=True),
+    }
+
+@st.cache_data(show_spinner=False)
+def download_template():
+    example_data = {
+        "Филиал": [''],
+        "Дата": [''],
+        "Сумма": [''],
+        "Подразделение": [''],
+        "Номенклатурная группа": [''],
+        "Вид услуг": [''],
+        "Бизнес-направление": [''],
+        "Профиль": [''],
+        "Направление медицинских услуг": [''],
+        "Контрагенты": [''],
+        "Статья затрат БУ": [''],
+        "Статья затрат УУ": [''],
+        "НД": ['']
+    }
+
+    template_df = pd.DataFrame(example_data)
+    
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        template_df.to_excel(writer, index=False)
+    
+    return output.getvalue()
+
+def show_duplicates(duplicates):
+    """Сообщает о строках, уже загруженных ранее за тот же месяц"""
+    if duplicates is None:
+        return
+    branches = ", ".join(f"{branch} - {count}" for branch, count in duplicates["branches"].items())
+    datasets = {meta["id"]: meta for meta in nabory.list_datasets()}
+    sources = "; ".join(nabory.describe(datasets[dataset_id]) for dataset_id in duplicates["datasets"] if dataset_id in datasets)
+    # Отпечатки строк хранятся дольше самих наборов (povtory.py)
+    sources = sources or "наборы, которые уже удалены из хранилища"
+    action = "не включены в набор данных" if duplicates.get("skipped") else "включены в набор данных - при сводке они будут учтены дважды"
+    st.warning(f"Строк, уже загруженных ранее: {duplicates['rows']} ({branches}). Они {action}. Ранее загружены в: {sources}")
+
+# Сколько ошибок начала файла показывать, пока проверяется весь файл
+PREVIEW_ERRORS = 20
+
+def show_preview_result(result):
+    """Результат проверки начала файла, пока весь файл проверяется в фоне"""
+    if "exception" in result:
+        return
+    if result["errors"]:
+        st.warning(f"В первых {result['rows']} строках найдено ошибок: {len(result['errors'])}. Проверка всего файла продолжается")
+        with st.expander("Первые найденные ошибки", expanded=True):
+            for error in result["errors"][:PREVIEW_ERRORS]:
+                st.write(error)
+    else:
+        st.info(f"В первых {result['rows']} строках ошибок не найдено. Проверка всего файла продолжается")
+
+def show_check_state():
+    """Показывает итог проверки или, пока весь файл проверяется в фоне, проверку его начала и ход проверки"""
+    result = hranilishche.session_get("expense_check")
+    job_id = st.session_state.get("job_expense_check")
+    if job_id is None:
+        if result is not None:
+            show_check_result(result)
+        return
+
+    job = jobs.get(job_id)
+    if job is None:
+        st.info("Результат проверки устарел и удалён. Проверьте файл заново")
+        return
+    if not job.done:
+        if result is not None:
+            show_preview_result(result)
+        # Индикатор со счётчиками строк и ошибок; по завершении страница перерисуется
+        jobs.session_job("expense_check")
+        return
+    if job.status == jobs.CANCELLED:
+        st.info("Проверка файла отменена")
+        return
+    if job.status == jobs.FAILED:
+        show_check_result({"exception": job.error})
+        return
+    result = job.result
+    if result is None:
+        st.info("Результат проверки устарел и удалён. Проверьте файл заново")
+        return
+    show_check_result(result)
+
+def show_check_result(result):
+    """Показывает результат проверки файла"""
+    if "exception" in result:
+        st.error(f"Ошибка при обработке файла: {result['exception']}")
+        return
+
+    if result["missing_columns"]:
+        st.error(f"В файле отсутствуют обязательные столбцы: {', '.join(result['missing_columns'])}")
+        st.error("Пожалуйста, используйте предоставленный шаблон.")
+        return
+
+    normalized = result.get("normalized")
+    if normalized is not None:
+        st.warning(f"Значения в {normalized['Строка'].nunique()} строках совпали со справочниками только без учёта регистра, пробелов, кавычек и ё - в обработанные данные записано написание справочника")
+        with st.expander("Строки, сопоставленные после нормализации"):
+            st.dataframe(normalized, hide_index=True)
+
+    if result["errors"]:
+        if result.get("stopped"):
+            st.warning(f"Проверка остановлена после {result['rows']} строк: найдено не меньше {MAX_ERRORS} ошибок. Исправьте их и проверьте файл снова")
+        st.error("Найдены ошибки в файле:")
+        for error in result["errors"]:
+            st.write(error)
+        if result.get("suggestions") is not None:
+            suggestions_ui(result["suggestions"], "expense")
 
+        # Файл с отмеченными ошибками нужен только для скачивания, поэтому строится по запросу
+        if result.get("error_frame") is not None and result.get("source") is not None:
+            if st.button("Подготовить файл с отмеченными ошибками (Excel)", key="expense_prepare_errors"):
+                hranilishche.session_put("expense_error_workbook", {"file": error_workbook(result["source"], result["error_frame"])})
+            marked = hranilishche.session_get("expense_error_workbook")
+            if marked is not None:
+                st.download_button(
+                    label="Скачать файл с отмеченными ошибками",
+                    data=marked["file"],
+                    file_name='file_with_errors.xlsx',
+                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                )
+    else:
+        st.success("Файл проверен успешно. Ошибок не найдено.")
+        show_duplicates(result.get("duplicates"))
+        dataset = result["dataset"]
+        if dataset is None:
+            st.info("Все строки файла уже были загружены ранее - новый набор данных не создан")
+            return
+        st.info(f"Данные доступны на странице отчётов без повторной загрузки: {nabory.describe(dataset)}")
 
-def validate_nomen_group(nomen_value):
-    return nomen_value in nomen_to_business.keys()
+        # Файл Excel нужен только для скачивания, поэтому строится по запросу
+        if st.button("Подготовить обработанный файл (Excel)", key="expense_prepare_processed"):
+            hranilishche.session_put("expense_processed", {
+                "dataset_id": dataset["id"],
+                "file": processed_file(nabory.load(dataset["id"]), dataset["month"], dataset["year"]),
+            })
+        processed = hranilishche.session_get("expense_processed")
+        if processed is not None and processed["dataset_id"] == dataset["id"]:
+            st.download_button(
+                label="Скачать обработанный файл",
+                data=processed["file"],
+                file_name='processed_file.xlsx',
+                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
 
-def trim_all_cells(df):
-    # Применяем strip() ко всем строковым колонкам
-    for col in df.columns:
-        if df[col].dtype == 'object':
-            df[col] = df[col].apply(lambda x: x.strip() if isinstance(x, str) else x)
-    return df
+    st.write("Первые строки загруженного файла (после обработки):")
+    st.dataframe(result["preview"])
 
 # --- Интерфейс Streamlit ---
 st.title("Проверка Excel-файла")
@@ -48,36 +200,6 @@ tab1, tab2 = st.tabs(["Проверка файлов", "Управление с
 
 with tab1:
     st.write("Загрузите файл для проверки")
-    
-    def download_template():
-        template_df = pd.DataFrame(columns=[
-            "Филиал", "Сумма", "Подразделение", 
-            "Номенклатурная группа", "Профиль", "Статья затрат БУ", "Статья затрат УУ", "НД"
-        ])
-    
-        example_data = {
-            "Филиал": [''],
-            "Дата": [''],
-            "Сумма": [''],
-            "Подразделение": [''],
-            "Номенклатурная группа": [''],
-            "Вид услуг": [''],
-            "Бизнес-направление": [''],
-            "Профиль": [''],
-            "Направление медицинских услуг": [''],
-            "Контрагенты": [''],
-            "Статья затрат БУ": [''],
-            "Статья затрат УУ": [''],
-            "НД": ['']
-        }
-    
-        template_df = pd.DataFrame(example_data)
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            template_df.to_excel(writer, index=False)
-        
-        return output.getvalue()
 
     st.download_button(
         label="Скачать шаблон файла",
@@ -86,122 +208,46 @@ with tab1:
         mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
 
-    uploaded_file = st.file_uploader("Выберите Excel файл", type=['xlsx', 'xls'])
+    # Параметры проверки отправляются одной кнопкой, без перезапуска страницы на каждое изменение
+    with st.form("expense_check_form"):
+        uploaded_file = st.file_uploader("Выберите Excel файл", type=['xlsx', 'xls'])
 
-    month = st.selectbox("Выберите месяц", 
-                       ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-                        "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"])
-    year = st.selectbox("Выберите год", range(2020, 2031))
+        data_type = st.radio("Тип данных", nabory.DATA_TYPES, horizontal=True)
+        month = st.selectbox("Выберите месяц", MONTHS)
+        year = st.selectbox("Выберите год", range(2020, 2031))
+        duplicates_mode = st.radio("Строки, загруженные ранее за этот месяц", DUPLICATE_MODES, horizontal=True)
 
-    if uploaded_file is not None:
+        submitted = st.form_submit_button("Проверить файл")
+
+    if submitted and uploaded_file is not None:
+        # Прежняя проверка и её файлы больше не нужны
+        jobs.discard_for_session("expense_check")
+        hranilishche.session_put("expense_error_workbook", None)
         try:
-            df = pd.read_excel(uploaded_file)
-            
-            df = trim_all_cells(df)
-            if "Дата" in df.columns:
-                df = df.drop(columns=["Дата"])
-            
-            df["Подразделения{уу}"] = df["Подразделение"].map(subdivision_mapping)
-            
-            required_input_columns = [
-                "Филиал", "Сумма", "Подразделение", 
-                "Номенклатурная группа", "Профиль", "Статья затрат БУ", "НД"
-            ]
-
-            # Исправленная обработка статей затрат
-            df["Статья затрат БУ"] = df["Статья затрат БУ"].fillna("").astype(str).str.strip()
-            
-            if "Статья затрат УУ" not in df.columns:
-                df["Статья затрат УУ"] = df["Статья затрат БУ"].map(rashod_bu_to_uu)
-            else:
-                df["Статья затрат УУ"] = df["Статья затрат УУ"].fillna("").astype(str).str.strip()
-                empty_uu_mask = (df["Статья затрат УУ"] == "") | df["Статья затрат УУ"].isna()
-                df.loc[empty_uu_mask, "Статья затрат УУ"] = df.loc[empty_uu_mask, "Статья затрат БУ"].map(rashod_bu_to_uu)
-            
-            missing_columns = [col for col in required_input_columns if col not in df.columns]
-            if missing_columns:
-                st.error(f"В файле отсутствуют обязательные столбцы: {', '.join(missing_columns)}")
-                st.error("Пожалуйста, используйте предоставленный шаблон.")
+            refs = load_expense_dictionaries()
+            options = {
+                "data_type": data_type, "month": month, "year": year,
+                "skip_duplicates": duplicates_mode == DUPLICATE_MODES[1],
+                "dictionaries": dictionary_versions(EXPENSE_DICTIONARY_FILES),
+            }
+            # Структура и начало файла проверяются сразу
+            result = check_preview(uploaded_file, "expense", refs)
+            if result["complete"]:
+                # Проверенные данные публикуются для страницы отчётов
+                result = publish_checked(result, "expense", uploaded_file.name, **options)
             else:
-                errors = []
-                
-                df["Бизнес-направление"] = df["Номенклатурная группа"].map(nomen_to_business)
-                df["Вид услуг"] = df["Номенклатурная группа"].map(nomen_to_service_type)
-                
-                empty_nomen_mask = df["Номенклатурная группа"].isna()
-                df.loc[empty_nomen_mask, "Бизнес-направление"] = "управление"
-                df.loc[empty_nomen_mask, "Вид услуг"] = pd.NA
-                
-                df["Контрагенты"] = df["Бизнес-направление"].map(business_to_counterparty)
-                df["Направление медицинских услуг"] = df["Профиль"].map(profile_to_med_direction)
-                
-                for idx, row in df.iterrows():
-                    try:
-                        nd_value = float(row["НД"])
-                        if nd_value < 0:
-                            errors.append(f"Ошибка в строке {idx + 2}, НД: значение не может быть отрицательным")
-                    except ValueError:
-                        errors.append(f"Ошибка в строке {idx + 2}, НД: значение '{row['НД']}' не является числом")
-
-                    if not validate_city(row["Филиал"]):
-                        errors.append(f"Ошибка в строке {idx + 2}, Филиал: '{row['Филиал']}' не соответствует справочнику")
-                    
-                    if pd.isna(row["Статья затрат БУ"]) or row["Статья затрат БУ"] == "":
-                        errors.append(f"Ошибка в строке {idx + 2}, Статья затрат БУ не может быть пустой")
-                    
-                    if pd.isna(row["Статья затрат УУ"]) or row["Статья затрат УУ"] == "":
-                        errors.append(f"Ошибка в строке {idx + 2}, Не удалось определить статью затрат УУ для БУ статьи: '{row['Статья затрат БУ']}'")
-                    
-                    if not validate_amount(row["Сумма"]):
-                        errors.append(f"Ошибка в строке {idx + 2}, Сумма: '{row['Сумма']}' - отрицательное значение или не число")
-                    
-                    if pd.notna(row["Номенклатурная группа"]) and not validate_nomen_group(row["Номенклатурная группа"]):
-                        errors.append(f"Ошибка в строке {idx + 2}, Номенклатурная группа: '{row['Номенклатурная группа']}' не соответствует допустимым значениям")
-                    
-                    if pd.notna(row["Номенклатурная группа"]):
-                        if pd.isna(row["Бизнес-направление"]):
-                            errors.append(f"Ошибка в строке {idx + 2}, Не удалось определить бизнес-направление для номенклатурной группы: '{row['Номенклатурная группа']}'")
-                        
-                        if pd.isna(row["Вид услуг"]):
-                            errors.append(f"Ошибка в строке {idx + 2}, Не удалось определить вид услуг для номенклатурной группы: '{row['Номенклатурная группа']}'")
-                    
-                    if pd.isna(row["Бизнес-направление"]):
-                        errors.append(f"Ошибка в строке {idx + 2}, Не удалось определить контрагента для бизнес-направления: '{row['Бизнес-направление']}'")
-                    
-                    if pd.notna(row["Профиль"]) and pd.isna(row["Направление медицинских услуг"]):
-                        errors.append(f"Ошибка в строке {idx + 2}, Не удалось определить направление медицинских услуг для профиля: '{row['Профиль']}'")
-                
-                if errors:
-                    st.error("Найдены ошибки в файле:")
-                    for error in errors:
-                        st.write(error)
-                    
-                    errors_df = pd.DataFrame(errors, columns=["Ошибки"])
-                else:
-                    st.success("Файл проверен успешно. Ошибок не найдено.")
-                    
-                    month_year_row = pd.DataFrame({
-                        col: [""] * len(df.columns) for col in df.columns
-                    })
-                    month_year_row.iloc[0, 0] = f"{month} {year}"
-                    df_with_date = pd.concat([df, month_year_row], ignore_index=True)
-                    
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_with_date.to_excel(writer, index=False)
-                    
-                    st.download_button(
-                        label="Скачать обработанный файл",
-                        data=output.getvalue(),
-                        file_name='processed_file.xlsx',
-                        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
-                
-                st.write("Первые строки загруженного файла (после обработки):")
-                st.dataframe(df.head())
-        
+                # Весь файл проверяется в фоне, а на странице уже видны ошибки его начала
+                result.pop("data")
+                jobs.submit_for_session(
+                    "expense_check", "Проверка файла", check_upload_task,
+                    uploaded_file.getvalue(), uploaded_file.name, "expense", refs, **options
+                )
         except Exception as e:
-            st.error(f"Ошибка при обработке файла: {e}")
+            result = {"exception": str(e)}
+        # Результат проверки хранится в общем хранилище с ограничением памяти, а не в состоянии сессии
+        hranilishche.session_put("expense_check", result)
+
+    show_check_state()
 
 CORRECT_PASSWORD = "34medisadmin"
 
@@ -224,9 +270,17 @@ def check_password():
     return True
 
 
-with tab2:
+@st.fragment
+def dictionaries_admin():
+    """Управление справочниками (перезапускается отдельно от проверки файлов)"""
     if check_password():
         st.title("Управление справочниками")
+
+        # Связи номенклатура -> бизнес-направление -> контрагент проверяются при каждой новой версии справочников
+        problems = broken_links(load_expense_dictionaries())
+        if not problems.empty:
+            with st.expander(f"Разорванные связи справочников: {len(problems)}"):
+                st.dataframe(problems, hide_index=True)
         
         dictionary_configs = {
             "Номенклатура -> Бизнес": {
@@ -249,6 +303,11 @@ with tab2:
                 "filename": "subdivision_mapping.csv",
                 "columns": ["Подразделение", "Новое подразделение"]
             },
+            "Подразделение -> Контрагент -> Бизнес": {
+                "filename": "subdiv_to_contractor_business.csv",
+                "columns": ["Подразделение", "Контрагент", "Бизнес-направление"],
+                "is_triple": True
+            },
             "Филиалы": {
                 "filename": "Филиалы.csv",
                 "columns": ["Наименование"],
@@ -265,4 +324,7 @@ with tab2:
             list(dictionary_configs.keys())
         )
         
-        edit_dictionary_ui(dict_to_edit, dictionary_configs[dict_to_edit])
\ No newline at end of file
+        edit_dictionary_ui(dict_to_edit, dictionary_configs[dict_to_edit])
+
+with tab2:
+    dictionaries_admin()
@@ -26,5 +26,7 @@ for step in steps:
 
 st.info("""
 **Совет:**  
-Перед редактированием справочников рекомендуется создать резервную копию файлов.  
+Каждое сохранение справочника в программе записывается в историю (вкладка «История» в редакторе справочника): 
+видно, кто и когда изменил какие строки, и любую прошлую версию можно вернуть одной кнопкой.  
+Изменения, внесённые в файлы вручную вне программы, в историю не попадают - перед ними создайте резервную копию файлов.  
 """)
\ No newline at end of file
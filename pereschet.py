@@ -0,0 +1,160 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+import istoriya
+import nabory
+import otchety
+
+# Пересчёт после правки справочников.
+# При сохранении справочника сравниваются старое и новое сопоставления; по
+# изменившимся ключам через обратные индексы находятся только затронутые месяцы
+# сохранённых агрегатов сметы и опубликованные наборы, и в них пересчитываются
+# только строки с этими ключами - без повторной загрузки файлов филиалов.
+# Модуль не зависит от Streamlit.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+
+def changed_keys(old_mapping, new_mapping):
+    """Ключи, которые добавлены, удалены или сопоставлены другому значению"""
+    old_mapping = old_mapping or {}
+    new_mapping = new_mapping or {}
+    return {
+        key for key in set(old_mapping) | set(new_mapping)
+        if key not in old_mapping or key not in new_mapping or not _same(old_mapping[key], new_mapping[key])
+    }
+
+def _same(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return a == b
+
+def _read_mapping(filename, key_col, value_col):
+    path = os.path.join(base_dir, "dictionaries", filename)
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path, delimiter=";")
+    return dict(zip(df[key_col], df[value_col]))
+
+def _remap_derived(df, key_col, value_col, old_mapping, new_mapping, keys):
+    """
+    Заменяет значения value_col, полученные по старому справочнику, на значения нового.
+    Значение, заполненное в файле вручную (не совпадающее со старым сопоставлением), не меняется.
+    Возвращает маску изменённых строк.
+    """
+    rows = df[key_col].isin(keys)
+    old_values = df.loc[rows, key_col].map(old_mapping)
+    current = df.loc[rows, value_col]
+    derived = (current == old_values) | (current.isna() & old_values.isna())
+    mask = pd.Series(False, index=df.index)
+    mask[derived[derived].index] = True
+    df.loc[mask, value_col] = df.loc[mask, key_col].map(new_mapping)
+    return mask
+
+def _update_datasets(field, keys, update):
+    """Применяет update(df) -> число изменённых строк к наборам, где встречаются keys"""
+    datasets = rows = 0
+    for meta in nabory.find(field, keys):
+        try:
+            df = nabory.load(meta["id"])
+            changed = update(df)
+            if changed:
+                nabory.replace(meta, df)
+                datasets += 1
+                rows += changed
+        except OSError:
+            # Набор удалён или открыт другим процессом - его поправит повторная проверка файла
+            continue
+    return datasets, rows
+
+def recompute_bu_to_uu(old_mapping, new_mapping):
+    """Статьи затрат УУ, определённые по статье БУ: базы агрегатов сметы и наборы расходов"""
+    keys = {str(key) for key in changed_keys(old_mapping, new_mapping)}
+    summary = {"months": 0, "groups": 0, "datasets": 0, "rows": 0}
+    if not keys:
+        return summary
+
+    def update_base(rows):
+        _remap_derived(rows, "Статья затрат БУ", "Статья затрат УУ", old_mapping, new_mapping, keys)
+        return rows
+
+    summary["months"], summary["groups"] = otchety.recompute_month_items(
+        "smeta", "Статья затрат БУ", keys,
+        otchety.normalize_cost_items, otchety.normalize_cost_items, update_base,
+        istoriya.file_versions([os.path.join(base_dir, "dictionaries", "rashod_bu_to_uu.csv")]),
+    )
+
+    def update_dataset(df):
+        if "Статья затрат УУ" not in df.columns:
+            return 0
+        return int(_remap_derived(df, "Статья затрат БУ", "Статья затрат УУ", old_mapping, new_mapping, keys).sum())
+
+    summary["datasets"], summary["rows"] = _update_datasets("Статья затрат БУ", keys, update_dataset)
+    return summary
+
+def recompute_nomen_to_business(old_mapping, new_mapping):
+    """Бизнес-направление и контрагенты в опубликованных наборах"""
+    keys = {str(key) for key in changed_keys(old_mapping, new_mapping)}
+    summary = {"months": 0, "groups": 0, "datasets": 0, "rows": 0}
+    if not keys:
+        return summary
+    counterparties = _read_mapping("business_to_counterparty.csv", "Бизнес-направление", "Контрагент")
+
+    def update_dataset(df):
+        if "Бизнес-направление" not in df.columns:
+            return 0
+        mask = _remap_derived(df, "Номенклатурная группа", "Бизнес-направление", old_mapping, new_mapping, keys)
+        if "Контрагенты" in df.columns:
+            df.loc[mask, "Контрагенты"] = df.loc[mask, "Бизнес-направление"].map(counterparties)
+        return int(mask.sum())
+
+    summary["datasets"], summary["rows"] = _update_datasets("Номенклатурная группа", keys, update_dataset)
+    return summary
+
+def recompute_report_mapping(old_mapping, new_mapping, old_subsections, new_subsections):
+    """
+    Статьи отчёта и подразделы сметы.
+    Подразделы сопоставляются уже переименованным статьям, поэтому для них
+    затронутые исходные статьи УУ находятся по прообразу изменённых ключей.
+    """
+    keys = {str(key) for key in changed_keys(old_mapping, new_mapping)}
+    subsection_keys = changed_keys(old_subsections, new_subsections)
+    if subsection_keys:
+        for key in otchety.indexed_keys("smeta", "Статья затрат УУ"):
+            if old_mapping.get(key, key) in subsection_keys or new_mapping.get(key, key) in subsection_keys:
+                keys.add(key)
+
+    summary = {"months": 0, "groups": 0, "datasets": 0, "rows": 0}
+    if not keys:
+        return summary
+
+    def normalize_old(df):
+        return otchety.normalize_items(df, old_mapping, old_subsections)
+
+    def normalize_new(df):
+        return otchety.normalize_items(df, new_mapping, new_subsections)
+
+    summary["months"], summary["groups"] = otchety.recompute_month_items(
+        "smeta", "Статья затрат УУ", keys, normalize_old, normalize_new,
+        versions=otchety.report_dictionary_versions("smeta"),
+    )
+    return summary
+
+def on_dictionary_saved(filename, old_mapping, new_mapping):
+    """
+    Пересчитывает зависящие от справочника данные после его сохранения.
+    Возвращает сводку: месяцы и строки базы агрегатов, наборы и строки наборов.
+    """
+    if filename == "rashod_bu_to_uu.csv":
+        return recompute_bu_to_uu(old_mapping, new_mapping)
+    if filename == "nomen_to_business.csv":
+        return recompute_nomen_to_business(old_mapping, new_mapping)
+    # Второй справочник сметы читается с диска: справочники в памяти обновляются только в том процессе, где их сохранили
+    if filename == otchety.COST_ITEMS_MAPPING_CSV:
+        subsections = otchety.load_or_create_mapping(otchety.COST_ITEMS_SUBSECTIONS_CSV)
+        return recompute_report_mapping(old_mapping, new_mapping, subsections, subsections)
+    if filename == otchety.COST_ITEMS_SUBSECTIONS_CSV:
+        mapping = otchety.load_or_create_mapping(otchety.COST_ITEMS_MAPPING_CSV)
+        return recompute_report_mapping(mapping, mapping, old_mapping, new_mapping)
+    return None
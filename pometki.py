@@ -0,0 +1,285 @@
+import re
+import zipfile
+from datetime import date, datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+# Файл с отмеченными ошибками.
+# Филиал получает обратно свой файл как есть, но ошибочные ячейки выделены цветом
+# и снабжены примечаниями (что не так и как исправить), в конце каждой строки -
+# столбец "Ошибки", а на отдельном листе - список всех ошибок.
+# Файлы бывают на сотни тысяч строк, поэтому XML листов собирается векторно
+# по столбцам (а не ячейка за ячейкой) и сразу упаковывается в xlsx.
+# Модуль не зависит от Streamlit.
+
+# Сколько примечаний добавлять (остальные ошибочные ячейки только выделяются цветом)
+MAX_COMMENTS = 20000
+ERRORS_COLUMN = "Ошибки"
+LIST_COLUMNS = ["Строка", "Столбец", "Значение", "Ошибка", "Исправление"]
+# Предельная длина текста ячейки в Excel
+MAX_CELL_TEXT = 32767
+
+# Номера стилей ячеек (порядок cellXfs в STYLES)
+STYLE_HEADER, STYLE_ERROR, STYLE_DATE, STYLE_ERROR_DATE = 1, 2, 3, 4
+
+NUMBER_TYPES = [int, float, np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64,
+                np.float16, np.float32, np.float64]
+DATE_TYPES = [datetime, date, pd.Timestamp]
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+CONTENT_TYPES = (
+    XML_HEADER + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="vml" ContentType="application/vnd.openxmlformats-officedocument.vmlDrawing"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '{comments}</Types>'
+)
+COMMENTS_CONTENT_TYPE = '<Override PartName="/xl/comments1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.comments+xml"/>'
+
+ROOT_RELS = (
+    XML_HEADER + f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+)
+
+WORKBOOK = (
+    XML_HEADER + f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><bookViews><workbookView/></bookViews><sheets>'
+    '<sheet name="Данные" sheetId="1" r:id="rId1"/><sheet name="Ошибки" sheetId="2" r:id="rId2"/></sheets></workbook>'
+)
+
+WORKBOOK_RELS = (
+    XML_HEADER + f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{REL_NS}/worksheet" Target="worksheets/sheet2.xml"/>'
+    f'<Relationship Id="rId3" Type="{REL_NS}/styles" Target="styles.xml"/></Relationships>'
+)
+
+SHEET_RELS = (
+    XML_HEADER + f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/vmlDrawing" Target="../drawings/vmlDrawing1.vml"/>'
+    f'<Relationship Id="rId2" Type="{REL_NS}/comments" Target="../comments1.xml"/></Relationships>'
+)
+
+_FONT = '<sz val="11"/><name val="Calibri"/><family val="2"/>'
+STYLES = (
+    XML_HEADER + f'<styleSheet xmlns="{MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy"/></numFmts>'
+    f'<fonts count="3"><font>{_FONT}</font><font><b/>{_FONT}</font>'
+    '<font><sz val="11"/><color rgb="FF9C0006"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFFFC7CE"/><bgColor indexed="64"/></patternFill></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="2" fillId="2" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1" applyFill="1"/>'
+    '</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>'
+)
+
+VML_SHAPE = (
+    '<v:shape id="_x0000_s{shape_id}" type="#_x0000_t202" style="position:absolute;margin-left:59.25pt;'
+    'margin-top:1.5pt;width:288pt;height:90pt;z-index:{z_index};visibility:hidden" fillcolor="#ffffe1" o:insetmode="auto">'
+    '<v:fill color2="#ffffe1"/><v:shadow on="t" color="black" obscured="t"/><v:path o:connecttype="none"/>'
+    '<v:textbox style="mso-direction-alt:auto"><div style="text-align:left"></div></v:textbox>'
+    '<x:ClientData ObjectType="Note"><x:MoveWithCells/><x:SizeWithCells/>'
+    '<x:Anchor>{left}, 15, {row}, 2, {right}, 15, {bottom}, 16</x:Anchor><x:AutoFill>False</x:AutoFill>'
+    '<x:Row>{row}</x:Row><x:Column>{col}</x:Column></x:ClientData></v:shape>'
+)
+
+def column_letter(position):
+    """Буквенное имя столбца Excel по позиции (0 -> A, 26 -> AA)"""
+    letters = ""
+    position += 1
+    while position:
+        position, rest = divmod(position - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+def _escape(texts):
+    """Тексты (Series строк) для XML: служебные символы экранируются, недопустимые удаляются"""
+    return (texts.str.slice(0, MAX_CELL_TEXT)
+            .str.replace("&", "&amp;", regex=False)
+            .str.replace("<", "&lt;", regex=False)
+            .str.replace(">", "&gt;", regex=False)
+            .str.replace(_INVALID_XML, "", regex=True))
+
+def _escape_text(text):
+    """То же для одной строки"""
+    text = str(text)[:MAX_CELL_TEXT].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return _INVALID_XML.sub("", text)
+
+def _cells(values, letter, row_numbers, errors):
+    """
+    XML ячеек одного столбца (массив строк, по одной на строку листа).
+    errors - маска ячеек, выделяемых как ошибочные; пустые ячейки без ошибки не пишутся.
+    """
+    values = pd.Series(np.asarray(values, dtype=object))
+    types = values.map(type)
+    empty = values.isna().to_numpy()
+    is_bool = types.isin([bool, np.bool_]).to_numpy()
+    is_number = types.isin(NUMBER_TYPES).to_numpy() & ~empty
+    if is_number.any():
+        # Бесконечность в Excel не записать числом - остаётся текстом
+        is_number[is_number] = np.isfinite(values[is_number].astype("float64")).to_numpy()
+    is_date = types.isin(DATE_TYPES).to_numpy() & ~empty
+    is_text = ~(empty | is_bool | is_number | is_date)
+
+    content = np.full(len(values), "/>", dtype=object)
+    if is_number.any():
+        content[is_number] = ("><v>" + values[is_number].astype(str) + "</v></c>").to_numpy()
+    if is_date.any():
+        serials = (pd.to_datetime(values[is_date]) - EXCEL_EPOCH) / pd.Timedelta(days=1)
+        content[is_date] = ("><v>" + serials.astype(str) + "</v></c>").to_numpy()
+    if is_bool.any():
+        content[is_bool] = np.where(values[is_bool].astype(bool), ' t="b"><v>1</v></c>', ' t="b"><v>0</v></c>')
+    if is_text.any():
+        # Текстовые столбцы состоят из повторяющихся значений - каждое различное собирается один раз
+        codes, uniques = pd.factorize(values[is_text].astype(str))
+        texts = ' t="inlineStr"><is><t xml:space="preserve">' + _escape(pd.Series(uniques, dtype=object)) + "</t></is></c>"
+        content[is_text] = texts.to_numpy()[codes]
+
+    styles = np.full(len(values), "", dtype=object)
+    styles[is_date] = f' s="{STYLE_DATE}"'
+    styles[errors] = f' s="{STYLE_ERROR}"'
+    styles[errors & is_date] = f' s="{STYLE_ERROR_DATE}"'
+
+    cells = f'<c r="{letter}' + row_numbers + '"' + styles + content
+    cells[empty & ~errors] = ""
+    return cells
+
+def _worksheet(df, marks=None, widths=None, selected=False, comments=False):
+    """
+    XML листа: строка заголовков и строки df.
+    marks - {позиция столбца: маска ошибочных ячеек}, widths - {позиция столбца: ширина}.
+    """
+    marks = marks or {}
+    widths = widths or {}
+    row_numbers = (np.arange(len(df)) + 2).astype(str).astype(object)
+
+    rows = '<row r="' + row_numbers + '">'
+    no_errors = np.zeros(len(df), dtype=bool)
+    for position in range(len(df.columns)):
+        rows = rows + _cells(df.iloc[:, position], column_letter(position), row_numbers, marks.get(position, no_errors))
+    rows = rows + "</row>"
+
+    header = "".join(
+        f'<c r="{column_letter(position)}1" s="{STYLE_HEADER}" t="inlineStr"><is><t xml:space="preserve">{_escape_text(col)}</t></is></c>'
+        for position, col in enumerate(df.columns)
+    )
+    cols = "".join(
+        f'<col min="{position + 1}" max="{position + 1}" width="{width}" customWidth="1"/>'
+        for position, width in sorted(widths.items())
+    )
+    tab_selected = ' tabSelected="1"' if selected else ""
+    return "".join([
+        XML_HEADER, f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">',
+        f'<sheetViews><sheetView{tab_selected} workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>',
+        '<sheetFormatPr defaultRowHeight="15"/>',
+        f"<cols>{cols}</cols>" if cols else "",
+        f'<sheetData><row r="1">{header}</row>', "".join(rows.tolist()), "</sheetData>",
+        '<pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>',
+        '<legacyDrawing r:id="rId1"/>' if comments else "",
+        "</worksheet>",
+    ])
+
+def _comments(notes):
+    """XML примечаний и их фигур (VML) для списка (строка листа с 0, столбец с 0, текст)"""
+    items = "".join(
+        f'<comment ref="{column_letter(col)}{row + 1}" authorId="0"><text><r><rPr><sz val="9"/><rFont val="Tahoma"/>'
+        f'<family val="2"/></rPr><t xml:space="preserve">{_escape_text(text)}</t></r></text></comment>'
+        for row, col, text in notes
+    )
+    comments = XML_HEADER + f'<comments xmlns="{MAIN_NS}"><authors><author>Проверка</author></authors><commentList>{items}</commentList></comments>'
+
+    # Фигуры нумеруются блоками по 1024, каждый блок перечисляется в idmap
+    data_ids = ",".join(str(block + 1) for block in range(len(notes) // 1024 + 1))
+    shapes = "".join(
+        VML_SHAPE.format(shape_id=1025 + i, z_index=i + 1, row=row, col=col, left=col + 1, right=col + 5, bottom=row + 6)
+        for i, (row, col, _) in enumerate(notes)
+    )
+    vml = (
+        '<xml xmlns:v="urn:schemas-microsoft-com:vml" xmlns:o="urn:schemas-microsoft-com:office:office" '
+        'xmlns:x="urn:schemas-microsoft-com:office:excel">'
+        f'<o:shapelayout v:ext="edit"><o:idmap v:ext="edit" data="{data_ids}"/></o:shapelayout>'
+        '<v:shapetype id="_x0000_t202" coordsize="21600,21600" o:spt="202" path="m,l,21600r21600,l21600,xe">'
+        '<v:stroke joinstyle="miter"/><v:path gradientshapeok="t" o:connecttype="rect"/></v:shapetype>'
+        f"{shapes}</xml>"
+    )
+    return comments, vml
+
+def _width(col):
+    """Ширина столбца по заголовку"""
+    return min(max(len(str(col)) + 2, 10), 60)
+
+def error_workbook(source, error_frame):
+    """
+    Загруженная таблица source с выделенными ошибочными ячейками, примечаниями
+    (ошибка и как исправить), столбцом "Ошибки" в конце каждой строки и листом
+    со списком всех ошибок (xlsx, bytes).
+    error_frame - таблица ошибок проверки (proverka.ERROR_COLUMNS); её "Позиция" - номер строки source.
+    """
+    columns = [str(col) for col in source.columns]
+    errors = error_frame[error_frame["Позиция"] < len(source)]
+    column_positions = {col: position for position, col in enumerate(columns)}
+    errors = errors.assign(col=errors["Столбец"].map(column_positions))
+
+    # Ячейки с ошибками по столбцам
+    n = len(source)
+    marks = {}
+    for position, rows in errors.dropna(subset=["col"]).groupby("col")["Позиция"]:
+        mask = np.zeros(n, dtype=bool)
+        mask[rows.to_numpy(dtype=int)] = True
+        marks[int(position)] = mask
+
+    # Столбец "Ошибки": все ошибки строки через "; "
+    row_texts = errors.groupby("Позиция")["Ошибка"].agg("; ".join)
+    texts = np.full(n, None, dtype=object)
+    texts[row_texts.index.to_numpy(dtype=int)] = row_texts.to_numpy()
+    data = source.copy()
+    data.columns = columns
+    data.insert(len(columns), ERRORS_COLUMN, texts, allow_duplicates=True)
+    errors_mask = np.zeros(n, dtype=bool)
+    errors_mask[row_texts.index.to_numpy(dtype=int)] = True
+    marks[len(columns)] = errors_mask
+
+    # Примечания: одно на ячейку, со всеми её ошибками
+    noted = errors.dropna(subset=["col"])
+    noted = noted.assign(note=noted["Ошибка"].astype(str) + ". " + noted["Исправление"].astype(str))
+    notes = noted.groupby(["Позиция", "col"], sort=True)["note"].agg("\n".join).head(MAX_COMMENTS)
+    notes = [(int(row) + 1, int(col), text) for (row, col), text in notes.items()]
+
+    widths = {position: _width(col) for position, col in enumerate(columns)}
+    widths[len(columns)] = 80
+    listed = errors[LIST_COLUMNS].reset_index(drop=True)
+
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES.format(comments=COMMENTS_CONTENT_TYPE if notes else ""))
+        archive.writestr("_rels/.rels", ROOT_RELS)
+        archive.writestr("xl/workbook.xml", WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", STYLES)
+        archive.writestr("xl/worksheets/sheet1.xml", _worksheet(data, marks, widths, selected=True, comments=bool(notes)))
+        archive.writestr("xl/worksheets/sheet2.xml", _worksheet(listed, widths={0: 10, 1: 25, 2: 30, 3: 80, 4: 60}))
+        if notes:
+            comments, vml = _comments(notes)
+            archive.writestr("xl/worksheets/_rels/sheet1.xml.rels", SHEET_RELS)
+            archive.writestr("xl/comments1.xml", comments)
+            archive.writestr("xl/drawings/vmlDrawing1.vml", vml)
+    return output.getvalue()
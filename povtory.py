@@ -0,0 +1,98 @@
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+import nabory
+from proverka import EXPENSE_REQUIRED_COLUMNS, INCOME_REQUIRED_COLUMNS, MONTHS
+
+# Поиск строк, которые уже были загружены раньше.
+# Филиалы иногда присылают один и тот же месяц дважды или исправленный файл,
+# который частично повторяет прежний, - в сводных отчётах такие суммы удваиваются.
+# Каждая опубликованная строка получает отпечаток - хэш её ключевых столбцов.
+# Отпечатки хранятся по виду данных, плану/факту и месяцу
+# (row_index/<вид>/<план или факт>/ГГГГ-ММ.parquet: Филиал, Хэш, Набор),
+# и новый файл сверяется с ними одной векторной операцией.
+# Индекс не зависит от хранения наборов: старые наборы удаляются (nabory.MAX_DATASETS),
+# а их отпечатки остаются, чтобы повторная загрузка того же месяца находилась и позже.
+# Отпечатки набора заменяются только при его повторной регистрации.
+# Модуль не зависит от Streamlit.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+ROW_INDEX_DIR = os.path.join(base_dir, "row_index")
+
+KEY_COLUMNS = {"income": INCOME_REQUIRED_COLUMNS, "expense": EXPENSE_REQUIRED_COLUMNS}
+
+_lock = threading.Lock()
+
+def _index_path(kind, data_type, month, year):
+    period = f"{year}-{MONTHS.index(month) + 1:02d}"
+    return os.path.join(ROW_INDEX_DIR, kind, "plan" if data_type == "План" else "fact", f"{period}.parquet")
+
+def fingerprints(df, kind):
+    """Отпечатки строк (uint64): хэш ключевых столбцов, не зависящий от порядка строк и запуска"""
+    keys = df[KEY_COLUMNS[kind]].astype(object)
+    # Числа и строки сравниваются в одном виде ("1" и 1.0 - одно значение суммы или НД)
+    keys = keys.apply(lambda col: pd.to_numeric(col, errors="coerce").fillna(col) if col.name in ("Сумма", "НД") else col)
+    keys = keys.where(keys.notna(), "").astype(str)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def _read_index(path):
+    if not os.path.exists(path):
+        return pd.DataFrame({"Филиал": pd.Series(dtype=object), "Хэш": pd.Series(dtype="uint64"), "Набор": pd.Series(dtype=object)})
+    return pd.read_parquet(path)
+
+def find_duplicates(df, kind, data_type, month, year):
+    """
+    Строки df, уже загруженные в опубликованных наборах того же вида и месяца.
+    Одинаковые строки считаются по числу повторений: если в наборах строка была дважды,
+    повтором будут первые две такие строки файла, а третья - новой.
+    Возвращает (маска повторов, сводка {"rows", "branches", "datasets"}) или (маска, None), если повторов нет.
+    """
+    hashes = pd.Series(fingerprints(df, kind))
+    stored = _read_index(_index_path(kind, data_type, month, year))
+
+    # Номер повторения строки в файле сравнивается с числом таких строк в наборах
+    occurrence = hashes.groupby(hashes, sort=False).cumcount().to_numpy()
+    stored_count = hashes.map(stored["Хэш"].value_counts()).fillna(0).to_numpy()
+    mask = pd.Series(occurrence < stored_count, index=df.index)
+    if not mask.any():
+        return mask, None
+
+    matched = stored[stored["Хэш"].isin(hashes[mask.to_numpy()])]
+    return mask, {
+        "rows": int(mask.sum()),
+        "branches": df.loc[mask, "Филиал"].value_counts().to_dict(),
+        "datasets": sorted(matched["Набор"].unique()),
+    }
+
+def _register(df, kind, data_type, month, year, dataset_id):
+    """Добавляет отпечатки строк опубликованного набора в индекс месяца (вызывается под _lock)"""
+    path = _index_path(kind, data_type, month, year)
+    rows = pd.DataFrame({"Филиал": df["Филиал"].astype(str).to_numpy(), "Хэш": fingerprints(df, kind), "Набор": dataset_id})
+    stored = _read_index(path)
+    # Прежние отпечатки того же набора заменяются
+    stored = stored[stored["Набор"] != dataset_id]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.concat([stored, rows], ignore_index=True).to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def publish(df, kind, data_type, month, year, source_name, skip_duplicates, dictionaries=None):
+    """
+    Публикует набор (nabory.publish) и регистрирует отпечатки его строк. Поиск повторов, публикация
+    и регистрация выполняются под одной блокировкой: из двух одновременно загруженных файлов
+    с одними и теми же строками второй видит строки первого как повторы.
+    skip_duplicates - не публиковать строки, загруженные раньше.
+    Возвращает (описание набора или None, если публиковать нечего; сводка повторов или None).
+    """
+    with _lock:
+        duplicates, summary = find_duplicates(df, kind, data_type, month, year)
+        if summary is not None and skip_duplicates:
+            df = df[~duplicates]
+            summary["skipped"] = True
+        if df.empty:
+            return None, summary
+        dataset = nabory.publish(df, kind, data_type, month, year, source_name, dictionaries=dictionaries)
+        _register(df, kind, data_type, month, year, dataset["id"])
+        return dataset, summary
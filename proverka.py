@@ -0,0 +1,618 @@
+import zipfile
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.utils.exceptions import InvalidFileException
+from pandas.io.parsers import TextParser
+from metrics import stage
+from dengi import invalid_amounts, to_kopecks, to_rubles
+from klyuchi import composite_index, distinct, has_combination, in_keys, map_keys, match_distinct, per_row, suggest
+from svyazi import CLOSURE_COLUMNS, lookup
+
+# Проверка файлов доходов и расходов филиалов.
+# Функции не зависят от Streamlit: страницы передают сюда загруженный файл
+# и справочники, а показывают уже готовый результат проверки.
+
+MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+
+INCOME_REQUIRED_COLUMNS = [
+    "Филиал", "Сумма",
+    "Номенклатурная группа", "Профиль"
+]
+
+EXPENSE_REQUIRED_COLUMNS = [
+    "Филиал", "Сумма", "Подразделение",
+    "Номенклатурная группа", "Профиль", "Статья затрат БУ", "НД"
+]
+
+# Столбцы файла и справочники, с ключами которых они сравниваются
+KEY_DICTIONARIES = {
+    "Филиал": "ref_city",
+    "Номенклатурная группа": "nomen_to_business",
+    "Профиль": "profile_to_med_direction",
+    "Подразделение": "subdivision_mapping",
+    "Статья затрат БУ": "rashod_bu_to_uu",
+}
+
+# Столбцы, сверяемые со справочниками, раскладываются на коды строк и различные значения
+# (klyuchi.distinct) один раз за проверку: обрезка пробелов, написание справочника,
+# поиск производных значений и подсказки считаются по различным значениям, а строкам
+# результат раздаётся через коды. factors - кэш разложений одной проверки {столбец: (коды, значения)};
+# функция, меняющая значения разложенного столбца, обновляет и его разложение.
+
+def _factor(df, col, factors):
+    """Разложение столбца df[col] (из кэша проверки factors, если он передан)"""
+    if factors is None:
+        return distinct(df[col])
+    if col not in factors:
+        factors[col] = distinct(df[col])
+    return factors[col]
+
+def trim_all_cells(df, factors=None):
+    # Применяем strip() ко всем строковым колонкам - к каждому различному значению один раз
+    for col in df.columns:
+        if df[col].dtype == 'object':
+            codes, uniques = distinct(df[col])
+            stripped = np.array([value.strip() if isinstance(value, str) else value for value in uniques], dtype=object)
+            changed = per_row(codes, [isinstance(value, str) and value != trimmed for value, trimmed in zip(uniques, stripped)], False).astype(bool)
+            if changed.any():
+                values = df[col].to_numpy(dtype=object, copy=True)
+                values[changed] = per_row(codes, stripped, None)[changed]
+                df[col] = values
+            if factors is not None:
+                factors[col] = (codes, stripped)
+    return df
+
+def stripped_text(values, factor=None):
+    """
+    То же, что values.fillna("").astype(str).str.strip(), но по одному преобразованию на различное значение.
+    Возвращает (столбец, его разложение).
+    """
+    values = pd.Series(values)
+    codes, uniques = factor if factor is not None else distinct(values)
+    texts = np.array([str(value).strip() for value in uniques] + [""], dtype=object)
+    # Пустые значения становятся строкой "" - последним различным значением
+    codes = np.where(codes < 0, len(uniques), codes)
+    return pd.Series(texts[codes], index=values.index), (codes, texts)
+
+def add_derived_columns(df, refs, factors=None):
+    """Добавляет бизнес-направление, вид услуг, контрагента и направление медицинских услуг"""
+    # Бизнес-направление, вид услуг и контрагент - одним поиском в сквозной таблице справочников;
+    # строки без номенклатурной группы относятся к управлению
+    derived = lookup(df["Номенклатурная группа"], refs, _factor(df, "Номенклатурная группа", factors))
+    for col in CLOSURE_COLUMNS:
+        df[col] = derived[col]
+    df["Направление медицинских услуг"] = map_keys(df["Профиль"], refs["profile_to_med_direction"], _factor(df, "Профиль", factors))
+    return df
+
+# Таблица ошибок: позиция строки в таблице, номер правила (порядок ошибок в строке),
+# номер строки в Excel, столбец ошибочной ячейки, значение, текст ошибки и подсказка.
+# Правила проверяются масками по всему столбцу; текст строится только для ошибочных строк.
+ERROR_COLUMNS = ["Позиция", "Правило", "Строка", "Столбец", "Значение", "Ошибка", "Исправление"]
+
+AMOUNT_FIX = "Укажите неотрицательное число без букв и пробелов, например 1234.56"
+
+def _rule_errors(df, mask, rule, column, describe, fix):
+    """
+    Ошибки правила rule для строк mask.
+    describe(rows) - тексты ошибок для выбранных строк, fix - подсказка (строка или функция значения ячейки).
+    """
+    positions = np.flatnonzero(np.asarray(mask, dtype=bool))
+    if not len(positions):
+        return None
+    rows = df.iloc[positions]
+    values = rows[column].tolist()
+    return pd.DataFrame({
+        "Позиция": positions,
+        "Правило": rule,
+        "Строка": df.index[positions] + 2,
+        "Столбец": column,
+        "Значение": values,
+        "Ошибка": describe(rows),
+        "Исправление": [fix(value) for value in values] if callable(fix) else fix,
+    })
+
+def _error_frame(parts):
+    parts = [part for part in parts if part is not None and len(part)]
+    if not parts:
+        return pd.DataFrame({col: pd.Series(dtype=object) for col in ERROR_COLUMNS})
+    return pd.concat(parts, ignore_index=True).sort_values(["Позиция", "Правило"], kind="stable", ignore_index=True)
+
+def error_messages(frame):
+    """Список ошибок для показа: "Ошибка в строке N, ..." в порядке строк"""
+    return [f"Ошибка в строке {row}, {text}" for row, text in zip(frame["Строка"], frame["Ошибка"])]
+
+def _dictionary_fix(keys, dictionary_name, value_column=None):
+    """
+    Подсказка для значения, которого нет в справочнике: похожие ключи (ищутся один раз на значение).
+    value_column - столбец значений справочника: если ключ в справочнике есть, но значение у него пустое,
+    подсказка предлагает заполнить значение.
+    """
+    cache = {}
+    def fix(value):
+        if value not in cache:
+            if value_column is not None and value in keys:
+                cache[value] = f"Заполните «{value_column}» для этого ключа в справочнике «{dictionary_name}»"
+                return cache[value]
+            similar = suggest(value, keys)
+            cache[value] = (f"Возможно: {'; '.join(map(str, similar))}" if similar
+                            else f"Исправьте значение или добавьте его в справочник «{dictionary_name}»")
+        return cache[value]
+    return fix
+
+def _texts(template, *columns):
+    """describe для _rule_errors: template.format(значения столбцов строки)"""
+    return lambda rows: [template.format(*values) for values in zip(*(rows[col].tolist() for col in columns))]
+
+def income_errors(df, refs, factors=None):
+    """Таблица ошибок файла доходов (ERROR_COLUMNS)"""
+    ref_city = refs["ref_city"]
+    nomen_to_business = refs["nomen_to_business"]
+    all_counterparties = set(refs["business_to_counterparty"].values())
+
+    def validate_counterparty(counterparty_value):
+        if pd.isna(counterparty_value):
+            return False
+        return any(str(counterparty) in str(counterparty_value) for counterparty in all_counterparties)
+
+    nomen = df["Номенклатурная группа"]
+    # Допустимость контрагента проверяется один раз на различное значение
+    codes, counterparties = _factor(df, "Контрагенты", factors)
+    valid_counterparty = per_row(codes, [validate_counterparty(value) for value in counterparties], False).astype(bool)
+
+    return _error_frame([
+        _rule_errors(df, ~in_keys(df["Филиал"], ref_city, _factor(df, "Филиал", factors)), 1, "Филиал",
+                     _texts("Филиал: '{}' не соответствует справочнику", "Филиал"), _dictionary_fix(ref_city, "Филиалы")),
+        _rule_errors(df, invalid_amounts(df["Сумма"]), 2, "Сумма",
+                     _texts("Сумма: '{}' - отрицательное значение или не число", "Сумма"), AMOUNT_FIX),
+        _rule_errors(df, nomen.notna() & ~in_keys(nomen, nomen_to_business, _factor(df, "Номенклатурная группа", factors)), 3, "Номенклатурная группа",
+                     _texts("Номенклатурная группа: '{}' не соответствует допустимым значениям", "Номенклатурная группа"),
+                     _dictionary_fix(nomen_to_business, "Номенклатура -> Бизнес")),
+        _rule_errors(df, nomen.notna() & df["Бизнес-направление"].isna(), 4, "Номенклатурная группа",
+                     _texts("Не удалось определить бизнес-направление для номенклатурной группы: '{}'", "Номенклатурная группа"),
+                     "Добавьте номенклатурную группу в справочник «Номенклатура -> Бизнес»"),
+        _rule_errors(df, nomen.notna() & df["Вид услуг"].isna(), 5, "Номенклатурная группа",
+                     _texts("Не удалось определить вид услуг для номенклатурной группы: '{}'", "Номенклатурная группа"),
+                     "Добавьте номенклатурную группу в справочник «Номенклатура -> Вид услуг»"),
+        _rule_errors(df, ~valid_counterparty, 6, "Номенклатурная группа",
+                     _texts("Не удалось найти допустимого контрагента в ячейке: '{}' для бизнес-направления: '{}'", "Контрагенты", "Бизнес-направление"),
+                     "Проверьте справочник «Бизнес -> Контрагент» для бизнес-направления этой номенклатурной группы"),
+        _rule_errors(df, df["Профиль"].notna() & df["Направление медицинских услуг"].isna(), 7, "Профиль",
+                     _texts("Не удалось определить направление медицинских услуг для профиля: '{}'", "Профиль"),
+                     _dictionary_fix(refs["profile_to_med_direction"], "Профиль -> Мед. направление", "Направление медицинских услуг")),
+    ])
+
+def match_dictionary_keys(df, refs, factors=None):
+    """
+    Приводит значения ключевых столбцов к написанию справочника (регистр, ё, кавычки, пробелы).
+    Возвращает таблицу и список строк, сопоставленных только после нормализации.
+    """
+    normalized = []
+    for col, ref_name in KEY_DICTIONARIES.items():
+        if col not in df.columns or ref_name not in refs:
+            continue
+        # Каждое различное значение нормализуется один раз
+        codes, uniques = _factor(df, col, factors)
+        replacements = match_distinct(uniques, refs[ref_name])
+        mask = per_row(codes, [key is not None for key in replacements], False).astype(bool)
+        if mask.any():
+            matched = df[col].to_numpy(dtype=object, copy=True)
+            matched[mask] = per_row(codes, replacements, None)[mask]
+            normalized.append(pd.DataFrame({
+                "Строка": df.index[mask] + 2,
+                "Столбец": col,
+                "Значение в файле": df.loc[mask, col],
+                "Значение справочника": matched[mask],
+            }))
+            df[col] = matched
+            if factors is not None:
+                factors[col] = (codes, np.array([value if key is None else key for value, key in zip(uniques, replacements)], dtype=object))
+    if normalized:
+        return df, pd.concat(normalized, ignore_index=True).sort_values(["Строка", "Столбец"], ignore_index=True)
+    return df, None
+
+def dictionary_suggestions(df, refs, factors=None):
+    """
+    Значения ключевых столбцов, которых нет в справочниках, и похожие ключи справочников.
+    Каждое различное значение ищется один раз. Возвращает таблицу или None.
+    """
+    rows = []
+    for col, ref_name in KEY_DICTIONARIES.items():
+        if col not in df.columns or ref_name not in refs:
+            continue
+        keys = refs[ref_name]
+        known = set(keys)
+        # Число строк на значение - по кодам разложения; одинаковые значения
+        # (например, совпавшие после обрезки пробелов) складываются
+        codes, uniques = _factor(df, col, factors)
+        counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(uniques)), index=pd.Index(uniques, dtype=object))
+        counts = counts.groupby(level=0, sort=False).sum().sort_values(ascending=False, kind="stable")
+        for value, count in counts[~counts.index.isin(list(known)) & (counts.index != "")].items():
+            rows.append({
+                "Столбец": col,
+                "Значение в файле": value,
+                "Строк": int(count),
+                "Похожие значения": suggest(value, keys),
+            })
+    if not rows:
+        return None
+    return pd.DataFrame(rows)
+
+def prepare_expense_cost_items(df, refs, factors=None):
+    """Подразделение УУ и статья затрат УУ (по статье БУ, если не заполнена)"""
+    df["Подразделения{уу}"] = map_keys(df["Подразделение"], refs["subdivision_mapping"], _factor(df, "Подразделение", factors))
+
+    # Исправленная обработка статей затрат
+    df["Статья затрат БУ"], bu_factor = stripped_text(df["Статья затрат БУ"], _factor(df, "Статья затрат БУ", factors))
+    if factors is not None:
+        factors["Статья затрат БУ"] = bu_factor
+    uu_by_bu = map_keys(df["Статья затрат БУ"], refs["rashod_bu_to_uu"], bu_factor)
+
+    if "Статья затрат УУ" not in df.columns:
+        df["Статья затрат УУ"] = uu_by_bu
+    else:
+        uu, _ = stripped_text(df["Статья затрат УУ"], _factor(df, "Статья затрат УУ", factors))
+        empty_uu_mask = (uu == "") | uu.isna()
+        df["Статья затрат УУ"] = uu.where(~empty_uu_mask, uu_by_bu)
+        if factors is not None:
+            factors.pop("Статья затрат УУ", None)
+    return df
+
+def _nd_errors(nd):
+    """Маски ошибок НД: не число и отрицательное значение"""
+    numbers = pd.to_numeric(nd, errors="coerce").astype("float64")
+    unparsed = (nd.notna() & numbers.isna()).to_numpy()
+    not_number = np.zeros(len(nd), dtype=bool)
+    if unparsed.any():
+        # Значения, которые не разобрал pandas, проверяются через float(), как раньше построчно (один раз на значение)
+        fallback = {}
+        for value in nd[unparsed].unique():
+            try:
+                fallback[value] = float(value)
+            except (TypeError, ValueError):
+                fallback[value] = None
+        values = nd[unparsed]
+        not_number[unparsed] = values.map(lambda value: fallback[value] is None).to_numpy(dtype=bool)
+        numbers[unparsed] = values.map(lambda value: np.nan if fallback[value] is None else fallback[value]).to_numpy(dtype="float64")
+    return not_number, (numbers < 0).to_numpy()
+
+def expense_errors(df, refs, factors=None):
+    """Таблица ошибок файла расходов (ERROR_COLUMNS)"""
+    ref_city = refs["ref_city"]
+    nomen_to_business = refs["nomen_to_business"]
+    nomen = df["Номенклатурная группа"]
+    not_number, negative = _nd_errors(df["НД"])
+
+    return _error_frame([
+        _rule_errors(df, negative, 1, "НД", lambda rows: ["НД: значение не может быть отрицательным"] * len(rows),
+                     "Укажите 0 или положительное число"),
+        _rule_errors(df, not_number, 1, "НД", _texts("НД: значение '{}' не является числом", "НД"),
+                     "Укажите число: 1 - строка относится к НД, 0 - не относится"),
+        _rule_errors(df, ~in_keys(df["Филиал"], ref_city, _factor(df, "Филиал", factors)), 2, "Филиал",
+                     _texts("Филиал: '{}' не соответствует справочнику", "Филиал"), _dictionary_fix(ref_city, "Филиалы")),
+        _rule_errors(df, df["Статья затрат БУ"].isna() | (df["Статья затрат БУ"] == ""), 3, "Статья затрат БУ",
+                     lambda rows: ["Статья затрат БУ не может быть пустой"] * len(rows), "Заполните статью затрат БУ"),
+        _rule_errors(df, df["Статья затрат УУ"].isna() | (df["Статья затрат УУ"] == ""), 4, "Статья затрат БУ",
+                     _texts("Не удалось определить статью затрат УУ для БУ статьи: '{}'", "Статья затрат БУ"),
+                     _dictionary_fix(refs["rashod_bu_to_uu"], "Статьи затрат (БУ->УУ)", "Статья затрат УУ")),
+        _rule_errors(df, invalid_amounts(df["Сумма"]), 5, "Сумма",
+                     _texts("Сумма: '{}' - отрицательное значение или не число", "Сумма"), AMOUNT_FIX),
+        _rule_errors(df, nomen.notna() & ~in_keys(nomen, nomen_to_business, _factor(df, "Номенклатурная группа", factors)), 6, "Номенклатурная группа",
+                     _texts("Номенклатурная группа: '{}' не соответствует допустимым значениям", "Номенклатурная группа"),
+                     _dictionary_fix(nomen_to_business, "Номенклатура -> Бизнес")),
+        _rule_errors(df, nomen.notna() & df["Бизнес-направление"].isna(), 7, "Номенклатурная группа",
+                     _texts("Не удалось определить бизнес-направление для номенклатурной группы: '{}'", "Номенклатурная группа"),
+                     "Добавьте номенклатурную группу в справочник «Номенклатура -> Бизнес»"),
+        _rule_errors(df, nomen.notna() & df["Вид услуг"].isna(), 8, "Номенклатурная группа",
+                     _texts("Не удалось определить вид услуг для номенклатурной группы: '{}'", "Номенклатурная группа"),
+                     "Добавьте номенклатурную группу в справочник «Номенклатура -> Вид услуг»"),
+        _rule_errors(df, df["Бизнес-направление"].isna(), 9, "Номенклатурная группа",
+                     _texts("Не удалось определить контрагента для бизнес-направления: '{}'", "Бизнес-направление"),
+                     "Проверьте справочники «Номенклатура -> Бизнес» и «Бизнес -> Контрагент»"),
+        _rule_errors(df, df["Профиль"].notna() & df["Направление медицинских услуг"].isna(), 10, "Профиль",
+                     _texts("Не удалось определить направление медицинских услуг для профиля: '{}'", "Профиль"),
+                     _dictionary_fix(refs["profile_to_med_direction"], "Профиль -> Мед. направление", "Направление медицинских услуг")),
+    ])
+
+# Сочетание подразделения УУ, контрагента и бизнес-направления проверяется по справочнику
+# subdiv_to_contractor_business (столбцы справочника и соответствующие столбцы файла)
+SUBDIVISION_LINK_COLUMNS = {
+    "Подразделение": "Подразделения{уу}",
+    "Контрагент": "Контрагенты",
+    "Бизнес-направление": "Бизнес-направление",
+}
+# Сколько номеров строк показывать в одной ошибке
+MAX_ROWS_IN_ERROR = 10
+
+def _rows_text(positions, index):
+    rows = [str(index[position] + 2) for position in positions[:MAX_ROWS_IN_ERROR]]
+    more = len(positions) - MAX_ROWS_IN_ERROR
+    return ", ".join(rows) + (f" и ещё {more}" if more > 0 else "")
+
+def validate_subdivision_links(df, refs):
+    """
+    Проверяет подразделение УУ и сочетание (подразделение УУ, контрагент, бизнес-направление)
+    по справочнику subdiv_to_contractor_business. Каждое различное сочетание проверяется один раз,
+    ошибка выводится одна на сочетание со списком строк.
+    Возвращает (список ошибок, таблица ошибок по строкам).
+    """
+    errors = []
+    parts = []
+    missing = (df["Подразделение"].notna() & df["Подразделения{уу}"].isna()).to_numpy()
+    if missing.any():
+        for value, positions in df[missing].groupby("Подразделение", sort=False).indices.items():
+            errors.append(f"Ошибка в строках {_rows_text(positions, df.index[missing])}, Не удалось определить подразделение УУ для подразделения: '{value}'")
+        parts.append(_rule_errors(df, missing, 101, "Подразделение",
+                                  _texts("Не удалось определить подразделение УУ для подразделения: '{}'", "Подразделение"),
+                                  _dictionary_fix(refs["subdivision_mapping"], "Подразделения")))
+
+    links = refs.get("subdiv_to_contractor_business")
+    if links is None or links.empty:
+        # Справочник сочетаний не заполнен - проверять не с чем
+        return errors, _error_frame(parts)
+
+    index = composite_index(links, list(SUBDIVISION_LINK_COLUMNS))
+    file_columns = list(SUBDIVISION_LINK_COLUMNS.values())
+    checked = df[file_columns].notna().all(axis=1).to_numpy()
+    invalid = np.zeros(len(df), dtype=bool)
+    checked_positions = np.flatnonzero(checked)
+    for combination, positions in df[checked].groupby(file_columns, sort=False).indices.items():
+        if not has_combination(index, combination):
+            subdivision, counterparty, business = combination
+            errors.append(
+                f"Ошибка в строках {_rows_text(positions, df.index[checked])}, Сочетание подразделения УУ '{subdivision}', "
+                f"контрагента '{counterparty}' и бизнес-направления '{business}' отсутствует в справочнике"
+            )
+            invalid[checked_positions[positions]] = True
+    parts.append(_rule_errors(
+        df, invalid, 102, "Подразделение",
+        _texts("Сочетание подразделения УУ '{}', контрагента '{}' и бизнес-направления '{}' отсутствует в справочнике", *file_columns),
+        "Проверьте подразделение и номенклатурную группу или добавьте сочетание в справочник «Подразделение -> Контрагент -> Бизнес»",
+    ))
+    return errors, _error_frame(parts)
+
+def processed_file(df, month, year):
+    """Обработанный файл (xlsx) со строкой месяца и года в конце"""
+    month_year_row = pd.DataFrame({
+        col: [""] * len(df.columns) for col in df.columns
+    })
+    month_year_row.iloc[0, 0] = f"{month} {year}"
+    df_with_date = pd.concat([df, month_year_row], ignore_index=True)
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df_with_date.to_excel(writer, index=False)
+    return output.getvalue()
+
+# Большие файлы проверяются постепенно: сначала структура и первые PREVIEW_ROWS строк
+# (результат показывается сразу), затем весь файл читается частями по CHUNK_ROWS строк
+# в фоновой задаче. Как только найдено MAX_ERRORS ошибок, чтение прекращается -
+# файл всё равно придётся исправлять.
+PREVIEW_ROWS = 5000
+CHUNK_ROWS = 10000
+MAX_ERRORS = 1000
+
+def _cell_value(cell):
+    """Значение ячейки в том виде, в каком его возвращает pandas.read_excel"""
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+def _frame(header, rows, start):
+    """Часть таблицы из строк листа: типы столбцов определяются так же, как в pandas.read_excel"""
+    width = len(header)
+    rows = [row[:width] + [""] * (width - len(row)) for row in rows]
+    df = TextParser([header] + rows, header=0, skip_blank_lines=False).read()
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+def _read_chunks(uploaded_file, chunk_rows):
+    """
+    Читает первый лист файла Excel частями по chunk_rows строк, не загружая его целиком.
+    Возвращает генератор (часть таблицы с индексом от начала файла, есть ли ещё строки, оценка числа строк или None).
+    Значения правее последнего заголовка не читаются, пустые строки в конце листа отбрасываются.
+    """
+    try:
+        book = load_workbook(uploaded_file, read_only=True, data_only=True, keep_links=False)
+    except (zipfile.BadZipFile, InvalidFileException):
+        # Старый формат xls читается целиком
+        uploaded_file.seek(0)
+        df = pd.read_excel(uploaded_file)
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows], start + chunk_rows < len(df), len(df)
+        return
+
+    try:
+        sheet = book.worksheets[0]
+        # Размер листа из его описания - только для индикатора прогресса, он бывает неточным
+        total = sheet.max_row - 1 if sheet.max_row else None
+        sheet.reset_dimensions()
+        rows = sheet.rows
+        header = None
+        chunk = []
+        start = 0
+        for row in rows:
+            values = [_cell_value(cell) for cell in row]
+            while values and values[-1] == "":
+                values.pop()
+            if header is None:
+                header = values
+                continue
+            # Часть отдаётся, когда за ней есть ещё строка, и не заканчивается пустыми строками
+            if len(chunk) >= chunk_rows and chunk[-1]:
+                yield _frame(header, chunk, start), True, total
+                start += len(chunk)
+                chunk = []
+            chunk.append(values)
+        while chunk and not chunk[-1]:
+            chunk.pop()
+        yield _frame(header or [], chunk, start), False, total
+    finally:
+        book.close()
+
+def check_preview(uploaded_file, kind, refs):
+    """
+    Быстрая проверка: обязательные столбцы и первые PREVIEW_ROWS строк файла.
+    Результат как у check_file; rows - сколько строк проверено, complete - поместился ли файл целиком.
+    """
+    with stage("чтение начала файла") as record:
+        df, more, _ = next(_read_chunks(uploaded_file, PREVIEW_ROWS))
+        record["rows"] = len(df)
+    result = check_dataframe(df, kind, refs)
+    result.update(rows=len(df), complete=not more or bool(result["missing_columns"]), stopped=False)
+    return result
+
+def check_file(uploaded_file, kind, refs, progress=None, max_errors=MAX_ERRORS):
+    """
+    Читает и проверяет файл доходов (kind="income") или расходов (kind="expense").
+    Файл читается частями; после каждой части вызывается progress(доля файла, проверено строк, найдено ошибок).
+    Когда ошибок становится не меньше max_errors, чтение прекращается и результат строится по прочитанным строкам.
+    Возвращает словарь: missing_columns, errors, data (обработанная таблица, если ошибок нет), preview,
+    normalized (строки, сопоставленные со справочниками только после нормализации, или None),
+    suggestions (значения, которых нет в справочниках, с похожими ключами, или None),
+    error_frame (ошибки по ячейкам, ERROR_COLUMNS, или None) и source (таблица в том виде, в каком её загрузили,
+    или None) - для файла с отмеченными ошибками (pometki.error_workbook),
+    rows (проверено строк), complete (проверен весь файл) и stopped (чтение прервано из-за числа ошибок).
+    Обработанный файл Excel строится отдельно (processed_file) - только если его скачивают.
+    """
+    sources = []
+    checked = []
+    rows = errors = 0
+    stopped = False
+    chunks = _read_chunks(uploaded_file, CHUNK_ROWS)
+    while True:
+        with stage("чтение файла") as record:
+            item = next(chunks, None)
+            record["rows"] = 0 if item is None else len(item[0])
+        if item is None:
+            break
+        df, more, total = item
+        # Прочитанная часть остаётся исходной таблицей, проверяется её копия
+        found = _check_rows(df.copy(), kind, refs)
+        if found["missing_columns"]:
+            return _missing_result(found["missing_columns"], rows=rows + len(df), complete=True, stopped=False)
+        # Позиции ошибок части отсчитываются от начала файла
+        found["error_frame"]["Позиция"] += rows
+        sources.append(df)
+        checked.append(found)
+        rows += len(df)
+        errors += len(found["error_frame"])
+        if progress is not None:
+            progress(rows / total if total else 0.0, rows, errors)
+        if more and errors >= max_errors:
+            stopped = True
+            chunks.close()
+            break
+
+    # Итог собирается из результатов частей; заново по всему файлу выполняются только проверки,
+    # которые объединяют строки разных частей (сочетания подразделений, число строк на значение)
+    found = _merge_rows(checked)
+    result = _finish_check(found, kind, refs, lambda: _concat(sources))
+    if stopped:
+        # Список для показа ограничен порогом; таблица ошибок (error_frame) остаётся полной
+        result["errors"] = result["errors"][:max_errors]
+    result.update(rows=rows, complete=not stopped, stopped=stopped)
+    return result
+
+def _concat(frames):
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+def _missing_result(missing_columns, **extra):
+    return {"missing_columns": missing_columns, "errors": [], "data": None, "preview": None, "normalized": None, "suggestions": None,
+            "error_frame": None, "source": None, **extra}
+
+def _check_rows(df, kind, refs):
+    """
+    Проверки, которые выполняются по каждой строке отдельно: обрезка пробелов, сопоставление
+    со справочниками, производные столбцы и правила строк. Таблица меняется на месте.
+    Возвращает словарь: missing_columns, data (обработанная таблица), normalized, error_frame, factors.
+    """
+    # Разложения столбцов на различные значения, общие для всех шагов проверки
+    factors = {}
+    with stage("trim_all_cells", rows=len(df)):
+        df = trim_all_cells(df, factors)
+    # Удаляем столбец Дата, если он есть
+    if "Дата" in df.columns:
+        df = df.drop(columns=["Дата"])
+
+    # Проверка наличия обязательных колонок в загруженном файле
+    required_input_columns = INCOME_REQUIRED_COLUMNS if kind == "income" else EXPENSE_REQUIRED_COLUMNS
+    missing_columns = [col for col in required_input_columns if col not in df.columns]
+    if missing_columns:
+        return {"missing_columns": missing_columns}
+
+    with stage("сопоставление со справочниками", rows=len(df)):
+        df, normalized = match_dictionary_keys(df, refs, factors)
+        if kind == "expense":
+            df = prepare_expense_cost_items(df, refs, factors)
+        df = add_derived_columns(df, refs, factors)
+
+    with stage("проверка строк", rows=len(df)):
+        error_frame = income_errors(df, refs, factors) if kind == "income" else expense_errors(df, refs, factors)
+    return {"missing_columns": [], "data": df, "normalized": normalized, "error_frame": error_frame, "factors": factors}
+
+def _merge_rows(checked):
+    """Результаты _check_rows частей файла (позиции ошибок уже от начала файла) -> результат по всем строкам"""
+    if len(checked) == 1:
+        return checked[0]
+    normalized = [found["normalized"] for found in checked if found["normalized"] is not None]
+    return {
+        "missing_columns": [],
+        "data": _concat([found["data"] for found in checked]),
+        "normalized": pd.concat(normalized, ignore_index=True) if normalized else None,
+        "error_frame": _error_frame([found["error_frame"] for found in checked]),
+        # Коды разложений у каждой части свои
+        "factors": {},
+    }
+
+def _finish_check(found, kind, refs, source):
+    """
+    Проверки по всей таблице после _check_rows: сочетания подразделений, похожие значения
+    для ошибок, суммы обработанных данных. source() - исходная таблица (нужна только при ошибках).
+    """
+    df = found["data"]
+    error_frame = found["error_frame"]
+    factors = found["factors"]
+    with stage("проверка строк", rows=len(df)):
+        errors = error_messages(error_frame)
+        if kind == "expense":
+            link_errors, link_frame = validate_subdivision_links(df, refs)
+            errors += link_errors
+            error_frame = _error_frame([error_frame, link_frame])
+
+    suggestions = None
+    if errors:
+        with stage("поиск похожих значений", rows=len(df)):
+            suggestions = dictionary_suggestions(df, refs, factors)
+
+    if not errors:
+        # В обработанные данные суммы попадают числами, округлёнными до копейки
+        df["Сумма"] = to_rubles(to_kopecks(df["Сумма"])).astype("float64")
+
+    return {
+        "missing_columns": [],
+        "errors": errors,
+        "data": None if errors else df,
+        "preview": df.head(),
+        "normalized": found["normalized"],
+        "suggestions": suggestions,
+        "error_frame": error_frame if errors else None,
+        "source": source() if errors else None,
+    }
+
+def check_dataframe(df, kind, refs):
+    """Проверяет уже прочитанную таблицу (см. check_file)"""
+    # Исходная таблица нужна для файла с отмеченными ошибками: проверка меняет значения
+    source = df.copy()
+    found = _check_rows(df, kind, refs)
+    if found["missing_columns"]:
+        return _missing_result(found["missing_columns"])
+    return _finish_check(found, kind, refs, lambda: source)
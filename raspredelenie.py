@@ -0,0 +1,159 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from svyazi import MANAGEMENT_BUSINESS
+
+# Распределение управленческих расходов по филиалам и бизнес-направлениям.
+# Строки расходов без номенклатурной группы (бизнес-направление "управление")
+# распределяются по ячейкам филиал x бизнес-направление пропорционально базе:
+# выручке (данные доходов), прямым расходам или численности (справочник).
+# База выбирается для каждой статьи затрат УУ (справочник allocation_drivers.csv),
+# для остальных статей - база по умолчанию.
+#
+# Расход филиала делится между направлениями этого филиала; если у филиала нет
+# базы (например, головной офис без выручки), расход делится между всеми ячейками
+# пропорционально базе компании. Доли всех баз собираются в одну матрицу
+# (строка - база и филиал, столбец - ячейка), и все строки расходов распределяются
+# одним умножением. Суммы - в копейках и округляются по накопленным долям, поэтому
+# распределённые суммы сходятся с исходными до копейки.
+# Модуль не зависит от Streamlit.
+
+base_dir = str(Path.home() / "Documents" / "medisapp")
+
+DRIVERS = ["Выручка", "Прямые расходы", "Численность"]
+DEFAULT_DRIVER = "Выручка"
+
+# Справочники распределения (разделитель ";", см. spravochniki.py)
+DRIVERS_CSV = "allocation_drivers.csv"
+DRIVERS_COLUMNS = ["Статья затрат УУ", "База распределения"]
+HEADCOUNT_CSV = "headcount.csv"
+HEADCOUNT_COLUMNS = ["Филиал", "Бизнес-направление", "Численность"]
+
+CELL_COLUMNS = ["Филиал", "Бизнес-направление"]
+LINE_COLUMNS = ["Филиал", "Статья затрат УУ"]
+
+def dictionary_path(filename):
+    return os.path.join(base_dir, "dictionaries", filename)
+
+def _read_dictionary(filename, columns):
+    path = dictionary_path(filename)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(path, delimiter=";")
+
+def load_item_drivers():
+    """База распределения по статьям затрат УУ {статья: база}"""
+    df = _read_dictionary(DRIVERS_CSV, DRIVERS_COLUMNS)
+    return dict(zip(df[DRIVERS_COLUMNS[0]], df[DRIVERS_COLUMNS[1]]))
+
+def load_headcount():
+    """Численность по филиалам и направлениям (HEADCOUNT_COLUMNS)"""
+    df = _read_dictionary(HEADCOUNT_CSV, HEADCOUNT_COLUMNS)
+    df["Численность"] = pd.to_numeric(df["Численность"], errors="coerce").fillna(0)
+    return df
+
+def driver_bases(income_df, expense_df, headcount_df):
+    """
+    Значения баз по ячейкам филиал x бизнес-направление {база: Series с индексом CELL_COLUMNS}.
+    Направление "управление" базой не служит (доходы без номенклатурной группы тоже относятся к нему),
+    иначе управленческие расходы распределялись бы сами на себя.
+    """
+    bases = {
+        "Выручка": income_df.groupby(CELL_COLUMNS)["Сумма"].sum(),
+        "Прямые расходы": expense_df.groupby(CELL_COLUMNS)["Сумма"].sum(),
+        "Численность": headcount_df.groupby(CELL_COLUMNS)["Численность"].sum(),
+    }
+    return {name: base[base.index.get_level_values(1) != MANAGEMENT_BUSINESS] for name, base in bases.items()}
+
+def share_matrix(bases, cells, branches):
+    """
+    Доли ячеек для каждой базы и филиала: строка base_number * (len(branches) + 1) + номер филиала,
+    последняя строка каждой базы - доли по всей компании (для филиалов без базы).
+    """
+    cell_branch = branches.get_indexer(cells.get_level_values(0))
+    rows = len(branches) + 1
+    shares = np.zeros((len(bases) * rows, len(cells)))
+    for number, base in enumerate(bases.values()):
+        # Отрицательная база (например, сторно) в доли не входит
+        weights = np.clip(base.reindex(cells, fill_value=0).to_numpy(dtype=float), 0, None)
+        block = shares[number * rows:(number + 1) * rows]
+        totals = np.bincount(cell_branch, weights, minlength=len(branches))
+        has_base = totals[cell_branch] > 0
+        block[cell_branch[has_base], np.flatnonzero(has_base)] = weights[has_base] / totals[cell_branch[has_base]]
+        if weights.sum() > 0:
+            block[-1] = weights / weights.sum()
+            block[:-1][totals == 0] = block[-1]
+    return shares
+
+def _round_rows(amounts, shares):
+    """
+    Доли строк сумм (копейки) -> целые суммы по ячейкам. Округляются накопленные суммы,
+    поэтому сумма строки сохраняется точно, а каждая ячейка отличается от точной доли меньше чем на копейку.
+    """
+    cumulative = np.cumsum(shares, axis=1)
+    cumulative /= cumulative[:, -1:]
+    rounded = np.rint(amounts[:, None] * cumulative).astype("int64")
+    return np.diff(rounded, axis=1, prepend=0)
+
+def allocate(income_df, expense_df, item_drivers, default_driver=DEFAULT_DRIVER, headcount_df=None):
+    """
+    Распределяет управленческие расходы (суммы в копейках, см. otchety.split_pnl_sources).
+    Возвращает (распределение по ячейкам и статьям: Филиал, Бизнес-направление, Статья затрат УУ,
+    База распределения, Сумма; нераспределённые строки расходов: Филиал, Статья затрат УУ,
+    База распределения, Сумма).
+    """
+    if headcount_df is None:
+        headcount_df = pd.DataFrame(columns=HEADCOUNT_COLUMNS)
+    bases = driver_bases(income_df, expense_df, headcount_df)
+
+    management = expense_df[expense_df["Бизнес-направление"] == MANAGEMENT_BUSINESS]
+    lines = management.groupby(LINE_COLUMNS, dropna=False)["Сумма"].sum().reset_index()
+    lines = lines[lines["Сумма"] != 0].reset_index(drop=True)
+    drivers = lines["Статья затрат УУ"].map(item_drivers)
+    lines["База распределения"] = drivers.where(drivers.isin(DRIVERS), default_driver)
+
+    # Ячейки - все филиалы и направления (кроме управления), у которых есть хотя бы одна база
+    cells = pd.MultiIndex.from_tuples(
+        sorted(set().union(*(base.index for base in bases.values())), key=lambda cell: tuple(map(str, cell))),
+        names=CELL_COLUMNS
+    )
+    branches = pd.Index(cells.get_level_values(0).unique())
+    shares = share_matrix(bases, cells, branches)
+
+    # Строка матрицы долей для каждой строки расходов: база и филиал (неизвестный филиал - доли компании)
+    branch = branches.get_indexer(lines["Филиал"])
+    branch[branch < 0] = len(branches)
+    driver = pd.Index(list(bases)).get_indexer(lines["База распределения"])
+    line_shares = shares[driver * (len(branches) + 1) + branch]
+
+    allocatable = line_shares.sum(axis=1) > 0
+    amounts = lines["Сумма"].to_numpy(dtype="int64")
+    allocated = _round_rows(amounts[allocatable], line_shares[allocatable])
+
+    line_number, cell_number = np.nonzero(allocated)
+    allocated_lines = lines[allocatable].reset_index(drop=True)
+    result = pd.DataFrame({
+        "Филиал": cells.get_level_values(0)[cell_number],
+        "Бизнес-направление": cells.get_level_values(1)[cell_number],
+        "Статья затрат УУ": allocated_lines["Статья затрат УУ"].to_numpy()[line_number],
+        "База распределения": allocated_lines["База распределения"].to_numpy()[line_number],
+        "Сумма": allocated[line_number, cell_number],
+    })
+    return result, lines[~allocatable].reset_index(drop=True)
+
+def allocation_summary(income_df, expense_df, allocation):
+    """
+    Прибыль по филиалам и направлениям после распределения (суммы в копейках):
+    Выручка, Прямые расходы, Управленческие расходы, Маржа после распределения.
+    """
+    direct = expense_df[expense_df["Бизнес-направление"] != MANAGEMENT_BUSINESS]
+    summary = pd.concat([
+        income_df.groupby(CELL_COLUMNS)["Сумма"].sum().rename("Выручка"),
+        direct.groupby(CELL_COLUMNS)["Сумма"].sum().rename("Прямые расходы"),
+        allocation.groupby(CELL_COLUMNS)["Сумма"].sum().rename("Управленческие расходы"),
+    ], axis=1).fillna(0).astype("int64")
+    summary["Маржа после распределения"] = summary["Выручка"] - summary["Прямые расходы"] - summary["Управленческие расходы"]
+    return summary.reset_index()
@@ -1,29 +1,189 @@
 import pandas as pd
+import numpy as np
 import os
 import streamlit as st
 from pathlib import Path
+from datetime import datetime
+import istoriya
+from klyuchi import find_substring, substring_index
 
 base_dir = str(Path.home() / "Documents" / "medisapp")
 os.makedirs(os.path.join(base_dir, "dictionaries"), exist_ok=True)
 
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _load_dictionary_version(path, version, key_col, value_col, is_triple):
+    """Читает справочник один раз на версию файла (version входит в ключ кэша)"""
+    df = pd.read_csv(path, delimiter=";")
+
+    if is_triple:
+        return df
+    elif value_col:
+        return dict(zip(df[key_col], df[value_col]))
+    else:
+        return df[key_col].tolist()
+
 def load_dictionary(filename, key_col=None, value_col=None, is_triple=False):
+    # Результат общий для всех сессий - его нельзя изменять на месте
     try:
         path = os.path.join(base_dir, "dictionaries", filename)
-        df = pd.read_csv(path, delimiter=";")
-        
-        if is_triple:
-            return df
-        elif value_col:
-            return dict(zip(df[key_col], df[value_col]))
-        else:
-            return df[key_col].tolist()
+        stat = os.stat(path)
+        return _load_dictionary_version(path, (stat.st_mtime_ns, stat.st_size), key_col, value_col, is_triple)
     except Exception as e:
         st.error(f"Ошибка загрузки справочника {filename}: {e}")
         return pd.DataFrame() if is_triple else ({} if value_col else [])
 
-def save_dictionary(filename, data, columns):
+# Справочники, от которых зависят сохранённые агрегаты и опубликованные наборы
+# (в том числе справочники отчёта сметы - otchety.COST_ITEMS_MAPPING_CSV и COST_ITEMS_SUBSECTIONS_CSV)
+RECOMPUTED_DICTIONARIES = ("rashod_bu_to_uu.csv", "nomen_to_business.csv", "cost_items_mapping.csv", "cost_items_subsections.csv")
+
+def write_dictionary(path, df, note="", sep=";"):
+    """
+    Записывает справочник, добавляет изменения в историю (istoriya.py) и пересчитывает зависящие
+    от него данные (pereschet.on_dictionary_saved). Прежнее содержимое читается из файла на диске,
+    а не из памяти процесса. Возвращает сводку пересчёта или None.
+    """
+    old_df = pd.read_csv(path, delimiter=sep) if os.path.exists(path) else None
+
+    # Запись во временный файл и переименование: читатели видят либо старую, либо новую версию целиком
+    df.to_csv(path + ".tmp", index=False, sep=sep)
+    os.replace(path + ".tmp", path)
+    istoriya.record(path, old_df, df, note)
+
+    filename = os.path.basename(path)
+    if filename not in RECOMPUTED_DICTIONARIES or old_df is None:
+        return None
+    from pereschet import on_dictionary_saved
+    old_mapping = dict(zip(old_df.iloc[:, 0], old_df.iloc[:, 1]))
+    return on_dictionary_saved(filename, old_mapping, dict(zip(df.iloc[:, 0], df.iloc[:, 1])))
+
+def save_dictionary(filename, data, columns, note=""):
+    """Сохраняет справочник (write_dictionary) и сообщает, что пересчитано"""
+    path = os.path.join(base_dir, "dictionaries", filename)
+    show_recompute_summary(write_dictionary(path, pd.DataFrame(data, columns=columns), note))
+
+def dictionary_versions(filenames):
+    """Версии справочников {файл: версия} для метки отчётов и наборов данных"""
+    return istoriya.file_versions([os.path.join(base_dir, "dictionaries", filename) for filename in filenames])
+
+def rollback_dictionary(filename, version):
+    """Возвращает справочник к версии из истории (как новое сохранение)"""
     path = os.path.join(base_dir, "dictionaries", filename)
-    pd.DataFrame(data, columns=columns).to_csv(path, index=False, sep=";")
+    df = istoriya.reconstruct(path, version)
+    if df is None:
+        raise ValueError(f"Версия {version} не найдена в истории справочника {filename}")
+    save_dictionary(filename, df, list(df.columns), note=f"возврат к версии {version}")
+
+def history_ui(filename):
+    """История сохранений справочника и возврат к прошлой версии"""
+    path = os.path.join(base_dir, "dictionaries", filename)
+    entries = istoriya.history(path)
+    if not entries:
+        st.info("Изменений справочника ещё не было")
+        return
+
+    st.dataframe(pd.DataFrame([{
+        "Версия": entry["version"],
+        "Время": entry["time"].replace("T", " "),
+        "Пользователь": entry["author"],
+        "Добавлено": entry["added"],
+        "Удалено": entry["removed"],
+        "Изменено": entry["changed"],
+        "Комментарий": entry["note"],
+    } for entry in entries]), hide_index=True)
+
+    # Версия, действовавшая на дату (например, когда формировался отчёт за прошлый месяц)
+    day = st.date_input("Версия на дату", value=None, format="DD.MM.YYYY", key=f"history_date_{filename}")
+    if day is not None:
+        version_then = istoriya.version_at(path, datetime.combine(day, datetime.max.time()))
+        if version_then is None:
+            st.info(f"На {day:%d.%m.%Y} справочника ещё не было в истории")
+        else:
+            st.caption(f"На {day:%d.%m.%Y} действовала версия {version_then}")
+            with st.expander("Содержимое версии на дату"):
+                st.dataframe(istoriya.reconstruct(path, version_then), hide_index=True)
+
+    version = st.selectbox(
+        "Версия для просмотра или возврата",
+        [entry["version"] for entry in entries[1:]],
+        format_func=lambda v: next(f"{v} ({e['time'].replace('T', ' ')})" for e in entries if e["version"] == v),
+        key=f"history_version_{filename}",
+    )
+    if version is None:
+        return
+    with st.expander("Содержимое версии"):
+        st.dataframe(istoriya.reconstruct(path, version), hide_index=True)
+    if st.button("Вернуть эту версию", key=f"rollback_{filename}"):
+        rollback_dictionary(filename, version)
+        st.success(f"Справочник возвращён к версии {version}")
+        st.rerun(scope="fragment")
+
+def show_recompute_summary(summary):
+    """Сообщает, что пересчитано после сохранения справочника"""
+    if summary and (summary["months"] or summary["datasets"]):
+        st.toast(
+            f"Пересчитано: месяцев отчётов - {summary['months']} ({summary['groups']} строк), "
+            f"наборов данных - {summary['datasets']} ({summary['rows']} строк)"
+        )
+
+# Справочники, в которые значение из файла добавляется синонимом существующего ключа
+ALIAS_DICTIONARIES = {
+    "Номенклатурная группа": ["nomen_to_business.csv", "nomen_to_service_type.csv"],
+    "Профиль": ["profile_to_med_direction.csv"],
+    "Подразделение": ["subdivision_mapping.csv"],
+    "Статья затрат БУ": ["rashod_bu_to_uu.csv"],
+}
+
+def add_aliases(filename, aliases):
+    """
+    Добавляет в справочник новые ключи с теми же значениями, что у существующих.
+    aliases: {новый ключ: существующий ключ}. Возвращает число добавленных строк.
+    """
+    path = os.path.join(base_dir, "dictionaries", filename)
+    df = pd.read_csv(path, delimiter=";")
+    key_col = df.columns[0]
+    rows = df[df[key_col].isin(list(aliases.values()))].drop_duplicates(key_col).set_index(key_col)
+
+    added = []
+    for new_key, existing_key in aliases.items():
+        if existing_key in rows.index and new_key not in df[key_col].values:
+            added.append({key_col: new_key, **rows.loc[existing_key].to_dict()})
+    if added:
+        save_dictionary(filename, pd.concat([df, pd.DataFrame(added)], ignore_index=True), list(df.columns))
+    return len(added)
+
+def suggestions_ui(suggestions, key):
+    """Похожие значения справочников для ненайденных значений и их добавление синонимами"""
+    st.subheader("Значения, которых нет в справочниках")
+    table = suggestions.copy()
+    table["Добавить как"] = table["Похожие значения"].map(lambda values: values[0] if len(values) else None)
+    table["Похожие значения"] = table["Похожие значения"].map(", ".join)
+    table.insert(0, "Добавить", False)
+    options = sorted({value for values in suggestions["Похожие значения"] for value in values})
+
+    edited = st.data_editor(
+        table,
+        hide_index=True,
+        disabled=["Столбец", "Значение в файле", "Строк", "Похожие значения"],
+        column_config={
+            "Добавить": st.column_config.CheckboxColumn("Добавить"),
+            "Добавить как": st.column_config.SelectboxColumn("Добавить как синоним", options=options),
+        },
+        key=f"{key}_suggestions",
+    )
+
+    if st.button("Добавить отмеченные значения в справочники", key=f"{key}_add_aliases"):
+        selected = edited[edited["Добавить"] & edited["Добавить как"].notna()]
+        skipped = selected[~selected["Столбец"].isin(list(ALIAS_DICTIONARIES))]
+        if not skipped.empty:
+            st.warning(f"Значения столбца {', '.join(skipped['Столбец'].unique())} нужно исправить в файле")
+
+        added = 0
+        for col, group in selected.groupby("Столбец"):
+            aliases = dict(zip(group["Значение в файле"], group["Добавить как"]))
+            for filename in ALIAS_DICTIONARIES.get(col, []):
+                added += add_aliases(filename, aliases)
+        if added:
+            st.success(f"Добавлено записей в справочники: {added}. Проверьте файл повторно.")
 
 def export_dictionary(filename):
     path = os.path.join(base_dir, "dictionaries", filename)
@@ -40,6 +200,38 @@ def export_dictionary(filename):
     except Exception as e:
         st.error(f"Ошибка при экспорте справочника: {e}")
 
+def dictionary_diff(current_df, new_df, key_col):
+    """
+    Сравнивает новый справочник с текущим по ключевому столбцу (соединением по ключам, без циклов).
+    Возвращает таблицы added, removed, changed (с текущими и новыми значениями),
+    duplicates (ключи нового справочника с разными значениями) и число повторяющихся одинаковых строк repeated.
+    """
+    value_cols = [col for col in new_df.columns if col != key_col]
+    repeated = new_df[new_df[key_col].duplicated(keep=False)]
+    if value_cols:
+        conflicting = repeated.groupby(key_col, dropna=False)[value_cols].nunique(dropna=False).gt(1).any(axis=1)
+        duplicates = repeated[repeated[key_col].isin(conflicting[conflicting].index)]
+    else:
+        duplicates = repeated.iloc[:0]
+    new_unique = new_df.drop_duplicates(key_col, keep="last")
+    current_unique = current_df.drop_duplicates(key_col, keep="last")
+
+    merged = current_unique.merge(new_unique, on=key_col, how="outer", suffixes=(" (текущее)", " (новое)"), indicator=True)
+    both = merged[merged["_merge"] == "both"]
+    differs = np.zeros(len(both), dtype=bool)
+    for col in value_cols:
+        old_values = both[f"{col} (текущее)"].astype(object)
+        new_values = both[f"{col} (новое)"].astype(object)
+        differs |= ~((old_values == new_values) | (old_values.isna() & new_values.isna())).to_numpy()
+
+    return {
+        "added": new_unique[new_unique[key_col].isin(merged.loc[merged["_merge"] == "right_only", key_col])],
+        "removed": current_unique[current_unique[key_col].isin(merged.loc[merged["_merge"] == "left_only", key_col])],
+        "changed": both[differs].drop(columns="_merge"),
+        "duplicates": duplicates,
+        "repeated": int(new_df.duplicated().sum()),
+    }
+
 def import_dictionary(filename, columns):
     uploaded_file = st.file_uploader(
         "Выберите CSV файл для импорта", 
@@ -49,22 +241,142 @@ def import_dictionary(filename, columns):
     
     if uploaded_file is not None:
         try:
-            df = pd.read_csv(uploaded_file, delimiter=";")
+            df = pd.read_csv(uploaded_file, delimiter=";", encoding="utf-8-sig")
 
             if list(df.columns) != columns:
                 st.error(f"Неверная структура файла. Ожидаемые колонки: {columns}")
                 return
-            st.write("Предпросмотр данных для импорта:")
-            st.dataframe(df.head())
-            
+
+            path = os.path.join(base_dir, "dictionaries", filename)
+            current_df = pd.read_csv(path, delimiter=";") if os.path.exists(path) else pd.DataFrame(columns=columns)
+            diff = dictionary_diff(current_df, df, columns[0])
+
+            st.write(f"Строк в файле: {len(df)}, в текущем справочнике: {len(current_df)}")
+            metric_cols = st.columns(4)
+            metric_cols[0].metric("Новые ключи", len(diff["added"]))
+            metric_cols[1].metric("Удаляемые ключи", len(diff["removed"]))
+            metric_cols[2].metric("Изменённые значения", len(diff["changed"]))
+            metric_cols[3].metric("Ключи с разными значениями", diff["duplicates"][columns[0]].nunique())
+            for title, name in [("Новые ключи", "added"), ("Удаляемые ключи", "removed"),
+                                ("Изменённые значения", "changed"), ("Ключи с разными значениями в файле", "duplicates")]:
+                if len(diff[name]):
+                    with st.expander(f"{title} ({len(diff[name])})"):
+                        st.dataframe(diff[name].head(1000), hide_index=True)
+
+            if diff["repeated"]:
+                st.info(f"Одинаковых повторяющихся строк: {diff['repeated']} - при использовании справочника они не мешают")
+            if len(diff["duplicates"]):
+                st.error("В файле есть ключи с разными значениями - исправьте их перед импортом")
+                return
+            if not (len(diff["added"]) or len(diff["removed"]) or len(diff["changed"])):
+                st.info("Файл совпадает с текущим справочником")
+                return
+
             if st.button(f"Подтвердить импорт {filename}"):
-                save_dictionary(base_dir, filename, df, columns)
+                save_dictionary(filename, df, columns, note=f"импорт из файла {uploaded_file.name}")
                 st.success("Справочник успешно импортирован!")
-                st.rerun()
+                st.rerun(scope="fragment")
                 
         except Exception as e:
             st.error(f"Ошибка при импорте файла: {e}")
 
+# Справочники больше этого числа строк редактируются по страницам (paged_editor_ui)
+LARGE_DICTIONARY_ROWS = 2000
+PAGE_SIZES = [50, 100, 500]
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _search_index(path, version):
+    """
+    Индекс поиска по справочнику (строится один раз на версию файла):
+    индекс троек символов строк в нижнем регистре (klyuchi.substring_index) для поиска подстроки
+    и отсортированные ключи для поиска по началу.
+    """
+    df = pd.read_csv(path, delimiter=";")
+    text = substring_index(df.fillna("").astype(str).agg(" | ".join, axis=1).str.casefold().tolist())
+    keys = df.iloc[:, 0].fillna("").astype(str).str.casefold().to_numpy()
+    order = np.argsort(keys, kind="stable")
+    return {"df": df, "text": text, "order": order, "sorted_keys": keys[order]}
+
+def search_dictionary(index, query, prefix=False):
+    """Позиции строк справочника, найденных по запросу (пустой запрос - все строки)"""
+    query = query.strip().casefold()
+    if not query:
+        return np.arange(len(index["df"]))
+    if prefix:
+        # Ключи с общим началом идут в отсортированном массиве подряд
+        start = np.searchsorted(index["sorted_keys"], query, side="left")
+        end = np.searchsorted(index["sorted_keys"], query + "\U0010ffff", side="left")
+        return np.sort(index["order"][start:end])
+    return find_substring(index["text"], query)
+
+def apply_dictionary_changes(filename, columns, version, row_labels, changes):
+    """
+    Применяет к справочнику только изменённые строки страницы редактора.
+    changes - состояние st.data_editor (edited_rows, added_rows, deleted_rows) с позициями строк страницы,
+    row_labels - номера этих строк в справочнике, version - версия файла, которую видел пользователь.
+    Возвращает число изменённых строк.
+    """
+    path = os.path.join(base_dir, "dictionaries", filename)
+    stat = os.stat(path)
+    if (stat.st_mtime_ns, stat.st_size) != version:
+        raise ValueError("Справочник изменён в другом окне. Обновите страницу и повторите изменения")
+
+    df = pd.read_csv(path, delimiter=";")
+    for position, values in changes.get("edited_rows", {}).items():
+        for col, value in values.items():
+            df.loc[row_labels[int(position)], col] = value
+    deleted = [row_labels[position] for position in changes.get("deleted_rows", [])]
+    added = [row for row in changes.get("added_rows", []) if any(pd.notna(value) and value != "" for value in row.values())]
+    df = df.drop(index=deleted)
+    if added:
+        df = pd.concat([df, pd.DataFrame(added, columns=columns)], ignore_index=True)
+
+    count = len(changes.get("edited_rows", {})) + len(deleted) + len(added)
+    if count:
+        save_dictionary(filename, df, columns, note=f"изменено строк: {count}")
+    return count
+
+def paged_editor_ui(filename, columns):
+    """Редактор большого справочника: поиск и страницы на сервере, сохраняются только изменённые строки"""
+    path = os.path.join(base_dir, "dictionaries", filename)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    index = _search_index(path, version)
+
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        query = st.text_input("Поиск по ключам и значениям", key=f"search_{filename}")
+    with col2:
+        search_mode = st.radio("Искать", ["содержит", "начинается с"], key=f"search_mode_{filename}")
+    with col3:
+        page_size = st.selectbox("Строк на странице", PAGE_SIZES, key=f"page_size_{filename}")
+
+    positions = search_dictionary(index, query, prefix=search_mode == "начинается с")
+    pages = max(1, -(-len(positions) // page_size))
+    page = st.number_input("Страница", min_value=1, max_value=pages, value=1, key=f"page_{filename}")
+    st.caption(f"Найдено строк: {len(positions)} из {len(index['df'])}, страниц: {pages}. Сохраните изменения перед переходом на другую страницу.")
+
+    page_df = index["df"].iloc[positions[(page - 1) * page_size:page * page_size]]
+    editor_key = f"page_editor_{filename}_{version}_{query}_{search_mode}_{page_size}_{page}"
+    st.data_editor(
+        page_df,
+        num_rows="dynamic",
+        column_config={col: st.column_config.TextColumn(disabled=False) for col in columns},
+        key=editor_key,
+    )
+
+    if st.button("Сохранить изменения", key=f"save_page_{filename}"):
+        try:
+            count = apply_dictionary_changes(filename, columns, version, list(page_df.index), st.session_state[editor_key])
+        except ValueError as e:
+            st.error(str(e))
+            return
+        if count:
+            st.success(f"Сохранено изменённых строк: {count}")
+            st.rerun(scope="fragment")
+        st.info("Изменений нет")
+
+@st.fragment
 def edit_dictionary_ui(dict_name, config):
     filename = config["filename"]
     columns = config["columns"]
@@ -73,14 +385,16 @@ def edit_dictionary_ui(dict_name, config):
     
     path = os.path.join(base_dir, "dictionaries", filename)
     
+    # Справочник читается один раз на версию файла (общий кэш - не изменять на месте)
     try:
-        df = pd.read_csv(path, delimiter=";")
+        stat = os.stat(path)
+        df = _load_dictionary_version(path, (stat.st_mtime_ns, stat.st_size), None, None, True)
     except:
         df = pd.DataFrame(columns=columns)
     
     st.subheader(f"Редактирование справочника: {dict_name}")
     
-    tab1, tab2, tab3 = st.tabs(["Редактирование", "Импорт", "Экспорт"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Редактирование", "Импорт", "Экспорт", "История"])
     
     with tab1:
         with st.form(key=f"add_{filename}"):
@@ -92,7 +406,7 @@ def edit_dictionary_ui(dict_name, config):
                         df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
                         save_dictionary(filename, df, columns)
                         st.success("Значение добавлено!")
-                        st.rerun()
+                        st.rerun(scope="fragment")
             elif is_triple:
                 cols = st.columns(3)
                 new_values = []
@@ -102,13 +416,17 @@ def edit_dictionary_ui(dict_name, config):
                 
                 if st.form_submit_button("Добавить"):
                     if all(new_values):
-                        exists = (df[columns[0]] == new_values[0]).any()
+                        # Ключ записи - первый столбец (или несколько первых, key_columns)
+                        key_columns = config.get("key_columns", 1)
+                        exists = (df[columns[:key_columns]] == new_values[:key_columns]).all(axis=1).any()
                         if not exists:
                             new_row = {columns[i]: new_values[i] for i in range(3)}
                             df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
                             save_dictionary(filename, df, columns)
                             st.success("Запись добавлена!")
-                            st.rerun()
+                            st.rerun(scope="fragment")
+                        elif key_columns > 1:
+                            st.error("Такая запись уже существует!")
                         else:
                             st.error("Такое подразделение уже существует!")
             else:
@@ -124,18 +442,24 @@ def edit_dictionary_ui(dict_name, config):
                         df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
                         save_dictionary(filename, df, columns)
                         st.success("Значение добавлено!")
-                        st.rerun()
+                        st.rerun(scope="fragment")
 
         st.write("Текущие значения:")
         
-        if is_triple:
+        # Большие справочники редактируются по страницам
+        is_large = len(df) > LARGE_DICTIONARY_ROWS
+        if is_large:
+            paged_editor_ui(filename, columns)
+        elif is_triple:
             edited_df = st.data_editor(
                 df,
                 num_rows="dynamic",
                 column_config={
                     columns[0]: st.column_config.TextColumn(disabled=False),
                     columns[1]: st.column_config.TextColumn(disabled=False),
-                    columns[2]: st.column_config.TextColumn(disabled=False)
+                    # Третий столбец может быть числовым (например, численность)
+                    columns[2]: st.column_config.NumberColumn(disabled=False) if pd.api.types.is_numeric_dtype(df[columns[2]])
+                    else st.column_config.TextColumn(disabled=False)
                 }
             )
         elif len(columns) == 2 and not is_key_only:
@@ -158,7 +482,7 @@ def edit_dictionary_ui(dict_name, config):
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            if st.button("Сохранить изменения", key=f"save_{filename}"):
+            if not is_large and st.button("Сохранить изменения", key=f"save_{filename}"):
                 save_dictionary(filename, edited_df, columns)
                 st.success("Изменения сохранены!")
         with col2:
@@ -184,7 +508,7 @@ def edit_dictionary_ui(dict_name, config):
                 example_data = config.get("example_data", [])
                 if example_data:
                     save_dictionary(filename, example_data, columns)
-                    st.rerun()
+                    st.rerun(scope="fragment")
     
     with tab2:
         st.subheader("Импорт справочника")
@@ -194,8 +518,13 @@ def edit_dictionary_ui(dict_name, config):
         st.subheader("Экспорт справочника")
         st.info("Скачайте текущий справочник в CSV файл")
         export_dictionary(filename)
+    with tab4:
+        st.subheader("История изменений")
+        history_ui(filename)
 
+@st.cache_resource(show_spinner=False)
 def init_dictionaries():
+    """Создаёт недостающие справочники (один раз за время работы сервера)"""
     os.makedirs(os.path.join(base_dir, "dictionaries"), exist_ok=True)
     
     dictionaries_config = {
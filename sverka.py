@@ -0,0 +1,111 @@
+import pandas as pd
+
+from dengi import to_rubles
+from klyuchi import canonical, distinct, per_row
+
+# Сверка плана и факта отчётов по статьям затрат.
+# Строка отчёта, которая есть только в плане или только в факте, обычно означает,
+# что статья в двух файлах сопоставлена по-разному: при объединении плана и факта
+# недостающая сторона молча становится нулём. Сверка находит такие статьи
+# (разность множеств ключей статей по хэш-индексу) и ищет причину по исходным
+# статьям БУ. Работает по базе агрегатов (otchety.run_plan) - по различным
+# парам статей БУ и УУ, а не по строкам файлов, поэтому выполняется при каждом
+# формировании отчёта.
+# Модуль не зависит от Streamlit.
+
+ITEM_COLUMNS = ["Подраздел", "Статья затрат УУ"]
+SIDES = {"План": "Факт", "Факт": "План"}
+# "в плане", "в факте"
+SIDE_LOCATIVE = {"План": "плане", "Факт": "факте"}
+
+ONLY_IN = {"План": "Только в плане", "Факт": "Только в факте"}
+NOT_IN_REPORT = "Нет в отчёте"
+RECONCILIATION_COLUMNS = ["Расхождение", "Подраздел", "Статья затрат УУ", "План", "Факт", "Статьи затрат БУ", "Причина"]
+
+# Сколько исходных статей БУ перечислять для строки сверки
+MAX_SOURCE_ITEMS = 5
+
+def _canonical(values):
+    """Канонические написания столбца (klyuchi.canonical), по одному на различное значение"""
+    codes, uniques = distinct(values)
+    return per_row(codes, [canonical(value) for value in uniques], "")
+
+def _sources(rows, side):
+    """Исходные статьи БУ строк базы: крупные суммы первыми"""
+    amounts = rows.groupby("Статья затрат БУ", sort=False)[side].sum().abs().sort_values(ascending=False, kind="stable")
+    names = [name for name in amounts.index if name != ""]
+    text = ", ".join(f"«{name}»" for name in names[:MAX_SOURCE_ITEMS])
+    if len(names) > MAX_SOURCE_ITEMS:
+        text += f" и ещё {len(names) - MAX_SOURCE_ITEMS}"
+    return names, text
+
+def reconcile(base_df, normalize):
+    """
+    Статьи отчёта, которые есть только в плане или только в факте, и строки без статьи УУ
+    (в отчёт они не попадают). base_df - база агрегатов в копейках, normalize - сопоставление
+    статей отчёта (otchety.normalize_cost_items или normalize_admin_cost_items).
+    Возвращает таблицу RECONCILIATION_COLUMNS с суммами в рублях (пустую, если расхождений нет).
+    """
+    rows = base_df.copy()
+    rows["Статья затрат БУ"] = rows["Статья затрат БУ"].fillna("")
+    unmapped = (rows["Статья затрат УУ"].isna() | (rows["Статья затрат УУ"] == "")).to_numpy()
+    rows = normalize(rows)
+    result = []
+
+    # Строки без статьи УУ: статья БУ не найдена в справочнике БУ -> УУ
+    if unmapped.any():
+        lost = rows[unmapped].groupby("Статья затрат БУ", sort=False)[list(SIDES)].sum()
+        for bu, amounts in lost.iterrows():
+            if bu == "":
+                cause = "Строки без статьи затрат БУ и УУ не попали в отчёт"
+            else:
+                cause = (f"Статья БУ «{bu}» не сопоставлена со статьёй УУ - строки не попали в отчёт. "
+                         "Проверьте справочник «Статьи затрат (БУ->УУ)»")
+            result.append({
+                "Расхождение": NOT_IN_REPORT, "Подраздел": "", "Статья затрат УУ": "",
+                "План": amounts["План"], "Факт": amounts["Факт"], "Статьи затрат БУ": f"«{bu}»" if bu else "", "Причина": cause,
+            })
+
+    rows = rows[~unmapped]
+    totals = rows.groupby(ITEM_COLUMNS, sort=False)[list(SIDES)].sum()
+    # Статьи отчёта с ненулевой суммой на каждой стороне; расхождения - разность множеств
+    present = {side: totals.index[totals[side] != 0] for side in SIDES}
+    item_keys = _canonical(rows["Статья затрат УУ"])
+    bu_keys = _canonical(rows["Статья затрат БУ"])
+
+    for side, other in SIDES.items():
+        only = present[side].difference(present[other], sort=False)
+        if only.empty:
+            continue
+        on_side = rows[side].to_numpy() != 0
+        on_other = rows[other].to_numpy() != 0
+        # Статьи другой стороны по каноническому написанию статьи УУ и по исходной статье БУ
+        other_items = dict(zip(item_keys[on_other], rows["Статья затрат УУ"].to_numpy()[on_other]))
+        other_by_bu = {}
+        for bu, item in zip(bu_keys[on_other], rows["Статья затрат УУ"].to_numpy()[on_other]):
+            other_by_bu.setdefault(bu, []).append(item)
+
+        side_rows = rows[on_side]
+        groups = side_rows.groupby(ITEM_COLUMNS, sort=False).indices
+        for key in only:
+            item_rows = side_rows.iloc[groups[key]]
+            names, sources = _sources(item_rows, side)
+            item = key[1]
+            spelled = other_items.get(canonical(item))
+            moved = [(bu, other_item) for bu in names for other_item in dict.fromkeys(other_by_bu.get(canonical(bu), []))
+                     if other_item != item]
+            if spelled is not None and spelled != item:
+                cause = f"В {SIDE_LOCATIVE[other]} статья записана как «{spelled}»"
+            elif moved:
+                cause = "; ".join(f"Статья БУ «{bu}» в {SIDE_LOCATIVE[other]} отнесена к статье «{other_item}»"
+                                  for bu, other_item in moved[:MAX_SOURCE_ITEMS])
+            else:
+                cause = f"Статьи нет в {SIDE_LOCATIVE[other]}"
+            result.append({
+                "Расхождение": ONLY_IN[side], "Подраздел": key[0], "Статья затрат УУ": item,
+                "План": totals.at[key, "План"], "Факт": totals.at[key, "Факт"], "Статьи затрат БУ": sources, "Причина": cause,
+            })
+
+    reconciliation = pd.DataFrame(result, columns=RECONCILIATION_COLUMNS)
+    reconciliation[list(SIDES)] = to_rubles(reconciliation[list(SIDES)].astype("int64"))
+    return reconciliation
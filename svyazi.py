@@ -0,0 +1,91 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from klyuchi import distinct
+
+# Сквозная таблица справочников номенклатуры.
+# Номенклатурная группа -> Бизнес-направление -> Контрагент и Номенклатурная
+# группа -> Вид услуг сводятся в одну таблицу с ключом по номенклатурной группе.
+# Таблица строится один раз на набор версий справочников (загруженные справочники
+# кэшируются, поэтому новая версия любого из них - новый объект и новая таблица),
+# и производные столбцы файла заполняются одним поиском по ключу.
+# При построении отмечаются разорванные связи (например, бизнес-направление без контрагента).
+# Модуль не зависит от Streamlit.
+
+CLOSURE_COLUMNS = ["Бизнес-направление", "Вид услуг", "Контрагенты"]
+# Бизнес-направление строк без номенклатурной группы
+MANAGEMENT_BUSINESS = "управление"
+
+_lock = threading.Lock()
+_cache = {"sources": None, "closure": None}
+
+def build_closure(nomen_to_business, nomen_to_service_type, business_to_counterparty):
+    """
+    Сквозная таблица (индекс - номенклатурная группа, столбцы CLOSURE_COLUMNS)
+    и таблица разорванных связей (Справочник, Значение, Проблема).
+    """
+    business = pd.Series(nomen_to_business, dtype=object)
+    service_type = pd.Series(nomen_to_service_type, dtype=object)
+    business = business[business.index.notna()]
+    service_type = service_type[service_type.index.notna()]
+    keys = business.index.union(service_type.index)
+
+    closure = pd.DataFrame(index=keys)
+    closure["Бизнес-направление"] = business[~business.index.duplicated(keep="last")].reindex(keys)
+    closure["Вид услуг"] = service_type[~service_type.index.duplicated(keep="last")].reindex(keys)
+    closure["Контрагенты"] = closure["Бизнес-направление"].map(business_to_counterparty)
+
+    problems = []
+    def flag(dictionary, values, problem):
+        for value in values:
+            problems.append({"Справочник": dictionary, "Значение": value, "Проблема": problem})
+
+    flag("Номенклатура -> Бизнес", keys[closure["Бизнес-направление"].isna()], "нет бизнес-направления")
+    flag("Номенклатура -> Вид услуг", keys[closure["Вид услуг"].isna()], "нет вида услуг")
+    no_counterparty = closure.loc[closure["Бизнес-направление"].notna() & closure["Контрагенты"].isna(), "Бизнес-направление"]
+    flag("Бизнес -> Контрагент", sorted(no_counterparty.unique()), "нет контрагента")
+    if pd.isna(business_to_counterparty.get(MANAGEMENT_BUSINESS)):
+        flag("Бизнес -> Контрагент", [MANAGEMENT_BUSINESS], "нет контрагента для строк без номенклатурной группы")
+
+    return closure, pd.DataFrame(problems, columns=["Справочник", "Значение", "Проблема"])
+
+def closure_for(refs):
+    """Сквозная таблица, разорванные связи и массив значений для поиска (строятся один раз на версии справочников)"""
+    sources = (refs["nomen_to_business"], refs["nomen_to_service_type"], refs["business_to_counterparty"])
+    with _lock:
+        cached = _cache["sources"]
+        if cached is not None and all(a is b for a, b in zip(cached, sources)):
+            return _cache["closure"]
+
+    closure, problems = build_closure(*sources)
+    # Последняя пустая строка - результат для ненайденных ключей
+    values = np.vstack([closure.to_numpy(dtype=object), np.full((1, len(CLOSURE_COLUMNS)), np.nan, dtype=object)])
+    built = (closure, problems, values)
+    with _lock:
+        _cache["sources"] = sources
+        _cache["closure"] = built
+    return built
+
+def broken_links(refs):
+    """Разорванные связи справочников номенклатуры (Справочник, Значение, Проблема)"""
+    return closure_for(refs)[1]
+
+def lookup(nomen_values, refs, factor=None):
+    """
+    Производные столбцы (CLOSURE_COLUMNS) для столбца номенклатурных групп - одним поиском по различным ключам.
+    factor - готовое разложение столбца (klyuchi.distinct).
+    """
+    closure, _, values = closure_for(refs)
+    nomen_values = pd.Series(nomen_values)
+    # Ключ ищется один раз на различное значение, строки получают результат через коды
+    codes, uniques = factor if factor is not None else distinct(nomen_values)
+    positions = np.append(closure.index.get_indexer(uniques), -1)[codes]
+    rows = values[positions]
+
+    # Строки без номенклатурной группы относятся к управлению
+    empty = nomen_values.isna().to_numpy()
+    if empty.any():
+        rows[empty] = [MANAGEMENT_BUSINESS, np.nan, refs["business_to_counterparty"].get(MANAGEMENT_BUSINESS, np.nan)]
+    return pd.DataFrame(rows, columns=CLOSURE_COLUMNS, index=nomen_values.index)
@@ -0,0 +1,20 @@
+import pandas as pd
+
+import dengi
+
+def test_to_kopecks_is_exact():
+    kopecks = dengi.to_kopecks([0.1, 0.2, "1234.56", -7.5, 10])
+    assert kopecks.tolist() == [10, 20, 123456, -750, 1000]
+    # 0.1 + 0.2 в копейках складываются без погрешности float
+    assert kopecks[0] + kopecks[1] == 30
+
+def test_non_numeric_amounts_are_missing():
+    values = pd.Series([None, "", "abc", float("inf"), "1,5", 5])
+    assert dengi.to_kopecks(values).isna().tolist() == [True, True, True, True, True, False]
+    # Пустые значения ошибкой не считаются, нечисловые - считаются
+    assert dengi.invalid_amounts(values).tolist() == [False, True, True, True, True, False]
+    assert dengi.amount_column(values).tolist() == [0, 0, 0, 0, 0, 500]
+
+def test_to_rubles_round_trip():
+    values = pd.Series([1234.56, -0.01, 0.0])
+    assert dengi.to_rubles(dengi.amount_column(values)).tolist() == values.tolist()
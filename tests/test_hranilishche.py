@@ -0,0 +1,77 @@
+import time
+
+import pandas as pd
+import pytest
+
+import hranilishche
+import jobs
+
+OWNER = "test-session"
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(hranilishche, "SPILL_DIR", str(tmp_path))
+    yield
+    hranilishche.release_owner(OWNER)
+
+def frame(rows):
+    return pd.DataFrame({"Филиал": [f"Филиал {i}" for i in range(rows)], "Сумма": range(rows)})
+
+def test_values_over_budget_spill_to_disk(monkeypatch, tmp_path):
+    first, second = frame(1000), b"x" * 10000
+    monkeypatch.setattr(hranilishche, "MEMORY_BUDGET", hranilishche._size(second))
+    first_id = hranilishche.put(OWNER, first)
+    second_id = hranilishche.put(OWNER, second)
+
+    # Давно не использованная таблица сброшена на диск и читается обратно без потерь
+    assert hranilishche._items[first_id].value is None
+    assert list(tmp_path.iterdir())
+    assert hranilishche.get(first_id).equals(first)
+    assert hranilishche.get(second_id) == second
+
+def test_release_owner_removes_memory_and_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(hranilishche, "MEMORY_BUDGET", 0)
+    item_ids = [hranilishche.put(OWNER, frame(100)) for _ in range(3)]
+    hranilishche.release_owner(OWNER)
+    assert all(hranilishche.get(item_id) is None for item_id in item_ids)
+    assert not list(tmp_path.iterdir())
+
+def test_expired_values_are_removed(monkeypatch):
+    item_id = hranilishche.put(OWNER, b"x")
+    hranilishche._items[item_id].last_used = time.time() - hranilishche.ITEM_TTL - 1
+    assert hranilishche.get(item_id) is None
+
+def test_only_large_values_are_stored():
+    large = frame(10000)
+    stored = hranilishche.put_values(OWNER, {"data": large, "errors": ["ошибка"], "file": b"x"})
+    assert isinstance(stored["data"], hranilishche.Ref)
+    assert stored["errors"] == ["ошибка"] and stored["file"] == b"x"
+    assert hranilishche.get_values(stored)["data"].equals(large)
+    hranilishche.release_values(stored)
+    assert hranilishche.get_values(stored) is None
+
+def wait(job_id):
+    job = jobs.get(job_id)
+    deadline = time.time() + 10
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+def test_job_result_goes_through_store():
+    large = frame(10000)
+    job = wait(jobs.submit(OWNER, "Отчёт", lambda job, df: {"data": df, "rows": len(df)}, large))
+    assert job.status == jobs.DONE
+    assert isinstance(job._result["data"], hranilishche.Ref)
+    assert job.result["data"].equals(large) and job.result["rows"] == 10000
+
+    jobs.discard(job.id)
+    assert jobs.get(job.id) is None
+    assert hranilishche.get(job._result["data"].id) is None
+
+def test_failed_job_keeps_error():
+    def fail(job):
+        raise ValueError("нет данных")
+
+    job = wait(jobs.submit(OWNER, "Отчёт", fail))
+    assert job.status == jobs.FAILED and job.error == "нет данных"
+    jobs.discard(job.id)
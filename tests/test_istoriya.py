@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+import istoriya
+
+COLUMNS = ["Ключ", "Значение"]
+
+def frame(*keys):
+    return pd.DataFrame([[key, key.upper()] for key in keys], columns=COLUMNS)
+
+def rows(df):
+    return sorted(map(tuple, df.astype(str).to_numpy().tolist()))
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(istoriya, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(istoriya, "_tips", {})
+    return str(tmp_path / "spravochnik.csv")
+
+def test_reconstruct_each_saved_version(path):
+    v1 = istoriya.record(path, None, frame("a", "b"))
+    v2 = istoriya.record(path, frame("a", "b"), frame("a", "c"))
+    v3 = istoriya.record(path, frame("a", "c"), frame("a", "c", "d"))
+    assert rows(istoriya.reconstruct(path, v1)) == rows(frame("a", "b"))
+    assert rows(istoriya.reconstruct(path, v2)) == rows(frame("a", "c"))
+    assert rows(istoriya.reconstruct(path, v3)) == rows(frame("a", "c", "d"))
+
+def test_save_over_version_missing_from_log(path):
+    # Справочник изменили в обход журнала ({a,b} -> {a,c}), затем сохранили {a,c,d}
+    v1 = istoriya.record(path, None, frame("a", "b"))
+    v2 = istoriya.record(path, frame("a", "c"), frame("a", "c", "d"))
+    assert rows(istoriya.reconstruct(path, v1)) == rows(frame("a", "b"))
+    assert rows(istoriya.reconstruct(path, v2)) == rows(frame("a", "c", "d"))
+
+def test_log_appended_by_another_process(path):
+    v1 = istoriya.record(path, None, frame("a", "b"))
+    # Запись другой копии приложения: кэш конца журнала этой копии устарел
+    other = istoriya._entry(istoriya.content_hash(frame("a", "c")), v1, COLUMNS, "")
+    other["added"], other["removed"] = [["c", "C"]], [["b", "B"]]
+    with open(istoriya._log_path(path), "a", encoding="utf-8") as f:
+        f.write(istoriya.json.dumps(other, ensure_ascii=False) + "\n")
+    v3 = istoriya.record(path, frame("a", "c"), frame("a", "c", "d"))
+    assert [entry["version"] for entry in istoriya.history(path)][:2] == [v3, other["version"]]
+    assert rows(istoriya.reconstruct(path, v3)) == rows(frame("a", "c", "d"))
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+import nabory
+import povtory
+
+COLUMNS = povtory.KEY_COLUMNS["income"]
+PERIOD = ("income", "Факт", "Январь", 2025)
+
+def frame(*numbers):
+    return pd.DataFrame({col: [float(n) if col == "Сумма" else f"{col} {n}" for n in numbers] for col in COLUMNS})
+
+@pytest.fixture(autouse=True)
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(nabory, "DATASETS_DIR", str(tmp_path / "datasets"))
+    monkeypatch.setattr(povtory, "ROW_INDEX_DIR", str(tmp_path / "row_index"))
+
+def publish(df, skip_duplicates=False, period=PERIOD):
+    kind, data_type, month, year = period
+    return povtory.publish(df, kind, data_type, month, year, "file.xlsx", skip_duplicates)
+
+def test_repeated_rows_are_matched_by_count():
+    publish(frame(1, 1, 2))
+    mask, summary = povtory.find_duplicates(frame(1, 1, 1, 2, 2, 3), *PERIOD)
+    # Строка 1 была загружена дважды, строка 2 - один раз
+    assert mask.tolist() == [True, True, False, True, False, False]
+    assert summary["rows"] == 3
+
+def test_skip_duplicates_publishes_only_new_rows():
+    first, _ = publish(frame(1, 2))
+    dataset, summary = publish(frame(1, 2, 3), skip_duplicates=True)
+    assert summary["skipped"] and summary["datasets"] == [first["id"]]
+    assert len(nabory.load_table(dataset["id"])) == 1
+    dataset, summary = publish(frame(1, 2, 3), skip_duplicates=True)
+    assert dataset is None and summary["rows"] == 3
+
+def test_other_months_are_not_duplicates():
+    publish(frame(1))
+    mask, summary = povtory.find_duplicates(frame(1), "income", "Факт", "Февраль", 2025)
+    assert not mask.any() and summary is None
+
+def test_fingerprints_outlive_dataset_retention(monkeypatch):
+    monkeypatch.setattr(nabory, "MAX_DATASETS", 1)
+    publish(frame(1, 2))
+    publish(frame(5), period=("income", "Факт", "Февраль", 2025))
+    assert len(nabory.list_datasets()) == 1
+    mask, _ = povtory.find_duplicates(frame(1, 2), *PERIOD)
+    assert mask.all()
@@ -0,0 +1,68 @@
+import io
+
+import pandas as pd
+import pytest
+
+import proverka
+from benchmarks import generate_data
+
+REFS = generate_data.load_reference_data()
+GENERATORS = {"income": generate_data.generate_income, "expense": generate_data.generate_expense}
+
+def workbook(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def same(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return a.reset_index(drop=True).equals(b.reset_index(drop=True))
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Несколько частей на файл: проверяется объединение результатов частей
+    monkeypatch.setattr(proverka, "CHUNK_ROWS", 300)
+
+@pytest.mark.parametrize("kind", ["income", "expense"])
+def test_check_file_matches_whole_table_check(kind):
+    df = GENERATORS[kind](1000, REFS, 0.05, 7)
+    df["Сумма"] = df["Сумма"].astype(object)
+    df.loc[5, "Сумма"] = "12,5"
+    content = workbook(df)
+    expected = proverka.check_dataframe(pd.read_excel(io.BytesIO(content)), kind, REFS)
+
+    result = proverka.check_file(io.BytesIO(content), kind, REFS, max_errors=10 ** 9)
+    assert result["errors"] and result["errors"] == expected["errors"]
+    for key in ["data", "preview", "normalized", "suggestions", "error_frame", "source"]:
+        assert same(result[key], expected[key]), key
+    assert result["rows"] == 1000 and result["complete"] and not result["stopped"]
+
+def test_clean_file_returns_processed_data():
+    df = generate_data.generate_income(1000, REFS, 0.0, 7)
+    # Строки с ошибками генератора убираем - остаётся файл без ошибок
+    found = proverka.check_dataframe(df.copy(), "income", REFS)
+    df = df.drop(df.index[found["error_frame"]["Позиция"].unique()]).reset_index(drop=True)
+    content = workbook(df)
+    expected = proverka.check_dataframe(pd.read_excel(io.BytesIO(content)), "income", REFS)
+
+    result = proverka.check_file(io.BytesIO(content), "income", REFS)
+    assert not result["errors"] and result["error_frame"] is None
+    assert result["data"].equals(expected["data"])
+
+def test_reading_stops_after_max_errors():
+    df = generate_data.generate_expense(1000, REFS, 0.3, 7)
+    content = workbook(df)
+    expected = proverka.check_dataframe(pd.read_excel(io.BytesIO(content)), "expense", REFS)
+
+    result = proverka.check_file(io.BytesIO(content), "expense", REFS, max_errors=50)
+    assert result["stopped"] and not result["complete"] and result["rows"] < 1000
+    assert len(result["errors"]) == 50
+    # Ошибки по строкам - те же, что в начале проверки всего файла
+    row_errors = [error for error in result["errors"] if error.startswith("Ошибка в строке ")]
+    assert row_errors == [error for error in expected["errors"] if error.startswith("Ошибка в строке ")][:len(row_errors)]
+
+def test_missing_columns_are_reported_from_first_chunk():
+    content = workbook(pd.DataFrame({"Филиал": ["г. Москва"] * 10}))
+    result = proverka.check_file(io.BytesIO(content), "income", REFS)
+    assert result["missing_columns"] and result["rows"] == 10 and result["data"] is None
@@ -0,0 +1,58 @@
+import pandas as pd
+
+import raspredelenie
+from svyazi import MANAGEMENT_BUSINESS
+
+def income(*rows):
+    return pd.DataFrame(list(rows), columns=["Филиал", "Бизнес-направление", "Сумма"])
+
+def expense(*rows):
+    return pd.DataFrame(list(rows), columns=["Филиал", "Бизнес-направление", "Статья затрат УУ", "Сумма"])
+
+def test_management_is_not_a_target():
+    allocation, unallocated = raspredelenie.allocate(
+        income(("A", MANAGEMENT_BUSINESS, 100), ("A", "X", 300)),
+        expense(("A", MANAGEMENT_BUSINESS, "Аренда", 1000)),
+        {},
+    )
+    assert unallocated.empty
+    assert (allocation["Бизнес-направление"] != MANAGEMENT_BUSINESS).all()
+    assert allocation.set_index("Бизнес-направление")["Сумма"].to_dict() == {"X": 1000}
+
+def test_line_totals_are_preserved():
+    allocation, unallocated = raspredelenie.allocate(
+        income(("A", "X", 1), ("A", "Y", 1), ("A", "Z", 1), ("B", "X", 2), ("B", MANAGEMENT_BUSINESS, 5)),
+        expense(
+            ("A", MANAGEMENT_BUSINESS, "Аренда", 100),
+            ("A", MANAGEMENT_BUSINESS, "Связь", 7),
+            ("B", MANAGEMENT_BUSINESS, "Аренда", 33),
+            # Филиал без базы: делится по базе всей компании
+            ("C", MANAGEMENT_BUSINESS, "Аренда", 10),
+            ("A", "X", "Материалы", 50),
+        ),
+        {},
+    )
+    assert unallocated.empty
+    assert (allocation["Бизнес-направление"] != MANAGEMENT_BUSINESS).all()
+    # Распределение идёт по ячейкам-получателям, суммы статей сходятся с исходными до копейки
+    assert allocation.groupby("Статья затрат УУ")["Сумма"].sum().to_dict() == {"Аренда": 143, "Связь": 7}
+    # Расход филиала без базы распределён по ячейкам всех филиалов
+    assert set(allocation["Филиал"]) == {"A", "B"}
+
+def test_rounding_keeps_line_total():
+    allocation, _ = raspredelenie.allocate(
+        income(("A", "X", 1), ("A", "Y", 1), ("A", "Z", 1)),
+        expense(("A", MANAGEMENT_BUSINESS, "Аренда", 100)),
+        {},
+    )
+    # Округление по накопленным долям: 100 на три равные доли
+    assert sorted(allocation["Сумма"]) == [33, 33, 34]
+
+def test_line_without_any_base_stays_unallocated():
+    allocation, unallocated = raspredelenie.allocate(
+        income(("A", MANAGEMENT_BUSINESS, 100)),
+        expense(("A", MANAGEMENT_BUSINESS, "Аренда", 1000)),
+        {},
+    )
+    assert allocation.empty
+    assert unallocated["Сумма"].tolist() == [1000]
@@ -0,0 +1,38 @@
+import pandas as pd
+
+import sverka
+
+def base(*rows):
+    # Суммы в копейках
+    return pd.DataFrame(list(rows), columns=["Статья затрат БУ", "Статья затрат УУ", "План", "Факт"])
+
+def normalize(rows):
+    rows = rows.copy()
+    rows["Подраздел"] = "Раздел"
+    return rows
+
+def test_matching_items_have_no_discrepancies():
+    result = sverka.reconcile(base(("Аренда БУ", "Аренда", 100, 0), ("Аренда БУ", "Аренда", 0, 90)), normalize)
+    assert result.empty
+    assert list(result.columns) == sverka.RECONCILIATION_COLUMNS
+
+def test_differently_spelled_item_is_explained():
+    result = sverka.reconcile(base(("Аренда БУ", "Аренда", 10000, 0), ("Аренда БУ", "аренда ", 0, 9000)), normalize)
+    rows = result.set_index("Статья затрат УУ")
+    assert rows.at["Аренда", "Расхождение"] == sverka.ONLY_IN["План"]
+    assert rows.at["Аренда", "Причина"] == "В факте статья записана как «аренда »"
+    assert rows.at["аренда ", "Расхождение"] == sverka.ONLY_IN["Факт"]
+    # Суммы - в рублях
+    assert rows.at["Аренда", "План"] == 100.0 and rows.at["аренда ", "Факт"] == 90.0
+
+def test_moved_bu_item_is_explained():
+    result = sverka.reconcile(base(("Связь БУ", "Связь", 500, 0), ("Связь БУ", "Прочие", 0, 500)), normalize)
+    row = result[result["Статья затрат УУ"] == "Связь"].iloc[0]
+    assert row["Причина"] == "Статья БУ «Связь БУ» в факте отнесена к статье «Прочие»"
+    assert row["Статьи затрат БУ"] == "«Связь БУ»"
+
+def test_unmapped_rows_are_not_in_report():
+    result = sverka.reconcile(base(("Новая БУ", None, 250, 100), ("Аренда БУ", "Аренда", 100, 100)), normalize)
+    assert result["Расхождение"].tolist() == [sverka.NOT_IN_REPORT]
+    assert result[["План", "Факт"]].iloc[0].tolist() == [2.5, 1.0]
+    assert "«Новая БУ»" in result["Причина"].iloc[0]
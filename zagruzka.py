@@ -0,0 +1,31 @@
+from io import BytesIO
+
+import povtory
+from proverka import check_file
+
+# Загрузка файлов доходов и расходов: проверка всего файла и публикация набора данных.
+# Страницы сразу показывают проверку начала файла (proverka.check_preview), а весь
+# большой файл проверяется здесь, в фоновой задаче (jobs.py): индикатор показывает,
+# сколько строк проверено и сколько ошибок найдено.
+# Модуль не зависит от Streamlit.
+
+def publish_checked(result, kind, filename, data_type, month, year, skip_duplicates, dictionaries):
+    """
+    Публикует проверенные данные для страницы отчётов, если в файле нет ошибок.
+    Добавляет в результат duplicates (строки, загруженные ранее за тот же месяц) и dataset (описание набора или None).
+    """
+    data = result.pop("data")
+    if data is None:
+        return result
+    # Строки, которые уже есть в опубликованных наборах того же месяца, отмечаются или пропускаются
+    result["dataset"], result["duplicates"] = povtory.publish(data, kind, data_type, month, year, filename, skip_duplicates,
+                                                              dictionaries=dictionaries)
+    return result
+
+def check_upload_task(job, content, filename, kind, refs, data_type, month, year, skip_duplicates, dictionaries):
+    """Фоновая задача: проверка всего файла (content - содержимое файла) и публикация данных"""
+    def progress(fraction, rows, errors):
+        job.set_progress(fraction, f"проверено строк: {rows}, найдено ошибок: {errors}")
+
+    result = check_file(BytesIO(content), kind, refs, progress)
+    return publish_checked(result, kind, filename, data_type, month, year, skip_duplicates, dictionaries)